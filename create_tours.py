@@ -4,13 +4,14 @@ import sys
 import django
 
 # Add the project root to the Python path
-sys.path.append('/Users/shahinmammadov/Desktop/JLTECH/tourai/tourai_back')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Set up Django settings
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tourai_back.settings')
 django.setup()
 
-from users.models import User, Tour
+from users.models import User
+from users.tour_import import TourImporter
 from decimal import Decimal
 from datetime import date
 
@@ -206,17 +207,14 @@ tours = [
     }
 ]
 
-# Create tours
-created_count = 0
-for tour_data in tours:
-    try:
-        tour = Tour.objects.create(
-            agent=agent,
-            **tour_data
-        )
-        created_count += 1
-        print(f'Created: {tour.title} - {tour.destination} (${tour.price})')
-    except Exception as e:
-        print(f'Error creating tour {tour_data["title"]}: {e}')
+# Create tours in one batch; the external_id makes re-running the script update them instead of duplicating
+rows = (
+    (index, {**tour_data, 'external_id': f'sample-{index}'}, None)
+    for index, tour_data in enumerate(tours, start=1)
+)
+report = TourImporter(agent).run(rows)
 
-print(f'Successfully created {created_count} tours')
\ No newline at end of file
+for error in report.errors:
+    print(f'Error creating tour {tours[error["row"] - 1]["title"]}: {error["errors"]}')
+
+print(f'Successfully created {report.imported} tours')
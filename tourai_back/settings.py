@@ -49,6 +49,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so connections opened by any later middleware are timed too
+    'users.middleware.ConnectionTimingMiddleware',
+    'users.middleware.MetricsMiddleware',
+    'users.middleware.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'users.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'tourai_back.urls'
@@ -83,16 +88,96 @@ WSGI_APPLICATION = 'tourai_back.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'railway',
-        'USER': 'postgres',
-        'PASSWORD': 'AWhjXGSzyWxZonPmbFKwBXMVPzZgNSIJ',
-        'HOST': 'shinkansen.proxy.rlwy.net',
-        'PORT': '44747',
+def env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'postgresql')
+# ENGINE is Django's backend with connect timing added (users.db_backends), for the Server-Timing header
+
+if DB_ENGINE == 'sqlite':
+    # Local stand-in for development, tests and benchmarks
+    DATABASES = {
+        'default': {
+            'ENGINE': 'users.db_backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+            # Concurrent writers (e.g. `manage.py bench_chat`) wait for the lock instead of failing at once
+            'OPTIONS': {'timeout': 20},
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'users.db_backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'railway'),
+            'USER': os.getenv('DB_USER', 'postgres'),
+            'PASSWORD': os.getenv('DB_PASSWORD', 'AWhjXGSzyWxZonPmbFKwBXMVPzZgNSIJ'),
+            'HOST': os.getenv('DB_HOST', 'shinkansen.proxy.rlwy.net'),
+            'PORT': os.getenv('DB_PORT', '44747'),
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+                # TCP keepalives stop the proxy from silently dropping idle persistent connections
+                'keepalives': 1,
+                'keepalives_idle': 30,
+                'keepalives_interval': 10,
+                'keepalives_count': 3,
+            },
+            # Server-side cursors stream large exports; disable them behind a transaction-mode pooler
+            'DISABLE_SERVER_SIDE_CURSORS': env_bool('DB_DISABLE_SERVER_SIDE_CURSORS'),
+        }
+    }
+
+# Keep connections open between requests instead of paying a TCP+TLS+auth handshake each time.
+# Health checks make Django ping a reused connection once per request and reconnect if it died.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = env_bool('DB_CONN_HEALTH_CHECKS', True)
+
+# Optional in-process pool for ASGI deployments (PostgreSQL on Django 5.1+ with psycopg 3).
+# Elsewhere the persistent connections above are used; asking for the pool there is an error
+# rather than a setting that silently does nothing.
+DB_POOL = env_bool('DB_POOL')
+if DB_POOL:
+    import django
+    from django.core.exceptions import ImproperlyConfigured
+    if DB_ENGINE == 'sqlite' or django.VERSION < (5, 1):
+        raise ImproperlyConfigured(
+            f"DB_POOL needs PostgreSQL on Django 5.1+ (this is {DB_ENGINE} on Django {django.get_version()}); "
+            "unset it to use persistent connections (DB_CONN_MAX_AGE)"
+        )
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+    }
+
+# Read replicas: comma-separated hosts (host or host:port) for PostgreSQL, file paths for SQLite.
+# Exposed as aliases replica_1, replica_2, ... and used by users.routers.ReplicaRouter.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if DB_ENGINE == 'sqlite':
+        DATABASES[alias]['NAME'] = replica.strip()
+    else:
+        host, _, port = replica.strip().partition(':')
+        DATABASES[alias]['HOST'] = host
+        DATABASES[alias]['PORT'] = port or DATABASES['default']['PORT']
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['users.routers.ReplicaRouter']
+
+# Replicas lagging more than this many seconds behind are skipped in favour of the primary
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '10'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', '5'))
+# How long a client's reads of models it just wrote stay pinned to the primary
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '15'))
+
+# Rows fetched per round trip when streaming large querysets (see users.db.iterate_queryset)
+DB_EXPORT_CHUNK_SIZE = int(os.getenv('DB_EXPORT_CHUNK_SIZE', '2000'))
 
 
 # Password validation
@@ -114,6 +199,24 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Sign-in looks users up by email in one indexed query; username login still works for the admin
+AUTHENTICATION_BACKENDS = [
+    'users.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+PASSWORD_HASHERS = [
+    'users.hashers.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# PBKDF2 work factor; unset uses Django's default. Tune with `manage.py bench_signin`.
+PASSWORD_HASHER_ITERATIONS = int(os.getenv('PASSWORD_HASHER_ITERATIONS', '0')) or None
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -140,16 +243,32 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     )
 }
 
+# Shared cache. User invalidations (users.authentication) live here: token claims are only trusted when this
+# cache is shared by all processes (e.g. Redis or FileBasedCache), otherwise users are reloaded.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+# Backends that cull past MAX_ENTRIES (300 by default) would drop invalidations early
+if CACHES['default']['BACKEND'].rsplit('.', 2)[-2] in ('locmem', 'filebased', 'db'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '100000'))}
+
+# Seconds a user row stays in the per-process cache used by ClaimsJWTAuthentication
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '30'))
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
+    'TOKEN_REFRESH_SERIALIZER': 'users.tokens.ClaimsTokenRefreshSerializer',
 }
 
 # CORS settings
@@ -163,3 +282,101 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+
+# Chat LLM: 'openai' uses the agent with ChatOpenAI, 'mock' uses the offline keyword-based responses
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+
+# OpenAI-compatible endpoint, e.g. the local stub from `manage.py run_llm_stub` (http://127.0.0.1:8765/v1)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
+# LLM resilience (users.llm_resilience): per-call timeout, whole-chat deadline, retries with
+# jittered exponential backoff, hedged second requests after the recent p95 (or LLM_HEDGE_AFTER_MS
+# until enough calls were seen) and a circuit breaker that sends chats to the mock responder.
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '20'))
+LLM_CHAT_DEADLINE = float(os.getenv('LLM_CHAT_DEADLINE', '45'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BACKOFF = float(os.getenv('LLM_RETRY_BACKOFF', '0.5'))
+LLM_HEDGE = env_bool('LLM_HEDGE', False)
+LLM_HEDGE_AFTER_MS = float(os.getenv('LLM_HEDGE_AFTER_MS', '3000'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', '30'))
+
+# Agent execution budget (users.agent_budget): the agent stops at the first limit reached and
+# answers from what it found, either with one LLM call ('generate') or a fixed message ('force').
+# AGENT_ENOUGH_TOURS stops as soon as searches found that many distinct tours. 0 disables a limit.
+AGENT_MAX_ITERATIONS = int(os.getenv('AGENT_MAX_ITERATIONS', '4'))
+AGENT_MAX_TOOL_CALLS = int(os.getenv('AGENT_MAX_TOOL_CALLS', '6'))
+AGENT_MAX_SECONDS = float(os.getenv('AGENT_MAX_SECONDS', '30'))
+AGENT_ENOUGH_TOURS = int(os.getenv('AGENT_ENOUGH_TOURS', '5'))
+AGENT_EARLY_STOPPING = os.getenv('AGENT_EARLY_STOPPING', 'generate')
+
+# Run the tool calls the model requests in one agent step concurrently (users.agent_executor)
+# on a pool of AGENT_TOOL_WORKERS threads; off runs them one after another.
+AGENT_PARALLEL_TOOLS = env_bool('AGENT_PARALLEL_TOOLS', True)
+AGENT_TOOL_WORKERS = int(os.getenv('AGENT_TOOL_WORKERS', '4'))
+
+# Ranking of the tours found in one chat turn (users.ranking): each search tool contributes its first
+# RANKING_CANDIDATE_POOL tour IDs, and the RANKING_TOP_K best across all tool calls are shown.
+RANKING_CANDIDATE_POOL = int(os.getenv('RANKING_CANDIDATE_POOL', '50'))
+RANKING_TOP_K = int(os.getenv('RANKING_TOP_K', '5'))
+
+# Semantic tour search (users.embeddings): hashed text embeddings of EMBEDDING_DIM float32 values;
+# each process checks for new or changed embeddings at most every EMBEDDING_REFRESH_INTERVAL seconds.
+# Every process holds all vectors in memory: about tours x EMBEDDING_DIM x 4 bytes each.
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '512'))
+EMBEDDING_REFRESH_INTERVAL = float(os.getenv('EMBEDDING_REFRESH_INTERVAL', '10'))
+
+# Precomputed similar tours (users.similarity): SIMILAR_TOURS_K neighbours per tour, rebuilt by
+# `manage.py compute_similar_tours` and updated incrementally when a tour is saved.
+SIMILAR_TOURS_K = int(os.getenv('SIMILAR_TOURS_K', '10'))
+SIMILAR_TOURS_REFRESH_ON_SAVE = env_bool('SIMILAR_TOURS_REFRESH_ON_SAVE', True)
+
+# Personalized Discover feed (users.personalization): saved and recommended tours lose half their
+# weight every AFFINITY_HALF_LIFE_DAYS; ordering=personalized re-ranks the newest PERSONALIZED_WINDOW matches.
+AFFINITY_HALF_LIFE_DAYS = float(os.getenv('AFFINITY_HALF_LIFE_DAYS', '60'))
+PERSONALIZED_WINDOW = int(os.getenv('PERSONALIZED_WINDOW', '120'))
+
+# In-process catalog caches (users.catalog, e.g. the facet index) check for tour changes made by
+# other processes at most every CATALOG_REFRESH_INTERVAL seconds.
+CATALOG_REFRESH_INTERVAL = float(os.getenv('CATALOG_REFRESH_INTERVAL', '10'))
+
+# Tour change feed (users.changes, /api/tours/changes/): entries are served once they are
+# TOUR_CHANGES_SETTLE_SECONDS old (longer than any tour write transaction plus replica lag), and
+# `manage.py compact_tour_changes` merges each tour's entries older than TOUR_CHANGES_COMPACT_AFTER_DAYS.
+TOUR_CHANGES_SETTLE_SECONDS = float(os.getenv('TOUR_CHANGES_SETTLE_SECONDS', '5'))
+TOUR_CHANGES_COMPACT_AFTER_DAYS = float(os.getenv('TOUR_CHANGES_COMPACT_AFTER_DAYS', '7'))
+
+# Recommendation impressions (users.impressions) are buffered in each process and written every
+# IMPRESSIONS_FLUSH_INTERVAL seconds or per IMPRESSIONS_BATCH_SIZE rows; past IMPRESSIONS_BUFFER_SIZE
+# unwritten rows (e.g. while the database is unreachable) the oldest are dropped.
+IMPRESSIONS_FLUSH_INTERVAL = float(os.getenv('IMPRESSIONS_FLUSH_INTERVAL', '5'))
+IMPRESSIONS_BATCH_SIZE = int(os.getenv('IMPRESSIONS_BATCH_SIZE', '500'))
+IMPRESSIONS_BUFFER_SIZE = int(os.getenv('IMPRESSIONS_BUFFER_SIZE', '10000'))
+
+# Exchange rates (users.currency): units of each currency per US dollar, reloaded when the file changes.
+# After updating it run `manage.py refresh_prices` so price filters use the new rates.
+FX_RATES_FILE = os.getenv('FX_RATES_FILE', str(BASE_DIR / 'users' / 'fx_rates.json'))
+
+# Record/replay LLM traffic (users.llm_cassette): a JSON Lines file and 'record' or 'replay'
+LLM_CASSETTE = os.getenv('LLM_CASSETTE', '')
+LLM_CASSETTE_MODE = os.getenv('LLM_CASSETTE_MODE', 'replay')
+
+# On-demand request profiling for staff users (users.middleware.ProfilingMiddleware).
+# Send `X-Profile: 1` or set a sample rate; profiles are listed under "Request profiles" in the admin.
+PROFILING_ENABLED = env_bool('PROFILING_ENABLED', DEBUG)
+PROFILING_HEADER = 'X-Profile'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_MODE = os.getenv('PROFILING_MODE', 'sampler')  # 'sampler' (collapsed stacks) or 'cprofile'
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '2'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+# Newest profiles kept (older ones and their files are deleted as new ones are saved); 0 keeps all
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '200'))
+
+# Metrics (users.metrics), scraped from /metrics. Under gunicorn point METRICS_DIR at a directory
+# shared by the workers (cleared on deploy) so a scrape sees every process.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+# When set, scrapes must send `Authorization: Bearer <METRICS_TOKEN>`; otherwise only clients at
+# METRICS_ALLOWED_IPS may scrape (behind a reverse proxy every client looks local: set the token).
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
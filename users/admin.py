@@ -1,6 +1,12 @@
+import os
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Tour, TourCompany, Conversation, ChatMessage, SavedTour
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+from .models import User, Tour, TourCompany, Conversation, ChatMessage, SavedTour, RequestProfile, Country
 
 
 @admin.register(TourCompany)
@@ -42,17 +48,17 @@ class CustomUserAdmin(UserAdmin):
 @admin.register(Tour)
 class TourAdmin(admin.ModelAdmin):
     list_display = ('title', 'agent', 'destination', 'hotel_name', 'formatted_price', 'meal_plan', 'flight_type', 'start_date', 'end_date', 'visa_required', 'is_active', 'created_at')
-    list_filter = ('meal_plan', 'flight_type', 'visa_required', 'is_active', 'start_date', 'created_at', 'agent__user_type')
-    search_fields = ('title', 'destination', 'hotel_name', 'description', 'agent__username', 'agent__email')
+    list_filter = ('currency', 'meal_plan', 'flight_type', 'visa_required', 'is_active', 'start_date', 'created_at', 'agent__user_type')
+    search_fields = ('title', 'destination', 'hotel_name', 'description', 'external_id', 'agent__username', 'agent__email')
     readonly_fields = ('created_at', 'updated_at')
     date_hierarchy = 'created_at'
     
     fieldsets = (
         ('Basic Information', {
-            'fields': ('agent', 'title', 'description')
+            'fields': ('agent', 'title', 'description', 'external_id')
         }),
         ('Tour Details', {
-            'fields': ('destination', 'hotel_name', 'price', 'start_date', 'end_date', 'visa_required', 'meal_plan', 'flight_type')
+            'fields': ('destination', 'hotel_name', 'price', 'currency', 'start_date', 'end_date', 'visa_required', 'meal_plan', 'flight_type')
         }),
         ('Status', {
             'fields': ('is_active',)
@@ -67,6 +73,15 @@ class TourAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('agent')
 
 
+@admin.register(Country)
+class CountryAdmin(admin.ModelAdmin):
+    # Countries are created by the tours that go there; new ones outside users.geography need a region here
+    list_display = ('name', 'region', 'continent')
+    list_editable = ('region', 'continent')
+    list_filter = ('continent', 'region')
+    search_fields = ('name',)
+
+
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'title', 'message_count', 'is_active', 'created_at', 'updated_at')
@@ -113,3 +128,53 @@ class SavedTourAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'tour', 'tour__agent')
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'cpu_ms', 'sql_count', 'sql_ms', 'user', 'mode')
+    list_filter = ('mode', 'method', 'status_code', 'created_at')
+    search_fields = ('path', 'request_id', 'user__username')
+    date_hierarchy = 'created_at'
+    readonly_fields = (
+        'request_id', 'method', 'path', 'status_code', 'user', 'mode', 'duration_ms', 'cpu_ms',
+        'sql_count', 'sql_ms', 'samples', 'download', 'top_frames_table', 'slowest_queries_table', 'created_at'
+    )
+    exclude = ('top_frames', 'slowest_queries', 'profile_path')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        return [
+            path('<int:object_id>/download/', self.admin_site.admin_view(self.download_view),
+                 name='users_requestprofile_download'),
+        ] + super().get_urls()
+    
+    def download_view(self, request, object_id):
+        profile = get_object_or_404(RequestProfile, pk=object_id)
+        if not os.path.exists(profile.profile_path):
+            raise Http404("Profile file no longer exists")
+        return FileResponse(open(profile.profile_path, 'rb'), as_attachment=True,
+                            filename=os.path.basename(profile.profile_path))
+    
+    def download(self, obj):
+        url = reverse('admin:users_requestprofile_download', args=[obj.pk])
+        hint = 'open in https://www.speedscope.app' if obj.mode == 'sampler' else 'open with pstats or snakeviz'
+        return format_html('<a href="{}">{}</a> ({})', url, os.path.basename(obj.profile_path), hint)
+    download.short_description = 'Profile file'
+    
+    def top_frames_table(self, obj):
+        unit = 'samples' if obj.mode == 'sampler' else 'ms (self)'
+        rows = format_html_join('', '<tr><td>{}</td><td>{}</td></tr>', ((value, label) for label, value in obj.top_frames))
+        return format_html('<table><tr><th>{}</th><th>Function</th></tr>{}</table>', unit, rows)
+    top_frames_table.short_description = 'Hottest functions'
+    
+    def slowest_queries_table(self, obj):
+        rows = format_html_join('', '<tr><td>{}</td><td><code>{}</code></td></tr>',
+                                ((query['ms'], query['sql']) for query in obj.slowest_queries))
+        return format_html('<table><tr><th>ms</th><th>SQL</th></tr>{}</table>', rows)
+    slowest_queries_table.short_description = 'Slowest queries'
@@ -0,0 +1,138 @@
+"""
+Execution budget for the recommendation agent.
+
+``run_with_budget`` drives ``AgentExecutor.iter()`` step by step and stops the agent as soon
+as one of the limits is reached: LLM iterations, total tool calls, wall-clock time, or
+enough distinct tours collected from search results (a limit of 0 is off). Detail lookups
+don't count towards enough tours: the agent still has to answer the question about them. A
+stopped run still returns a normal agent result; its final answer comes from the ``generate``
+strategy (one LLM call without tools that answers from the conversation and the tool results)
+or the ``force`` strategy (a fixed message).
+"""
+import json
+import time
+
+from django.conf import settings
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from . import metrics
+
+AGENT_STOPS = metrics.counter('tourai_agent_stops_total', 'Agent runs by the reason they ended', ('reason',))
+AGENT_TOOL_CALLS = metrics.histogram('tourai_agent_tool_calls', 'Tool calls per agent run', (), metrics.COUNT_BUCKETS)
+
+FINISHED = 'finished'
+MAX_ITERATIONS = 'max_iterations'
+MAX_TOOL_CALLS = 'max_tool_calls'
+DEADLINE = 'deadline'
+ENOUGH_TOURS = 'enough_tours'
+
+# Tools that look up tours the user asked about rather than search for new ones
+DETAIL_TOOLS = {'get_tour_details_by_ids'}
+
+FORCED_ANSWERS = {
+    ENOUGH_TOURS: "Great! I found some tours that match what you're looking for!",
+    None: "Here's what I found so far. Tell me more about what you'd like and I can refine the search!",
+}
+
+FINAL_ANSWER_PROMPT = """You are TourAI, a friendly travel assistant. The search is finished.
+If the user asked about specific tours, answer the question briefly from their details.
+Otherwise reply in one or two enthusiastic, conversational sentences based on the tours found,
+without listing tour details - they are shown separately in cards. If nothing was found, say so
+and suggest what the user could tell you to refine the search."""
+
+
+class AgentBudget:
+    def __init__(self, max_iterations=None, max_tool_calls=None, max_seconds=None, enough_tours=None,
+                 strategy=None):
+        self.max_iterations = settings.AGENT_MAX_ITERATIONS if max_iterations is None else max_iterations
+        self.max_tool_calls = settings.AGENT_MAX_TOOL_CALLS if max_tool_calls is None else max_tool_calls
+        self.max_seconds = settings.AGENT_MAX_SECONDS if max_seconds is None else max_seconds
+        self.enough_tours = settings.AGENT_ENOUGH_TOURS if enough_tours is None else enough_tours
+        self.strategy = strategy or settings.AGENT_EARLY_STOPPING
+
+
+def run_with_budget(executor, agent_input, collect_tour_ids, llm=None, budget=None):
+    """
+    Run the agent like ``executor.invoke(agent_input)`` within ``budget``.
+
+    ``collect_tour_ids(steps)`` returns the distinct tour IDs found in intermediate steps.
+    The result has ``output``, ``intermediate_steps`` and ``stop_reason``.
+    """
+    budget = budget or AgentBudget()
+    started = time.monotonic()
+    steps = []
+    iterations = 0
+    stop_reason = None
+
+    iterator = iter(executor.iter(agent_input))
+    try:
+        for chunk in iterator:
+            if 'output' in chunk:
+                AGENT_STOPS.inc(FINISHED)
+                AGENT_TOOL_CALLS.observe(len(steps))
+                return {
+                    'output': chunk['output'],
+                    'intermediate_steps': chunk.get('intermediate_steps', steps),
+                    'stop_reason': FINISHED,
+                }
+
+            step = chunk.get('intermediate_step')
+            if not step:
+                continue
+            iterations += 1
+            steps.extend(step)
+
+            searches = [step for step in steps if getattr(step[0], 'tool', None) not in DETAIL_TOOLS]
+            if budget.enough_tours and len(collect_tour_ids(searches)) >= budget.enough_tours:
+                stop_reason = ENOUGH_TOURS
+            elif budget.max_tool_calls and len(steps) >= budget.max_tool_calls:
+                stop_reason = MAX_TOOL_CALLS
+            elif budget.max_iterations and iterations >= budget.max_iterations:
+                stop_reason = MAX_ITERATIONS
+            elif budget.max_seconds and time.monotonic() - started >= budget.max_seconds:
+                stop_reason = DEADLINE
+            if stop_reason:
+                break
+    finally:
+        # Stop the generator so no further LLM or tool calls are made
+        iterator.close()
+
+    if stop_reason is None:
+        # The executor ended without a final answer (its own limits); treat as an iteration limit
+        stop_reason = MAX_ITERATIONS
+    AGENT_STOPS.inc(stop_reason)
+    AGENT_TOOL_CALLS.observe(len(steps))
+    return {
+        'output': final_answer(agent_input, steps, stop_reason, llm, budget.strategy),
+        'intermediate_steps': steps,
+        'stop_reason': stop_reason,
+    }
+
+
+def final_answer(agent_input, steps, stop_reason, llm=None, strategy='generate'):
+    """Answer for a run stopped early, from the tool results gathered so far"""
+    forced = FORCED_ANSWERS.get(stop_reason, FORCED_ANSWERS[None])
+    if strategy != 'generate' or llm is None:
+        return forced
+
+    found = []
+    details = []
+    for action, observation in steps:
+        if not isinstance(observation, list):
+            continue
+        tours = [item for item in observation if isinstance(item, dict) and 'title' in item]
+        if getattr(action, 'tool', None) in DETAIL_TOOLS:
+            details.extend(tours)
+        else:
+            found.extend(f"{item.get('title')} ({item.get('destination')})" for item in tours)
+    summary = '; '.join(dict.fromkeys(found)) or 'no matching tours'
+    request = f"User request: {agent_input.get('input', '')}\n\nTours found: {summary[:4000]}"
+    if details:
+        request += f"\n\nDetails of the tours asked about: {json.dumps(details, default=str)[:4000]}"
+    history = [message for message in agent_input.get('chat_history') or [] if isinstance(message, (HumanMessage, AIMessage))]
+    try:
+        message = llm.invoke([SystemMessage(content=FINAL_ANSWER_PROMPT), *history, HumanMessage(content=request)])
+        return message.content or forced
+    except Exception as e:
+        print(f"   ❌ Final answer generation failed: {e}")
+        return forced
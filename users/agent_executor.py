@@ -0,0 +1,79 @@
+"""
+Agent executor that runs the tool calls of one agent step concurrently.
+
+With the OpenAI tools agent the model can ask for several tools in one response (e.g.
+destination, price range and meal plan searches). ``AgentExecutor`` runs them one after
+another; ``ParallelAgentExecutor`` submits them all to a thread pool, so a step takes as
+long as its slowest tool instead of the sum. Results are yielded in the order the model
+listed the calls, so the merged result is deterministic.
+
+Each tool runs in a copy of the caller's context (replica routing state and other
+contextvars carry over, and its queries count towards the request's) and with Django's
+connection housekeeping around it: worker threads keep their own database connection
+between tasks, replaced when it is too old or broken, just like a request-handling thread.
+"""
+import contextvars
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction
+
+from . import metrics
+from .db import count_context_queries
+
+AGENT_TOOL_STEP = metrics.histogram(
+    'tourai_agent_tool_step_seconds', 'Time spent running the tool calls of one agent step', ('mode',)
+)
+
+_tool_pool = None
+
+
+def _pool():
+    global _tool_pool
+    if _tool_pool is None:
+        _tool_pool = ThreadPoolExecutor(max_workers=settings.AGENT_TOOL_WORKERS, thread_name_prefix='agent-tool')
+    return _tool_pool
+
+
+def _run_tool(func, *args):
+    close_old_connections()
+    try:
+        # Counted with the request's queries (MetricsMiddleware)
+        with count_context_queries():
+            return func(*args)
+    finally:
+        close_old_connections()
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    parallel_tools: bool = True
+    """Run the tool calls of a step concurrently; False runs them in order like AgentExecutor"""
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        # The base implementation yields the step's actions, then one _perform_agent_action
+        # result per action; in parallel mode those are futures, all started before any is awaited
+        pending = []
+        started = None
+        for item in super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager):
+            if isinstance(item, Future):
+                pending.append(item)
+                continue
+            yield item
+            if isinstance(item, AgentAction):
+                started = time.perf_counter()
+        for future in pending:
+            yield future.result()
+        if started is not None:
+            AGENT_TOOL_STEP.observe(time.perf_counter() - started, 'parallel' if self.parallel_tools else 'sequential')
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        if not self.parallel_tools:
+            return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        context = contextvars.copy_context()
+        return _pool().submit(
+            context.run, _run_tool, super()._perform_agent_action,
+            name_to_tool_map, color_mapping, agent_action, run_manager
+        )
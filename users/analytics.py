@@ -0,0 +1,157 @@
+"""
+Agent analytics: tour views, saves and chat recommendations over time.
+
+Requests only append ``TourEvent`` rows (``record_events``): no counters are updated while
+serving. ``rollup()`` (``manage.py rollup_analytics``, run every few minutes) drains the queue
+in batches: it counts each batch per tour and day in Python and adds the counts to
+``TourDailyStats`` with one INSERT ... ON CONFLICT DO UPDATE per chunk, then deletes exactly
+the events it counted, all in one transaction. An event committed while a batch runs is left
+for the next one.
+
+A dashboard then reads at most one row per tour and day: ``dashboard()`` is one query on the
+``(agent, day)`` index for the daily series and one for the per-tour totals.
+"""
+import datetime
+import logging
+from collections import Counter, defaultdict
+
+from django.db import connections, router, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import ChatMessage, SavedTour, TourDailyStats, TourEvent
+
+logger = logging.getLogger(__name__)
+
+# TourEvent kind -> TourDailyStats column
+COUNTERS = {'view': 'views', 'save': 'saves', 'recommendation': 'recommendations'}
+COLUMNS = tuple(COUNTERS.values())
+# Rows per INSERT statement
+UPSERT_CHUNK = 500
+TOP_TOURS = 20
+
+
+def record_events(kind, tour_ids):
+    """Queue one ``kind`` event per tour; never fails the request it is called from"""
+    try:
+        TourEvent.objects.bulk_create([TourEvent(tour_id=tour_id, kind=kind) for tour_id in tour_ids])
+    except Exception:
+        logger.exception("Recording %s events for tours %s failed", kind, list(tour_ids))
+
+
+def _upsert(counts, replace=False):
+    """
+    Add ``{(tour_id, agent_id, day): {column: n}}`` to the daily stats, or with ``replace`` set the
+    columns given to those counts.
+    """
+    if not counts:
+        return
+    using = router.db_for_write(TourDailyStats)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(TourDailyStats._meta.db_table)
+    if replace:
+        replaced = {column for values in counts.values() for column in values}
+        assignments = ', '.join(f"{quote(column)} = excluded.{quote(column)}" for column in COLUMNS if column in replaced)
+    else:
+        assignments = ', '.join(f"{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}" for column in COLUMNS)
+    rows = list(counts.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_CHUNK):
+            chunk = rows[start:start + UPSERT_CHUNK]
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * (3 + len(COLUMNS))) + ')'] * len(chunk))
+            params = []
+            for (tour_id, agent_id, day), values in chunk:
+                params.extend([tour_id, agent_id, connection.ops.adapt_datefield_value(day)])
+                params.extend(values.get(column, 0) for column in COLUMNS)
+            cursor.execute(
+                f"INSERT INTO {table} (tour_id, agent_id, day, {', '.join(quote(column) for column in COLUMNS)}) "
+                f"VALUES {placeholders} "
+                f"ON CONFLICT (tour_id, day) DO UPDATE SET {assignments}",
+                params,
+            )
+
+
+def rollup(batch_size=5000):
+    """Count queued events into the daily stats; returns the number of events counted"""
+    counted = 0
+    while True:
+        with transaction.atomic():
+            # Concurrent rollups skip each other's batches where the database supports it
+            events = list(
+                TourEvent.objects.select_for_update(skip_locked=True, of=('self',)).order_by('id')
+                .values_list('id', 'tour_id', 'tour__agent_id', 'kind', 'occurred_at')[:batch_size]
+            )
+            if not events:
+                return counted
+            counts = defaultdict(Counter)
+            for _, tour_id, agent_id, kind, occurred_at in events:
+                counts[(tour_id, agent_id, timezone.localdate(occurred_at))][COUNTERS[kind]] += 1
+            _upsert(counts)
+            TourEvent.objects.filter(id__in=[event[0] for event in events]).delete()
+        counted += len(events)
+
+
+def backfill():
+    """
+    Replace the save and recommendation counts with those derived from ``SavedTour`` and stored chat
+    messages (signed-in users' conversations), e.g. once after deploying; views have no history.
+    Queued save and recommendation events are dropped, since the history already includes them.
+    Returns the number of daily rows written.
+    """
+    counts = defaultdict(Counter)
+    saved = SavedTour.objects.values_list('tour_id', 'tour__agent_id', 'saved_at')
+    for tour_id, agent_id, saved_at in saved.iterator(chunk_size=5000):
+        counts[(tour_id, agent_id, timezone.localdate(saved_at))]['saves'] += 1
+    recommended = ChatMessage.recommended_tours.through.objects.values_list(
+        'tour_id', 'tour__agent_id', 'chatmessage__created_at'
+    )
+    for tour_id, agent_id, created_at in recommended.iterator(chunk_size=5000):
+        counts[(tour_id, agent_id, timezone.localdate(created_at))]['recommendations'] += 1
+    with transaction.atomic():
+        TourDailyStats.objects.update(saves=0, recommendations=0)
+        TourEvent.objects.filter(kind__in=['save', 'recommendation']).delete()
+        _upsert(counts, replace=True)
+    return len(counts)
+
+
+def _rate(saves, views):
+    return round(saves / views, 4) if views else None
+
+
+def dashboard(agent_id, days=30, tour_id=None, today=None):
+    """Daily series (zero-filled), totals and the most viewed tours of an agent's last ``days`` days"""
+    today = today or timezone.localdate()
+    first_day = today - datetime.timedelta(days=days - 1)
+    stats = TourDailyStats.objects.filter(agent_id=agent_id, day__gte=first_day, day__lte=today)
+    if tour_id is not None:
+        stats = stats.filter(tour_id=tour_id)
+    sums = {column: Sum(column) for column in COLUMNS}
+
+    by_day = {row['day']: row for row in stats.values('day').annotate(**sums).order_by()}
+    series = []
+    totals = dict.fromkeys(COLUMNS, 0)
+    for offset in range(days):
+        day = first_day + datetime.timedelta(days=offset)
+        row = by_day.get(day, {})
+        point = {'date': day.isoformat(), **{column: row.get(column) or 0 for column in COLUMNS}}
+        for column in COLUMNS:
+            totals[column] += point[column]
+        series.append(point)
+    totals['save_rate'] = _rate(totals['saves'], totals['views'])
+
+    tours = [
+        {
+            'id': row['tour_id'],
+            'title': row['tour__title'],
+            **{column: row[column] for column in COLUMNS},
+            'save_rate': _rate(row['saves'], row['views']),
+        }
+        for row in stats.values('tour_id', 'tour__title').annotate(**sums).order_by('-views', '-saves', 'tour_id')[:TOP_TOURS]
+    ]
+    return {
+        'period': {'from': first_day.isoformat(), 'to': today.isoformat(), 'days': days},
+        'totals': totals,
+        'series': series,
+        'tours': tours,
+    }
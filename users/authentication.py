@@ -0,0 +1,214 @@
+"""
+Stateless JWT authentication.
+
+Access tokens carry the claims permission checks need (``user_type``, ``tour_company_id``)
+and the ``preferred_currency`` prices are shown in, so most authenticated requests never touch the ``users_user`` table. ``request.user`` is a
+``ClaimsUser`` that answers those attributes from the token and only loads the full row -
+from a short-TTL per-process cache, then the database - when something else is accessed.
+
+Call ``invalidate_user(user_id)`` whenever a user's type, company, currency or active flag changes
+outside ``User.save()`` (e.g. ``QuerySet.update()``); saves and deletes do it automatically.
+Tokens issued before the invalidation stop being trusted for their claims. Invalidations are
+recorded in the default Django cache, so claims are only trusted when that cache is shared by
+all processes (Redis, Memcached, database); with a per-process cache every request loads the
+user through the TTL cache and is checked for ``is_active``.
+"""
+import copy
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from .metrics import CACHE_REQUESTS
+
+CLAIM_FIELDS = ('user_type', 'tour_company_id', 'preferred_currency')
+# Cache backends whose entries other processes never see (or that keep nothing)
+LOCAL_CACHE_BACKENDS = (LocMemCache, DummyCache)
+
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+
+def _invalidation_key(user_id):
+    return f'tourai:user-invalidated:{user_id}'
+
+
+def invalidated_at(user_id):
+    """Time of the last invalidation of ``user_id`` (seconds since epoch), or None"""
+    return cache.get(_invalidation_key(user_id))
+
+
+def claims_trusted():
+    """Whether invalidations reach every process, so that token claims may stand in for the user row"""
+    return not isinstance(caches['default'], LOCAL_CACHE_BACKENDS)
+
+
+def _normalize_user_id(user_id):
+    # Token claims may carry the id as a string
+    return get_user_model()._meta.pk.to_python(user_id)
+
+
+def invalidate_user(user_id):
+    """
+    Drop cached state for ``user_id``.
+
+    Clears this process's user cache and records the invalidation time in the shared Django
+    cache, so other processes reload the user and distrust claims in older tokens.
+    """
+    user_id = _normalize_user_id(user_id)
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+    timeout = int(settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds())
+    cache.set(_invalidation_key(user_id), time.time(), timeout)
+
+
+def get_cached_user(user_id):
+    """
+    Load a user through the per-process TTL cache.
+
+    Returns a private copy, so callers may modify and save it. Returns None if the user does not exist.
+    """
+    user_id = _normalize_user_id(user_id)
+    ttl = getattr(settings, 'USER_CACHE_TTL', 30)
+    now = time.time()
+
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+    if entry:
+        cached_at, user = entry
+        invalidated = invalidated_at(user_id)
+        if now - cached_at < ttl and (invalidated is None or cached_at > invalidated):
+            CACHE_REQUESTS.inc('user', 'hit')
+            return copy.copy(user)
+    CACHE_REQUESTS.inc('user', 'miss')
+
+    User = get_user_model()
+    try:
+        user = User.objects.select_related('tour_company').get(pk=user_id)
+    except User.DoesNotExist:
+        return None
+
+    with _user_cache_lock:
+        if len(_user_cache) >= getattr(settings, 'USER_CACHE_MAX_SIZE', 10000):
+            # Evict the oldest entry (dicts keep insertion order)
+            _user_cache.pop(next(iter(_user_cache)))
+        _user_cache[user_id] = (now, user)
+    return copy.copy(user)
+
+
+def _load_active_user(user_id):
+    user = get_cached_user(user_id)
+    if user is None:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+    if not user.is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    return user
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    A user answered from token claims.
+
+    ``id``, ``pk``, ``user_type``, ``tour_company_id``, ``preferred_currency`` and the
+    authentication flags come from the token. Any other attribute (or using it as a model instance, e.g. in a foreign key)
+    loads the real ``User`` through ``get_cached_user``.
+    """
+
+    def __init__(self, user_id, claims):
+        self.__dict__['_user_id'] = user_id
+        self.__dict__['_claims'] = claims
+        super().__init__(lambda: _load_active_user(user_id))
+
+    def _claim(self, name):
+        if self._wrapped is not empty:
+            return getattr(self._wrapped, name)
+        return self.__dict__['_claims'][name]
+
+    @property
+    def id(self):
+        return self.__dict__['_user_id']
+
+    @property
+    def pk(self):
+        return self.__dict__['_user_id']
+
+    @property
+    def user_type(self):
+        return self._claim('user_type')
+
+    @property
+    def tour_company_id(self):
+        return self._claim('tour_company_id')
+
+    @property
+    def preferred_currency(self):
+        return self._claim('preferred_currency')
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    @property
+    def is_active(self):
+        # Tokens are only issued to active users, and claims are only trusted while deactivation
+        # reaches every process (see claims_trusted)
+        return True
+
+    def __bool__(self):
+        return True
+
+    def __copy__(self):
+        if self._wrapped is empty:
+            return type(self)(self.id, dict(self.__dict__['_claims']))
+        return copy.copy(self._wrapped)
+
+    def __deepcopy__(self, memo):
+        if self._wrapped is empty:
+            return type(self)(self.id, copy.deepcopy(self.__dict__['_claims'], memo))
+        return copy.deepcopy(self._wrapped, memo)
+
+    def __repr__(self):
+        if self._wrapped is empty:
+            return f'<ClaimsUser: {self.id}>'
+        return repr(self._wrapped)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the user claims embedded in access tokens.
+
+    Falls back to loading the user (via the TTL cache) for tokens without claims, tokens
+    issued before the user was last invalidated, and always when the cache isn't shared.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = _normalize_user_id(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            return super().get_user(validated_token)
+
+        if claims_trusted() and all(field in validated_token for field in CLAIM_FIELDS):
+            invalidated = invalidated_at(user_id)
+            # iat has one-second resolution: tokens from the invalidating second are not trusted either
+            issued_at = validated_token.get('iat', 0)
+            if invalidated is None or issued_at > math.floor(invalidated):
+                claims = {field: validated_token[field] for field in CLAIM_FIELDS}
+                CACHE_REQUESTS.inc('jwt_claims', 'hit')
+                return ClaimsUser(user_id, claims)
+
+        CACHE_REQUESTS.inc('jwt_claims', 'miss')
+        return _load_active_user(user_id)
@@ -0,0 +1,147 @@
+"""
+Travel-period queries: which tours can be taken during a stretch of dates.
+
+A tour is available in a travel window when its dates overlap it (it starts on or before the
+window's last day and ends on or after its first day). The window can be widened by
+``flex_days`` on both sides ("give or take 3 days") or given as a month ("any time in March"),
+and trip length can be limited by nights (``Tour.duration_nights``).
+
+Overlap on its own is a poor index condition: ``end_date >= first day`` matches nearly every
+upcoming tour. But a tour that overlaps the window and lasts at most N nights also starts no
+earlier than ``first day - N``, which makes a window with both ends a bounded range on the
+``(start_date, end_date)`` index of active tours. N is the longest duration among tours of at
+most ``LONG_TOUR_NIGHTS``; the few longer ones are kept in memory and added by ID when they
+overlap, so one year-long listing doesn't widen every search. Both come from the
+``duration_nights`` index and are cached like the other catalog structures (users.catalog).
+"""
+import calendar
+import datetime
+import re
+
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .catalog import CatalogCache
+from .models import Tour
+
+# Widest "give or take" accepted, in days
+MAX_FLEX_DAYS = 31
+# Tours longer than this are matched from memory rather than through the start date range
+LONG_TOUR_NIGHTS = 60
+
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+
+
+def month_window(value, today=None):
+    """
+    ``(first day, last day)`` of "2027-03", "March 2027" or "March" (its next occurrence, this month
+    included); ``None`` if the value isn't a month.
+    """
+    today = today or timezone.localdate()
+    text = (value or '').strip().lower()
+    match = re.fullmatch(r'(\d{4})-(\d{1,2})', text)
+    if match:
+        year, month = int(match.group(1)), int(match.group(2))
+    else:
+        parts = text.split()
+        month = MONTHS.get(parts[0]) if parts else None
+        if month is None or len(parts) > 2 or (len(parts) == 2 and not parts[1].isdigit()):
+            return None
+        year = int(parts[1]) if len(parts) == 2 else today.year + (month < today.month)
+    if not 1 <= month <= 12 or not datetime.MINYEAR < year < datetime.MAXYEAR:
+        return None
+    return datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _parse_date(value):
+    try:
+        date = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    # Like month_window: room for flex_days and the duration bound on either side
+    return date if datetime.MINYEAR < date.year < datetime.MAXYEAR else None
+
+
+def _parse_count(value):
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return None
+
+
+def parse_period(params):
+    """
+    The travel period in query parameters, as ``{'travel_from', 'travel_to', 'min_nights', 'max_nights'}``
+    (only the ones given). ``date_from``/``date_to`` take precedence over ``month``; ``flex_days`` widens
+    the window; ``nights`` is shorthand for equal min and max. Invalid values are ignored.
+    """
+    period = {}
+    month = month_window(params.get('month', ''))
+    if month:
+        period['travel_from'], period['travel_to'] = month
+    for name, key in (('date_from', 'travel_from'), ('date_to', 'travel_to')):
+        value = _parse_date(params.get(name, '').strip())
+        if value:
+            period[key] = value
+
+    flex_days = _parse_count(params.get('flex_days', '').strip()) or 0
+    flex = datetime.timedelta(days=min(flex_days, MAX_FLEX_DAYS))
+    if 'travel_from' in period:
+        period['travel_from'] -= flex
+    if 'travel_to' in period:
+        period['travel_to'] += flex
+
+    for name in ('min_nights', 'max_nights'):
+        value = _parse_count(params.get(name, '').strip() or params.get('nights', '').strip())
+        if value is not None:
+            period[name] = value
+    return period
+
+
+class _Durations(CatalogCache):
+    """The longest duration up to ``LONG_TOUR_NIGHTS``, and ``(id, start_date, end_date)`` of the longer tours"""
+
+    def __init__(self):
+        super().__init__()
+        self.longest = 0
+        self.tours = []
+
+    def load(self):
+        self.longest = Tour.objects.filter(duration_nights__lte=LONG_TOUR_NIGHTS).aggregate(
+            longest=Max('duration_nights')
+        )['longest'] or 0
+        self.tours = list(
+            Tour.objects.filter(duration_nights__gt=LONG_TOUR_NIGHTS).values_list('id', 'start_date', 'end_date')
+        )
+
+    def long_tours_overlapping(self, travel_from, travel_to):
+        return [
+            tour_id for tour_id, start_date, end_date in self.tours
+            if end_date >= travel_from and start_date <= travel_to
+        ]
+
+
+durations = _Durations()
+
+
+def period_condition(period):
+    """A ``Q`` for tours available in a ``parse_period()`` period (other keys are ignored)"""
+    condition = Q()
+    if 'travel_from' in period:
+        condition &= Q(end_date__gte=period['travel_from'])
+    if 'travel_to' in period:
+        condition &= Q(start_date__lte=period['travel_to'])
+    if 'travel_from' in period and 'travel_to' in period:
+        # An open-ended window matches most of the catalog anyway; a bounded one becomes an index range
+        durations.refresh()
+        earliest_start = period['travel_from'] - datetime.timedelta(days=durations.longest)
+        condition &= Q(start_date__gte=earliest_start)
+        long_tour_ids = durations.long_tours_overlapping(period['travel_from'], period['travel_to'])
+        if long_tour_ids:
+            condition |= Q(id__in=long_tour_ids)
+    if 'min_nights' in period:
+        condition &= Q(duration_nights__gte=period['min_nights'])
+    if 'max_nights' in period:
+        condition &= Q(duration_nights__lte=period['max_nights'])
+    return condition
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authenticate with email and password in a single indexed lookup.
+
+    Failed attempts take the same time whether or not the email exists: a password hash is
+    always computed, so response timing does not reveal which emails are registered.
+    """
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.get(email=email)
+        except (UserModel.DoesNotExist, UserModel.MultipleObjectsReturned):
+            # Run the default password hasher once to even out timing with the found-user path
+            UserModel().set_password(password)
+            return None
+
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
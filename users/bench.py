@@ -0,0 +1,100 @@
+"""
+Shared helpers for the benchmark management commands (``manage.py bench_*``).
+"""
+import json
+import math
+import os
+import platform
+import time
+from contextlib import contextmanager
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (pct in 0-100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies_ms):
+    """p50/p95/p99/mean/max summary of a list of latencies in milliseconds"""
+    if not latencies_ms:
+        return {'count': 0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'mean_ms': 0.0, 'max_ms': 0.0}
+    return {
+        'count': len(latencies_ms),
+        'p50_ms': round(percentile(latencies_ms, 50), 3),
+        'p95_ms': round(percentile(latencies_ms, 95), 3),
+        'p99_ms': round(percentile(latencies_ms, 99), 3),
+        'mean_ms': round(sum(latencies_ms) / len(latencies_ms), 3),
+        'max_ms': round(max(latencies_ms), 3),
+    }
+
+
+class Stopwatch:
+    """Wall-clock and CPU time of a block, in seconds"""
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    @contextmanager
+    def running(self):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield self
+        finally:
+            self.wall += time.perf_counter() - wall_start
+            self.cpu += time.process_time() - cpu_start
+
+
+def timed_ms(func, *args, **kwargs):
+    """Call ``func`` and return ``(result, elapsed_ms)``"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def environment_info():
+    """Machine details stored next to benchmark results so runs can be compared"""
+    from django.db import connection
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'database': connection.vendor,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def write_results(path, results):
+    """Write benchmark results as JSON (pretty-printed so runs diff cleanly)"""
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True, default=str)
+        f.write('\n')
+
+
+def load_budgets(path):
+    """Per-endpoint budgets: ``{label: {"p95_ms": .., "queries": .., "bytes": ..}}``"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def check_budgets(results, budgets):
+    """
+    List of human readable budget violations for ``{label: measured}`` results. Unexpected
+    response statuses (``errors``) are violations whether or not the endpoint has a budget.
+    """
+    violations = [
+        f"{label}: {measured['errors']} unexpected responses"
+        for label, measured in sorted(results.items()) if measured.get('errors')
+    ]
+    for label, budget in sorted(budgets.items()):
+        measured = results.get(label)
+        if measured is None:
+            continue
+        for metric, limit in budget.items():
+            if metric in measured and measured[metric] > limit:
+                violations.append(f"{label}: {metric} {measured[metric]} > budget {limit}")
+    return violations
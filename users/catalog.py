@@ -0,0 +1,59 @@
+"""
+In-process structures derived from the tour catalog, and how they notice catalog changes.
+
+``catalog_version()`` is the newest entry of the tour change log (users.changes), one primary
+key lookup: every tour write appends to it. A ``CatalogCache`` compares it at most every
+``CATALOG_REFRESH_INTERVAL`` seconds and reloads when it moved; writes in the same process call
+``catalog_changed()`` so the next read there rebuilds immediately. Until the newest entry is
+settled, an earlier-numbered change may still commit, so the cache checks again next time.
+Writes that bypass ``Tour.save()`` (``QuerySet.update()``, ``bulk_create``) must log their
+changes themselves.
+"""
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from . import changes
+
+_caches = weakref.WeakSet()
+
+
+def catalog_version():
+    """``(seq, recorded_at)`` of the newest change log entry"""
+    return changes.latest()
+
+
+def catalog_changed():
+    """Have every catalog cache in this process reload on its next use"""
+    for cache in list(_caches):
+        cache.mark_stale()
+
+
+class CatalogCache:
+    """Base class: subclasses implement ``load()``, readers call ``refresh()`` first"""
+
+    def __init__(self):
+        self.version = None
+        self.checked_at = 0.0
+        self.stale = True
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def mark_stale(self):
+        self.stale = True
+
+    def refresh(self):
+        if not self.stale and time.monotonic() - self.checked_at < settings.CATALOG_REFRESH_INTERVAL:
+            return
+        with self._lock:
+            self.stale = False
+            self.checked_at = time.monotonic()
+            version = catalog_version()
+            if version != self.version:
+                self.load()
+                settled = version[1] is None or version[1] < changes.settled_before()
+                self.version = version if settled else None
+
+    def load(self):
+        raise NotImplementedError
@@ -0,0 +1,98 @@
+"""
+The tour change feed: incremental sync for clients and in-process caches.
+
+Every write clients can see appends a ``TourChange`` in the same transaction, numbered by a
+monotonic ``seq``: ``Tour.save()`` (diffing against the values it loaded), deletions (the
+``post_delete`` signal, inside the deletion's transaction) and the bulk writers, which log their
+batches explicitly. A client syncs by asking for the changes after the last ``seq`` it has
+seen: created entries carry every field, updated ones only the changed fields, deactivated and
+deleted ones none. Apply created and updated entries as upserts.
+
+Sequence numbers are handed out when a change is written, not when it commits, so a change can
+become visible after a later-numbered one. Entries are therefore served only once they are
+``TOUR_CHANGES_SETTLE_SECONDS`` old, which must exceed the longest write transaction (an import
+batch) plus any replica lag. The catalog caches (users.catalog) use the latest ``seq`` as their
+version under the same rule.
+
+``compact()`` (``manage.py compact_tour_changes``, run periodically) merges each tour's entries
+older than ``TOUR_CHANGES_COMPACT_AFTER_DAYS`` into its latest one, so the log grows with the
+number of tours rather than with the number of writes, and replaying it still ends in the same
+state.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import TourChange
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+
+def settled_before():
+    """Entries recorded before this time are safe to serve"""
+    return timezone.now() - datetime.timedelta(seconds=settings.TOUR_CHANGES_SETTLE_SECONDS)
+
+
+def latest():
+    """``(seq, recorded_at)`` of the newest entry, ``(0, None)`` while the log is empty"""
+    return TourChange.objects.order_by('-seq').values_list('seq', 'recorded_at').first() or (0, None)
+
+
+def cursor():
+    """The ``seq`` a client starts from: every entry up to it is settled"""
+    return (
+        TourChange.objects.filter(recorded_at__lt=settled_before())
+        .order_by('-seq').values_list('seq', flat=True).first() or 0
+    )
+
+
+def changes_since(since, limit=DEFAULT_LIMIT):
+    """``(entries, has_more)``: settled entries after ``since``, oldest first (a primary key range scan)"""
+    entries = list(
+        TourChange.objects.filter(seq__gt=since, recorded_at__lt=settled_before())
+        .order_by('seq')[:limit + 1]
+    )
+    return entries[:limit], len(entries) > limit
+
+
+def _merge(entries):
+    """``(kind, fields)`` that replaying ``entries`` (one tour's, oldest first) amounts to"""
+    kind, fields = entries[0].kind, dict(entries[0].fields)
+    for entry in entries[1:]:
+        if entry.kind == 'updated' and kind in ('created', 'updated'):
+            fields.update(entry.fields)
+        else:
+            kind, fields = entry.kind, dict(entry.fields)
+    return kind, fields
+
+
+def compact(before=None, batch_size=1000):
+    """Merge each tour's entries recorded before ``before`` into its latest one; returns entries removed"""
+    before = before or timezone.now() - datetime.timedelta(days=settings.TOUR_CHANGES_COMPACT_AFTER_DAYS)
+    old = TourChange.objects.filter(recorded_at__lt=before)
+    tour_ids = list(
+        old.order_by().values('tour_id').annotate(entries=Count('seq')).filter(entries__gt=1).values_list('tour_id', flat=True)
+    )
+    removed = 0
+    for start in range(0, len(tour_ids), batch_size):
+        with transaction.atomic():
+            by_tour = defaultdict(list)
+            for entry in old.filter(tour_id__in=tour_ids[start:start + batch_size]).order_by('seq'):
+                by_tour[entry.tour_id].append(entry)
+            merged = []
+            for entries in by_tour.values():
+                last = entries[-1]
+                last.kind, last.fields = _merge(entries)
+                merged.append(last)
+            TourChange.objects.bulk_update(merged, ['kind', 'fields'])
+            removed += old.filter(tour_id__in=list(by_tour)).exclude(seq__in=[entry.seq for entry in merged]).delete()[0]
+    return removed
+
+
+def as_json(entry):
+    return {'seq': entry.seq, 'tour_id': entry.tour_id, 'kind': entry.kind, 'fields': entry.fields}
@@ -1,30 +1,48 @@
 import os
 os.environ["LANGCHAIN_TRACING_V2"] = "false"
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 from langchain.tools import tool
-from langchain.agents import create_openai_functions_agent, AgentExecutor
+from langchain.agents import create_openai_tools_agent
 from langchain import hub
 from .models import Tour
-from django.db.models import Q
+from .currency import BASE_CURRENCY, base_bound, supported
+from .destinations import index as destination_index
+from .agent_budget import run_with_budget
+from .agent_executor import ParallelAgentExecutor
+from . import impressions
+from .llm_resilience import ResilientChatOpenAI, breaker, llm_deadline
+from .ranking import candidate_ids, collect_candidates, record_candidates
+from .metrics import AGENT_ITERATIONS, MOCK_FALLBACKS, llm_callback, track_tool
+from .routers import replica_reads
+from django.conf import settings
+from django.db.models import Case, IntegerField, Q, When
 from decimal import Decimal
 import json
+import threading
 from typing import List, Dict, Optional
 import logging
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Impressions of tours picked by the mock responder are attributed to this tool
+MOCK_TOOL = 'mock'
+
 # Define tools outside the class so they can be used by the agent
 @tool
+@track_tool
+@replica_reads
 def search_tours_by_destination(destination: str) -> List[Dict]:
-    """Search for tours by destination. Use this when users mention specific countries, cities, or regions."""
+    """Search for tours by destination. Use this when users mention specific cities, countries, regions (e.g. Southeast Asia) or continents."""
     print(f"🔍 TOOL CALLED: search_tours_by_destination")
     print(f"   Parameters: destination='{destination}'")
     
     try:
-        tours = Tour.objects.filter(is_active=True, destination__icontains=destination)
-        result = _serialize_tours_for_llm(tours)
+        # Countries, regions ("Southeast Asia") and continents ("Europe") resolve to destination IDs in memory
+        place_ids = destination_index.lookup(destination)
+        condition = Q(place_id__in=place_ids) if place_ids is not None else Q(destination__icontains=destination)
+        tours = Tour.objects.filter(is_active=True).filter(condition)
+        result = _search_results('search_tours_by_destination', tours, condition)
         print(f"   Results: Found {len(result)} tours for destination '{destination}'")
         for tour in result:
             print(f"     - {tour['title']} ({tour['destination']})")
@@ -33,16 +51,24 @@ def search_tours_by_destination(destination: str) -> List[Dict]:
         print(f"   Error: {str(e)}")
         return []
 
-@tool  
-def search_tours_by_price_range(min_price: float = 0, max_price: float = 10000) -> List[Dict]:
-    """Search for tours within a specific price range. Use for budget or luxury requests."""
+@tool
+@track_tool
+@replica_reads
+def search_tours_by_price_range(min_price: float = 0, max_price: float = 10000, currency: str = 'USD') -> List[Dict]:
+    """Search for tours within a specific price range. Use for budget or luxury requests. Pass the ISO code of the currency the user named (e.g. EUR), USD otherwise."""
     print(f"💰 TOOL CALLED: search_tours_by_price_range")
-    print(f"   Parameters: min_price=${min_price}, max_price=${max_price}")
+    print(f"   Parameters: min_price={min_price}, max_price={max_price}, currency={currency}")
     
     try:
-        tours = Tour.objects.filter(is_active=True, price__gte=min_price, price__lte=max_price).order_by('price')
-        result = _serialize_tours_for_llm(tours)
-        print(f"   Results: Found {len(result)} tours in price range ${min_price}-${max_price}")
+        # Tours are priced in different currencies: compare in dollars, on the indexed price_usd
+        currency = supported(currency) or BASE_CURRENCY
+        condition = Q(
+            price_usd__gte=base_bound(min_price, currency),
+            price_usd__lte=base_bound(max_price, currency),
+        )
+        tours = Tour.objects.filter(is_active=True).filter(condition).order_by('price_usd')
+        result = _search_results('search_tours_by_price_range', tours, condition)
+        print(f"   Results: Found {len(result)} tours in price range {min_price}-{max_price} {currency}")
         for tour in result:
             print(f"     - {tour['title']} ({tour['destination']})")
         return result
@@ -51,18 +77,24 @@ def search_tours_by_price_range(min_price: float = 0, max_price: float = 10000)
         return []
 
 @tool
+@track_tool
+@replica_reads
 def search_tours_by_keyword(keyword: str) -> List[Dict]:
     """Search tours by keywords in title or description. Use for activity types like 'adventure', 'cultural', 'safari', etc."""
     print(f"🔎 TOOL CALLED: search_tours_by_keyword")
     print(f"   Parameters: keyword='{keyword}'")
     
     try:
+        condition = Q(title__icontains=keyword) | Q(description__icontains=keyword)
         tours = Tour.objects.filter(
             is_active=True
         ).filter(
-            Q(title__icontains=keyword) | Q(description__icontains=keyword)
-        )
-        result = _serialize_tours_for_llm(tours)
+            condition
+        ).annotate(
+            # Title matches first
+            in_title=Case(When(title__icontains=keyword, then=1), default=0, output_field=IntegerField())
+        ).order_by('-in_title', '-created_at')
+        result = _search_results('search_tours_by_keyword', tours, condition)
         print(f"   Results: Found {len(result)} tours matching keyword '{keyword}'")
         for tour in result:
             print(f"     - {tour['title']} ({tour['destination']})")
@@ -72,14 +104,15 @@ def search_tours_by_keyword(keyword: str) -> List[Dict]:
         return []
 
 @tool
+@track_tool
+@replica_reads
 def get_all_available_destinations() -> List[str]:
     """Get a list of all available tour destinations. Use this to help users discover options."""
     print(f"🌍 TOOL CALLED: get_all_available_destinations")
     print(f"   Parameters: None")
     
     try:
-        destinations = Tour.objects.filter(is_active=True).values_list('destination', flat=True).distinct()
-        result = list(destinations)
+        result = destination_index.available()
         print(f"   Results: Found {len(result)} unique destinations")
         print(f"     - Destinations: {', '.join(result)}")
         return result
@@ -88,14 +121,17 @@ def get_all_available_destinations() -> List[str]:
         return []
 
 @tool
+@track_tool
+@replica_reads
 def search_tours_by_visa_requirement(visa_required: bool) -> List[Dict]:
     """Search for tours based on visa requirements. Use when users ask about destinations that require visa or visa-free travel."""
     print(f"📋 TOOL CALLED: search_tours_by_visa_requirement")
     print(f"   Parameters: visa_required={visa_required}")
     
     try:
-        tours = Tour.objects.filter(is_active=True, visa_required=visa_required).order_by('destination')
-        result = _serialize_tours_for_llm(tours)
+        condition = Q(visa_required=visa_required)
+        tours = Tour.objects.filter(is_active=True).filter(condition).order_by('destination')
+        result = _search_results('search_tours_by_visa_requirement', tours, condition)
         visa_status = "require visa" if visa_required else "are visa-free"
         print(f"   Results: Found {len(result)} tours that {visa_status}")
         for tour in result:
@@ -106,36 +142,36 @@ def search_tours_by_visa_requirement(visa_required: bool) -> List[Dict]:
         return []
 
 @tool
-def search_tours_by_date_range(start_date: str, end_date: str = None) -> List[Dict]:
-    """Search for tours within a specific date range. Use when users mention specific dates, months, or travel periods.
-    Format dates as YYYY-MM-DD. If end_date is not provided, searches for tours starting from start_date onwards."""
+@track_tool
+@replica_reads
+def search_tours_by_date_range(start_date: str, end_date: str = None, flexible_days: int = 0,
+                               min_nights: int = None, max_nights: int = None) -> List[Dict]:
+    """Search for tours available during a travel period (tours whose dates overlap start_date..end_date). Use when users mention specific dates, months, or travel periods.
+    Format dates as YYYY-MM-DD; for "any time in March" pass the first and last day of the month. If end_date is not provided, finds tours still running on or after start_date.
+    Use flexible_days for "give or take N days" and min_nights/max_nights for trip length (e.g. "a week" is 6 to 8 nights)."""
     print(f"📅 TOOL CALLED: search_tours_by_date_range")
-    print(f"   Parameters: start_date='{start_date}', end_date='{end_date}'")
+    print(f"   Parameters: start_date='{start_date}', end_date='{end_date}', flexible_days={flexible_days}, min_nights={min_nights}, max_nights={max_nights}")
     
     try:
-        from datetime import datetime
+        from .availability import parse_period, period_condition
         
-        # Parse start_date
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
+        params = {
+            'date_from': start_date,
+            'date_to': end_date or '',
+            'flex_days': str(flexible_days or 0),
+            'min_nights': '' if min_nights is None else str(min_nights),
+            'max_nights': '' if max_nights is None else str(max_nights),
+        }
+        period = parse_period(params)
+        if 'travel_from' not in period:
+            raise ValueError(f"start_date '{start_date}' is not a YYYY-MM-DD date")
         
-        # Build the query
-        if end_date:
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-            tours = Tour.objects.filter(
-                is_active=True,
-                start_date__gte=start_date_obj,
-                start_date__lte=end_date_obj
-            ).order_by('start_date')
-            date_range_desc = f"between {start_date} and {end_date}"
-        else:
-            tours = Tour.objects.filter(
-                is_active=True,
-                start_date__gte=start_date_obj
-            ).order_by('start_date')
-            date_range_desc = f"starting from {start_date}"
+        condition = period_condition(period)
+        tours = Tour.objects.filter(is_active=True).filter(condition).order_by('start_date')
+        date_range_desc = f"between {period['travel_from']} and {period['travel_to']}" if 'travel_to' in period else f"from {period['travel_from']} onwards"
         
-        result = _serialize_tours_for_llm(tours)
-        print(f"   Results: Found {len(result)} tours {date_range_desc}")
+        result = _search_results('search_tours_by_date_range', tours, condition)
+        print(f"   Results: Found {len(result)} tours available {date_range_desc}")
         for tour in result:
             print(f"     - {tour['title']} ({tour['destination']})")
         return result
@@ -144,6 +180,8 @@ def search_tours_by_date_range(start_date: str, end_date: str = None) -> List[Di
         return []
 
 @tool
+@track_tool
+@replica_reads
 def search_tours_by_meal_plan(meal_plan: str) -> List[Dict]:
     """Search for tours by meal plan. Use when users mention meal preferences.
     Valid meal plans: 'room_only', 'bed_breakfast', 'half_board', 'full_board', 'all_inclusive'"""
@@ -165,8 +203,9 @@ def search_tours_by_meal_plan(meal_plan: str) -> List[Dict]:
         # Normalize the meal plan input
         meal_plan_normalized = meal_plan_mapping.get(meal_plan.lower(), meal_plan.lower())
         
-        tours = Tour.objects.filter(is_active=True, meal_plan=meal_plan_normalized).order_by('destination')
-        result = _serialize_tours_for_llm(tours)
+        condition = Q(meal_plan=meal_plan_normalized)
+        tours = Tour.objects.filter(is_active=True).filter(condition).order_by('destination')
+        result = _search_results('search_tours_by_meal_plan', tours, condition)
         
         print(f"   Results: Found {len(result)} tours with {meal_plan} meal plan")
         for tour in result:
@@ -177,6 +216,56 @@ def search_tours_by_meal_plan(meal_plan: str) -> List[Dict]:
         return []
 
 @tool
+@track_tool
+@replica_reads
+def search_tours_semantic(query: str) -> List[Dict]:
+    """Search tours by meaning rather than exact words. Use for descriptive or vague requests like
+    'romantic getaway', 'somewhere in the mountains' or 'relaxing beach holiday'."""
+    print(f"🧭 TOOL CALLED: search_tours_semantic")
+    print(f"   Parameters: query='{query}'")
+    
+    try:
+        from .embeddings import similar_tours
+        matches = similar_tours(
+            query=query, k=settings.RANKING_CANDIDATE_POOL, queryset=Tour.objects.only('id', 'title', 'destination')
+        )
+        tour_ids = [tour.id for tour, _ in matches]
+        record_candidates('search_tours_semantic', tour_ids, Q(id__in=tour_ids))
+        result = _serialize_tours_for_llm([tour for tour, _ in matches])
+        print(f"   Results: Found {len(result)} tours similar to '{query}'")
+        for tour in result:
+            print(f"     - {tour['title']} ({tour['destination']})")
+        return result
+    except Exception as e:
+        print(f"   Error: {str(e)}")
+        return []
+
+@tool
+@track_tool
+@replica_reads
+def find_similar_tours(tour_id: int) -> List[Dict]:
+    """Find tours similar to a specific tour (same area, price band, meal plan, dates and style).
+    Use when users want alternatives to, or more tours like, a tour they were shown."""
+    print(f"🔗 TOOL CALLED: find_similar_tours")
+    print(f"   Parameters: tour_id={tour_id}")
+    
+    try:
+        from .similarity import similar_tours_for
+        tours = [entry.similar for entry in similar_tours_for(tour_id)]
+        tour_ids = [tour.id for tour in tours]
+        record_candidates('find_similar_tours', tour_ids, Q(id__in=tour_ids))
+        result = _serialize_tours_for_llm(tours)
+        print(f"   Results: Found {len(result)} tours similar to tour {tour_id}")
+        for tour in result:
+            print(f"     - {tour['title']} ({tour['destination']})")
+        return result
+    except Exception as e:
+        print(f"   Error: {str(e)}")
+        return []
+
+@tool
+@track_tool
+@replica_reads
 def get_tour_details_by_ids(tour_ids: List[int]) -> List[Dict]:
     """Get detailed information about specific tours by their IDs. Use this when users ask about specific tours from previous recommendations."""
     print(f"📋 TOOL CALLED: get_tour_details_by_ids")
@@ -193,6 +282,7 @@ def get_tour_details_by_ids(tour_ids: List[int]) -> List[Dict]:
                 'destination': tour.destination,
                 'hotel_name': tour.hotel_name,
                 'price': float(tour.price),
+                'currency': tour.currency,
                 'start_date': tour.start_date.strftime('%Y-%m-%d'),
                 'end_date': tour.end_date.strftime('%Y-%m-%d'),
                 'visa_required': tour.visa_required,
@@ -203,6 +293,12 @@ def get_tour_details_by_ids(tour_ids: List[int]) -> List[Dict]:
                 'description': tour.description[:300] + '...' if len(tour.description) > 300 else tour.description
             })
         
+        # Tours the user asked about are candidates of this turn too, in the order they were given
+        found = {tour['id'] for tour in result}
+        record_candidates(
+            'get_tour_details_by_ids', [tour_id for tour_id in tour_ids if tour_id in found], Q(id__in=found)
+        )
+        
         print(f"   Results: Found {len(result)} tours with detailed information")
         for tour in result:
             print(f"     - {tour['title']} ({tour['destination']}) - Visa: {tour['visa_required']}")
@@ -211,6 +307,12 @@ def get_tour_details_by_ids(tour_ids: List[int]) -> List[Dict]:
         print(f"   Error: {str(e)}")
         return []
 
+def _search_results(tool_name, tours, condition) -> List[Dict]:
+    """Record a search tool's filter and candidate pool for ranking and return its first 5 tours for the LLM"""
+    tour_ids = candidate_ids(tool_name, tours, condition)[:5]
+    tours_by_id = Tour.objects.only('id', 'title', 'destination').in_bulk(tour_ids)
+    return _serialize_tours_for_llm([tours_by_id[tour_id] for tour_id in tour_ids if tour_id in tours_by_id])
+
 def _serialize_tours_for_llm(tours) -> List[Dict]:
     """Serialize tour objects with minimal data for LLM - prevents detailed responses"""
     tours_data = []
@@ -240,6 +342,7 @@ def _serialize_tours_for_frontend(tours) -> List[Dict]:
             'destination': tour.destination,
             'hotel_name': tour.hotel_name,
             'price': float(tour.price),
+            'currency': tour.currency,
             'formatted_price': tour.formatted_price,
             'start_date': tour.start_date.strftime('%Y-%m-%d'),
             'end_date': tour.end_date.strftime('%Y-%m-%d'),
@@ -253,12 +356,32 @@ def _serialize_tours_for_frontend(tours) -> List[Dict]:
 
 class TourRecommendationService:
     def __init__(self):
+        if settings.LLM_BACKEND == 'mock':
+            self.use_mock = True
+            return
+
         # Initialize the LLM
         try:
-            self.llm = ChatOpenAI(
+            # A stub server or recorded cassette means no network: skip the prompt hub and don't require a real key
+            offline = bool(settings.OPENAI_BASE_URL or settings.LLM_CASSETTE)
+            llm_kwargs = {}
+            if settings.OPENAI_BASE_URL:
+                llm_kwargs['base_url'] = settings.OPENAI_BASE_URL
+            if settings.LLM_CASSETTE:
+                from .llm_cassette import cassette_http_client
+                llm_kwargs['http_client'] = cassette_http_client(settings.LLM_CASSETTE, settings.LLM_CASSETTE_MODE)
+            
+            # Timeouts, retries and hedging are handled per call by ResilientChatOpenAI, and
+            # streaming is off so each completion is one retryable unit
+            self.llm = ResilientChatOpenAI(
                 model="gpt-4.1-mini",
                 temperature=0.1,
-                api_key=os.getenv("OPENAI_API_KEY")
+                api_key=os.getenv("OPENAI_API_KEY") or ('offline' if offline else None),
+                timeout=settings.LLM_TIMEOUT,
+                max_retries=0,
+                disable_streaming=True,
+                callbacks=[llm_callback()],
+                **llm_kwargs
             )
             
             # Define tools
@@ -270,7 +393,9 @@ class TourRecommendationService:
                 search_tours_by_visa_requirement,
                 search_tours_by_date_range,
                 search_tours_by_meal_plan,
-                get_tour_details_by_ids
+                get_tour_details_by_ids,
+                search_tours_semantic,
+                find_similar_tours
             ]
             
             # Create agent
@@ -287,12 +412,15 @@ MANDATORY TOOL USAGE RULES:
 - Use search_tours_by_destination for ANY location mentioned (e.g., "Japan", "Europe", "Thailand")  
 - Use search_tours_by_price_range for ANY budget mentioned ("luxury", "budget", "cheap", "expensive", "under $X", "over $X")
 - Use search_tours_by_keyword for ANY activity mentioned ("adventure", "cultural", "safari", "beach", "wildlife", "hiking", "romantic")
+- Use search_tours_semantic for descriptive requests that may not match exact words ("romantic getaway", "mountains", "somewhere relaxing")
 - Use search_tours_by_visa_requirement when users ask about visa requirements ("visa-free", "no visa required", "visa required")
 - Use search_tours_by_date_range when users mention specific dates or travel periods ("in March", "next summer", "2024-05-15")
 - Use search_tours_by_meal_plan when users mention meal preferences ("all inclusive", "breakfast included", "full board", "half board")
 - Use get_all_available_destinations when users ask about available options
 - Use get_tour_details_by_ids when users ask follow-up questions about specific tours (you'll be given the tour IDs in CONTEXT)
+- Use find_similar_tours when users ask for alternatives to, or more tours like, a specific tour ("something similar", "other options like this one")
 - Always search for tours when users mention specific travel requests
+- When a request mentions several criteria (e.g. destination, budget and meal plan), call all the matching tools at once
 
 FOLLOW-UP QUESTION HANDLING:
 - When CONTEXT mentions previously recommended tours, ALWAYS use get_tour_details_by_ids first with the provided IDs
@@ -314,6 +442,8 @@ The system will automatically display tour details in cards - you focus on conve
 
             try:
                 # Try to get the prompt from hub, fallback if not available
+                if offline:
+                    raise RuntimeError("Prompt hub is not used offline")
                 prompt = hub.pull("hwchase17/openai-functions-agent")
                 prompt.messages[0].prompt.template = system_prompt
             except:
@@ -326,13 +456,18 @@ The system will automatically display tour details in cards - you focus on conve
                     MessagesPlaceholder("agent_scratchpad")
                 ])
 
-            # Create agent
-            agent = create_openai_functions_agent(self.llm, self.tools, prompt)
-            self.agent_executor = AgentExecutor(
+            # Create agent: the tools agent lets the model request several tools in one step,
+            # which ParallelAgentExecutor runs concurrently
+            agent = create_openai_tools_agent(self.llm, self.tools, prompt)
+            # recommend_tours enforces the full budget (tool calls, enough tours); these are backstops
+            self.agent_executor = ParallelAgentExecutor(
                 agent=agent, 
                 tools=self.tools, 
                 verbose=False,
-                return_intermediate_steps=True
+                parallel_tools=settings.AGENT_PARALLEL_TOOLS,
+                return_intermediate_steps=True,
+                max_iterations=settings.AGENT_MAX_ITERATIONS or None,
+                max_execution_time=settings.AGENT_MAX_SECONDS or None
             )
             self.use_mock = False
             
@@ -455,24 +590,23 @@ The system will automatically display tour details in cards - you focus on conve
         # Simple keyword matching for travel-related queries
         matching_tour_ids = []
         
-        # Match based on destinations mentioned
-        if 'japan' in query_lower or 'tokyo' in query_lower:
-            matching_tour_ids = [t['id'] for t in tours_data if 'Japan' in t['destination']][:2]
-        elif 'thailand' in query_lower or 'asia' in query_lower:
-            matching_tour_ids = [t['id'] for t in tours_data if any(country in t['destination'] for country in ['Thailand', 'Japan', 'Indonesia'])][:2]
-        elif 'europe' in query_lower or 'switzerland' in query_lower:
-            matching_tour_ids = [t['id'] for t in tours_data if any(country in t['destination'] for country in ['Switzerland', 'Greece', 'Norway', 'Iceland'])][:2]
+        # Match based on destinations mentioned: a city, country, region or continent
+        place = destination_index.mentioned(user_query)
+        if place:
+            from .models import Tour
+            place_name, place_ids = place
+            matching_tour_ids = list(Tour.objects.filter(is_active=True, place_id__in=place_ids).values_list('id', flat=True)[:2])
         elif 'adventure' in query_lower or 'hiking' in query_lower:
             matching_tour_ids = [t['id'] for t in tours_data if any(word in t['title'].lower() for word in ['adventure', 'trek', 'hiking', 'wilderness'])][:2]
         elif 'luxury' in query_lower or 'expensive' in query_lower:
             # Get luxury price range tours (>$2500) - need to fetch from DB
             from .models import Tour
-            luxury_tour_objects = Tour.objects.filter(is_active=True, price__gte=2500)[:2]
+            luxury_tour_objects = Tour.objects.filter(is_active=True, price_usd__gte=2500)[:2]
             matching_tour_ids = [t.id for t in luxury_tour_objects]
         elif 'budget' in query_lower or 'cheap' in query_lower:
             # Get budget price range tours (<$1000) - need to fetch from DB  
             from .models import Tour
-            budget_tour_objects = Tour.objects.filter(is_active=True, price__lt=1000)[:2]
+            budget_tour_objects = Tour.objects.filter(is_active=True, price_usd__lt=1000)[:2]
             matching_tour_ids = [t.id for t in budget_tour_objects]
         elif any(keyword in query_lower for keyword in ['tour', 'travel', 'vacation', 'trip', 'destination', 'where', 'visit']):
             # Only recommend tours if user mentions travel-related keywords
@@ -493,12 +627,8 @@ The system will automatically display tour details in cards - you focus on conve
         
         # Generate response based on matches
         if recommended_tours:
-            if 'japan' in query_lower or 'tokyo' in query_lower:
-                response = "Great! I found some amazing tours in Japan that offer incredible cultural experiences!"
-            elif 'thailand' in query_lower or 'asia' in query_lower:
-                response = "Excellent! I discovered some fantastic tours in Asia that would be perfect for you!"
-            elif 'europe' in query_lower or 'switzerland' in query_lower:
-                response = "Perfect! I found some wonderful European tours with stunning alpine experiences!"
+            if place:
+                response = f"Great! I found some amazing tours in {place_name} that would be perfect for you!"
             elif 'adventure' in query_lower or 'hiking' in query_lower:
                 response = "Amazing! I found some thrilling adventure tours that will get your adrenaline pumping!"
             elif 'luxury' in query_lower or 'expensive' in query_lower:
@@ -529,8 +659,20 @@ The system will automatically display tour details in cards - you focus on conve
         # Use mock response if OpenAI is not available
         if self.use_mock:
             print(f"   → Using mock response system")
+            MOCK_FALLBACKS.inc('disabled' if settings.LLM_BACKEND == 'mock' else 'unavailable')
+            tours_data = self.get_all_tours_data()
+            return self._record_impressions(
+                self._get_mock_response(user_query, tours_data, chat_history, context_info), MOCK_TOOL, conversation
+            )
+        
+        # While the upstream is unhealthy, answer immediately instead of waiting on it
+        if breaker.is_open():
+            print(f"   → LLM circuit breaker open, using mock response system")
+            MOCK_FALLBACKS.inc('circuit_open')
             tours_data = self.get_all_tours_data()
-            return self._get_mock_response(user_query, tours_data, chat_history, context_info)
+            return self._record_impressions(
+                self._get_mock_response(user_query, tours_data, chat_history, context_info), MOCK_TOOL, conversation
+            )
         
         try:
             print(f"   → Using LangChain agent with tools")
@@ -554,51 +696,83 @@ The system will automatically display tour details in cards - you focus on conve
                         chat_messages.append(AIMessage(content=msg[10:].strip()))
                 agent_input["chat_history"] = chat_messages
             
-            # Use the agent to process the query
-            result = self.agent_executor.invoke(agent_input)
+            # Use the agent to process the query; its search tools record candidates for ranking
+            with llm_deadline(settings.LLM_CHAT_DEADLINE), collect_candidates() as candidates:
+                result = run_with_budget(self.agent_executor, agent_input, self._collect_tour_ids, llm=self.llm)
             response_text = result["output"]
+            AGENT_ITERATIONS.observe(len(result.get("intermediate_steps", [])))
+            if result["stop_reason"] != "finished":
+                print(f"   → Agent stopped early: {result['stop_reason']}")
             
             # Extract recommended tours from the agent's tool calls
-            recommended_tours = self._extract_tours_from_agent_response(result)
+            recommended_tours = self._extract_tours_from_agent_response(result, candidates)
             
             print(f"   → Agent completed. Response length: {len(response_text)} chars")
             print(f"   → Extracted {len(recommended_tours)} tours from tool results")
             
-            return {
+            return self._record_impressions({
                 'response': response_text,
                 'recommended_tours': recommended_tours
-            }
+            }, self._tour_sources(result, candidates), conversation)
             
         except Exception as e:
             print(f"   ❌ Agent error: {e}")
             print(f"   → Falling back to mock response")
+            MOCK_FALLBACKS.inc('agent_error')
             # Fallback to mock response if agent fails
             tours_data = self.get_all_tours_data()
-            return self._get_mock_response(user_query, tours_data, chat_history, context_info)
+            return self._record_impressions(
+                self._get_mock_response(user_query, tours_data, chat_history, context_info), MOCK_TOOL, conversation
+            )
     
-    def _extract_tours_from_agent_response(self, agent_result):
-        """Extract tour IDs from agent's intermediate steps and return full tour data for frontend"""
+    @staticmethod
+    def _record_impressions(result, tools, conversation):
+        """Log the shown tours as recommendation impressions (users.impressions) and return ``result``"""
+        impressions.record([tour['id'] for tour in result['recommended_tours']], tools, conversation)
+        return result
+    
+    @staticmethod
+    def _tour_sources(agent_result, candidates=None):
+        """``{tour ID: tool that found it}``: the tool ranking it highest, else the first tool to return it"""
+        if candidates is not None and candidates.pools:
+            return candidates.sources()
+        sources = {}
+        for step in agent_result.get('intermediate_steps', []):
+            if len(step) > 1 and isinstance(step[1], list):
+                for tour_data in step[1]:
+                    if isinstance(tour_data, dict) and 'id' in tour_data:
+                        sources.setdefault(tour_data['id'], getattr(step[0], 'tool', impressions.RANKING_TOOL))
+        return sources
+    
+    @staticmethod
+    def _collect_tour_ids(steps):
+        """Distinct tour IDs in tool outputs, in the order they were found"""
         tour_ids = []
+        for step in steps:
+            if len(step) > 1:
+                tool_output = step[1]  # Tool output is the second element
+                if isinstance(tool_output, list) and tool_output:
+                    # Extract tour IDs from minimal LLM data
+                    for tour_data in tool_output:
+                        if isinstance(tour_data, dict) and 'id' in tour_data:
+                            tour_ids.append(tour_data['id'])
+        return list(dict.fromkeys(tour_ids))
+    
+    @replica_reads
+    def _extract_tours_from_agent_response(self, agent_result, candidates=None):
+        """Rank the tours found by the agent's tool calls and return the top ones for the frontend"""
+        if candidates is not None and candidates.pools:
+            tour_ids = candidates.ranked()
+        else:
+            # No candidates recorded: tool outputs in the order they were found
+            tour_ids = self._collect_tour_ids(agent_result.get('intermediate_steps', []))
+        tour_ids = tour_ids[:settings.RANKING_TOP_K]
         
-        # Look through the agent's intermediate steps for tool outputs
-        if 'intermediate_steps' in agent_result:
-            for step in agent_result['intermediate_steps']:
-                if len(step) > 1:
-                    tool_output = step[1]  # Tool output is the second element
-                    if isinstance(tool_output, list) and tool_output:
-                        # Extract tour IDs from minimal LLM data
-                        for tour_data in tool_output:
-                            if isinstance(tour_data, dict) and 'id' in tour_data:
-                                tour_ids.append(tour_data['id'])
-        
-        # Remove duplicates and limit to 5 tours
-        unique_tour_ids = list(dict.fromkeys(tour_ids))[:5]
-        
-        # Get full tour objects and serialize for frontend
-        if unique_tour_ids:
+        # Hydrate only the final top tours, in one query, in ranked order
+        if tour_ids:
             from .models import Tour
-            tours = Tour.objects.filter(id__in=unique_tour_ids, is_active=True)
-            return _serialize_tours_for_frontend(tours)
+            tours = Tour.objects.filter(id__in=tour_ids, is_active=True).select_related('agent__tour_company').in_bulk()
+            return _serialize_tours_for_frontend([tours[tour_id] for tour_id in tour_ids if tour_id in tours])
         
         return []
     
@@ -664,4 +838,24 @@ The system will automatically display tour details in cards - you focus on conve
                     if len(recommended_tours) >= 3:  # Limit to 3 recommendations
                         break
         
-        return recommended_tours[:3]  # Return max 3 recommendations
\ No newline at end of file
+        return recommended_tours[:3]  # Return max 3 recommendations
+
+
+_service = None
+_service_key = None
+_service_lock = threading.Lock()
+
+
+def get_recommendation_service():
+    """
+    Process-wide TourRecommendationService, so the LLM client, its connection pool and the
+    agent are built once instead of per request. Rebuilt when the LLM settings change.
+    """
+    global _service, _service_key
+    key = (settings.LLM_BACKEND, settings.OPENAI_BASE_URL, settings.LLM_CASSETTE, settings.LLM_CASSETTE_MODE,
+           settings.AGENT_PARALLEL_TOOLS)
+    with _service_lock:
+        if _service is None or _service_key != key:
+            _service = TourRecommendationService()
+            _service_key = key
+        return _service
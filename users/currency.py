@@ -0,0 +1,210 @@
+"""
+Prices in more than one currency.
+
+A tour is priced in its agency's currency (``Tour.currency``) and also stores that price in
+US dollars (``Tour.price_usd``, indexed). Price filters in any display currency convert their
+bounds to dollars and stay a range on that one column; only the page being returned is
+converted for display.
+
+Rates come from a local JSON file (``FX_RATES_FILE``, units of each currency per dollar). Each
+process loads it into a conversion matrix (``matrix[i, j]`` turns one unit of currency ``i``
+into currency ``j``) and reloads it when the file changes, so a page of prices in mixed
+currencies is converted with one NumPy expression. Updating the file doesn't touch stored
+dollar prices: run ``manage.py refresh_prices`` afterwards.
+"""
+import json
+import math
+import os
+import threading
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+BASE_CURRENCY = 'USD'
+
+SYMBOLS = {
+    'AED': 'AED ', 'AUD': 'A$', 'AZN': '₼', 'CAD': 'C$', 'CHF': 'CHF ', 'CNY': 'CN¥', 'EUR': '€', 'GBP': '£',
+    'GEL': '₾', 'IDR': 'Rp', 'INR': '₹', 'JPY': '¥', 'KZT': '₸', 'RUB': '₽', 'THB': '฿', 'TRY': '₺', 'USD': '$',
+}
+# ISO 4217 currencies without minor units in common use; all others show two decimals
+ZERO_DECIMAL = {'IDR', 'JPY', 'KRW', 'VND'}
+
+CENT = Decimal('0.01')
+
+
+class FxTable:
+    """Exchange rates as a matrix over the sorted currency codes"""
+
+    def __init__(self, rates, as_of=None):
+        self.codes = sorted(rates)
+        self.positions = {code: position for position, code in enumerate(self.codes)}
+        per_dollar = np.array([float(rates[code]) for code in self.codes], dtype=np.float64)
+        self.matrix = per_dollar[np.newaxis, :] / per_dollar[:, np.newaxis]
+        self.as_of = as_of
+
+    def __contains__(self, code):
+        return code in self.positions
+
+    def rate(self, source, target):
+        """Units of ``target`` for one unit of ``source``"""
+        return float(self.matrix[self.positions[source], self.positions[target]])
+
+    def convert(self, amounts, currencies, target):
+        """``amounts`` (each in the matching entry of ``currencies``) in ``target``, as a float array"""
+        column = self.matrix[:, self.positions[target]]
+        sources = np.fromiter((self.positions[code] for code in currencies), dtype=np.intp, count=len(currencies))
+        return np.asarray(amounts, dtype=np.float64) * column[sources]
+
+
+_lock = threading.Lock()
+_table = None
+_loaded = None
+
+
+def fx_table():
+    """The rates in ``FX_RATES_FILE``, reloaded when the file changes"""
+    global _table, _loaded
+    path = settings.FX_RATES_FILE
+    stat = os.stat(path)
+    version = (path, stat.st_mtime_ns, stat.st_size)
+    if version != _loaded:
+        with _lock:
+            if version != _loaded:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('base', BASE_CURRENCY) != BASE_CURRENCY:
+                    raise ValueError(f"{path}: rates must be per {BASE_CURRENCY}")
+                _table = FxTable(data['rates'], data.get('as_of'))
+                _loaded = version
+    return _table
+
+
+def supported(code):
+    """``code`` upper-cased if there is a rate for it, else ``None``"""
+    code = (code or '').strip().upper()
+    return code if code in fx_table() else None
+
+
+def validate_currency(value):
+    if value not in fx_table():
+        raise ValidationError(f"No exchange rate for {value!r}; see FX_RATES_FILE.")
+
+
+def to_base(amount, currency):
+    """``amount`` in ``currency`` as a dollar ``Decimal`` rounded to cents (``Tour.price_usd``)"""
+    if currency == BASE_CURRENCY:
+        return Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP)
+    table = fx_table()
+    if currency not in table:
+        raise ValueError(f"No exchange rate for {currency!r}")
+    return Decimal(str(float(amount) * table.rate(currency, BASE_CURRENCY))).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def display_prices(tours, target):
+    """
+    ``(currency, amount)`` of each tour's price shown in ``target``. A tour whose currency has lost its
+    rate is shown from its stored dollar price, else in its own price and currency.
+    """
+    table = fx_table()
+    sources = []
+    for tour in tours:
+        if tour.currency in table:
+            sources.append((tour.price, tour.currency))
+        elif BASE_CURRENCY in table:
+            sources.append((tour.price_usd, BASE_CURRENCY))
+        else:
+            sources.append(None)
+    convertible = [source for source in sources if source]
+    amounts = iter(table.convert(
+        [amount for amount, _ in convertible], [currency for _, currency in convertible], target
+    ) if convertible else ())
+    return [
+        (target, next(amounts)) if source else (tour.currency, float(tour.price))
+        for tour, source in zip(tours, sources)
+    ]
+
+
+def base_bound(amount, currency):
+    """
+    A price filter bound given in ``currency``, in dollars, rounded to the cent as stored dollar prices
+    are (``to_base``): a tour priced exactly at the bound, in any currency, then compares equal to it.
+    Widening an unrounded bound instead doesn't survive the database, which rounds the parameter to
+    the column's cents.
+    """
+    if not math.isfinite(amount):
+        raise ValueError(f"Price bound must be a finite number, not {amount!r}")
+    return to_base(amount, currency)
+
+
+def round_price(amount, currency):
+    return round(float(amount), 0 if currency in ZERO_DECIMAL else 2)
+
+
+def format_price(amount, currency):
+    decimals = 0 if currency in ZERO_DECIMAL else 2
+    if currency in SYMBOLS:
+        return f"{SYMBOLS[currency]}{amount:,.{decimals}f}"
+    return f"{amount:,.{decimals}f} {currency}"
+
+
+def display_currency(request):
+    """The currency to show prices in: ``?currency=``, else the user's preferred currency, else dollars"""
+    if request is None:
+        return BASE_CURRENCY
+    params = getattr(request, 'query_params', request.GET)
+    code = supported(params.get('currency', ''))
+    if code:
+        return code
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        # A claim of the access token (users.authentication), so this doesn't load the user
+        return supported(user.preferred_currency) or BASE_CURRENCY
+    return BASE_CURRENCY
+
+
+def refresh_base_prices(batch_size=1000):
+    """
+    Recompute ``Tour.price_usd`` at the current rates, in batches of the rows that change (with a
+    new ``updated_at``, and logged as changes of active tours, users.changes). Returns the number of
+    tours updated and the currencies without a rate, whose tours are left alone.
+    """
+    from django.db import transaction
+    from django.utils import timezone
+
+    from .catalog import catalog_changed
+    from .models import Tour, TourChange
+
+    table = fx_table()
+    updated = 0
+    missing = []
+    currencies = Tour.objects.exclude(currency=BASE_CURRENCY).order_by().values_list('currency', flat=True).distinct()
+    for currency in currencies:
+        if currency not in table:
+            missing.append(currency)
+            continue
+        # to_base in Python, as Tour.save() computes it: a database-side product rounds differently
+        # at the half cent, and those rows would be rewritten on every run
+        stale = []
+        rows = Tour.objects.filter(currency=currency).values_list('id', 'price', 'price_usd', 'is_active')
+        for tour_id, price, price_usd, is_active in rows.iterator(chunk_size=batch_size):
+            value = to_base(price, currency)
+            if value != price_usd:
+                stale.append((tour_id, value, is_active))
+        for start in range(0, len(stale), batch_size):
+            batch = stale[start:start + batch_size]
+            now = timezone.now()
+            with transaction.atomic():
+                Tour.objects.bulk_update(
+                    [Tour(id=tour_id, price_usd=value, updated_at=now) for tour_id, value, _ in batch],
+                    ['price_usd', 'updated_at'],
+                )
+                TourChange.objects.bulk_create([
+                    TourChange(tour_id=tour_id, kind='updated', fields={'price_usd': value})
+                    for tour_id, value, is_active in batch if is_active
+                ])
+            updated += len(batch)
+    if updated:
+        catalog_changed()
+    return updated, missing
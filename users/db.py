@@ -0,0 +1,106 @@
+"""
+Database connection helpers: connect timing, query counting and streaming large querysets.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_opened_connections = contextvars.ContextVar('opened_connections', default=None)
+_query_counter = contextvars.ContextVar('query_counter', default=None)
+
+
+class ConnectTimingMixin:
+    """
+    For the project's database backends (users.db_backends, set as ``ENGINE``): notes when
+    ``connect()`` starts, so ``connection_created`` (sent at its end) can time it.
+    """
+
+    def connect(self):
+        self.connect_started_at = time.monotonic()
+        super().connect()
+
+
+def _record_connection(sender, connection, **kwargs):
+    opened = _opened_connections.get()
+    if opened is None:
+        return
+    started = getattr(connection, 'connect_started_at', None)
+    elapsed_ms = None if started is None else (time.monotonic() - started) * 1000
+    opened.append((connection.alias, elapsed_ms))
+
+
+connection_created.connect(_record_connection, dispatch_uid='users.db.record_connection')
+
+
+@contextlib.contextmanager
+def time_new_connections():
+    """
+    Collect ``(alias, connect_ms)`` for every database connection opened inside the block.
+
+    Nothing is opened for the timing itself: with persistent connections a reused connection
+    doesn't show up, and one that was never used isn't opened at all. ``connect_ms`` covers
+    the whole ``connect()``: handshake, authentication and session setup.
+    """
+    opened = []
+    token = _opened_connections.set(opened)
+    try:
+        yield opened
+    finally:
+        _opened_connections.reset(token)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _wrap_connections(stack, wrapper):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(wrapper))
+
+
+@contextlib.contextmanager
+def count_queries():
+    """
+    Count the SQL queries run inside the block (``.count`` of the yielded counter), including those of
+    other threads running in a copy of this context inside ``count_context_queries()``.
+    """
+    counter = _QueryCounter()
+    token = _query_counter.set(counter)
+    try:
+        with contextlib.ExitStack() as stack:
+            _wrap_connections(stack, counter)
+            yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+@contextlib.contextmanager
+def count_context_queries():
+    """Add this thread's queries in the block to the ``count_queries()`` of its (copied) context, if any"""
+    counter = _query_counter.get()
+    with contextlib.ExitStack() as stack:
+        if counter is not None:
+            _wrap_connections(stack, counter)
+        yield
+
+
+def iterate_queryset(queryset, chunk_size=None):
+    """
+    Stream a queryset without loading it into memory.
+
+    On PostgreSQL this uses a server-side cursor (unless DISABLE_SERVER_SIDE_CURSORS is set),
+    fetching ``chunk_size`` rows per round trip. Use it for exports and batch jobs.
+    """
+    return queryset.iterator(chunk_size=chunk_size or settings.DB_EXPORT_CHUNK_SIZE)
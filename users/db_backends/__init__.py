@@ -0,0 +1,4 @@
+"""
+Django's database backends with connect timing (``users.db.ConnectTimingMixin``), selected
+through ``DATABASES[...]['ENGINE']``.
+"""
@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from users.db import ConnectTimingMixin
+
+
+class DatabaseWrapper(ConnectTimingMixin, base.DatabaseWrapper):
+    pass
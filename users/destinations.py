@@ -0,0 +1,178 @@
+"""
+Destination lookups served from memory: autocomplete, the list of destinations on offer, and
+resolving a place name ("Bali", "Japan", "Southeast Asia", "Europe") to destination IDs.
+
+``DestinationIndex`` loads the (small) country and destination tables plus each destination's
+active tour count whenever the catalog changes. Place names are resolved here and the tours
+then filtered with ``place_id__in``, an indexed foreign key lookup, instead of a substring
+scan over the destination text. Autocomplete is a binary search over the sorted lowercase
+names of destinations, cities, countries, regions and continents: every name starting with
+the prefix is contiguous in that list.
+"""
+import bisect
+import re
+from collections import defaultdict
+
+from django.db.models import Count, Q
+
+from .catalog import CatalogCache
+from .geography import COUNTRY_ALIASES, destination_key
+from .models import Country, Destination, Tour
+
+KINDS = ('destination', 'city', 'country', 'region', 'continent')
+# Longest place name, in words, looked for in free text ("dominican republic", "central america & caribbean")
+MAX_NAME_WORDS = 4
+WORD_RE = re.compile(r"[\w&'-]+")
+# Words after which a lowercase one-word name reads as a place ("tours in japan", "a trip to nice")
+PLACE_CONTEXT = frozenset('to in at visit visiting around near explore exploring from'.split())
+
+
+def _normalize(text):
+    return ' '.join((text or '').lower().replace(',', ' , ').split()).replace(' , ', ', ')
+
+
+class _Snapshot:
+    """One immutable load, swapped in whole so readers never see a partial reload"""
+
+    def __init__(self, countries, destinations, counts):
+        self.labels = {}
+        self.members = defaultdict(set)
+        self.tours = {}
+        places = defaultdict(set)
+
+        for country_id, name, region, continent in countries:
+            places[('country', name)].add(country_id)
+            if region:
+                places[('region', region)].add(country_id)
+            if continent:
+                places[('continent', continent)].add(country_id)
+        by_country = defaultdict(set)
+        self.available = []
+        for destination_id, name, city, country_id in destinations:
+            by_country[country_id].add(destination_id)
+            self.members[('destination', _normalize(name))] = {destination_id}
+            self.labels[('destination', _normalize(name))] = name
+            if city:
+                self.members[('city', _normalize(city))].add(destination_id)
+                self.labels[('city', _normalize(city))] = city
+            if counts.get(destination_id):
+                self.available.append(name)
+        self.available.sort()
+        for (kind, name), country_ids in places.items():
+            key = (kind, _normalize(name))
+            self.labels[key] = name
+            self.members[key] = set().union(*(by_country[country_id] for country_id in country_ids))
+        for (kind, name), destination_ids in self.members.items():
+            self.tours[(kind, name)] = sum(counts.get(destination_id, 0) for destination_id in destination_ids)
+
+        # Aliases ("uae", "usa") resolve like the country they stand for but aren't suggested
+        for alias, country in COUNTRY_ALIASES.items():
+            if ('country', _normalize(country)) in self.members:
+                self.members[('alias', alias)] = self.members[('country', _normalize(country))]
+                self.labels[('alias', alias)] = country
+
+        self.kinds = defaultdict(list)
+        for kind, name in self.labels:
+            if kind != 'alias':
+                self.kinds[name].append(kind)
+        self.names = sorted(self.kinds)
+
+
+class DestinationIndex(CatalogCache):
+    def __init__(self):
+        super().__init__()
+        self.snapshot = _Snapshot([], [], {})
+
+    def load(self):
+        countries = list(Country.objects.values_list('id', 'name', 'region', 'continent'))
+        destinations = list(Destination.objects.values_list('id', 'name', 'city', 'country_id'))
+        counts = dict(
+            Tour.objects.filter(is_active=True, place__isnull=False).order_by()
+            .values_list('place_id').annotate(count=Count('id'))
+        )
+        self.snapshot = _Snapshot(countries, destinations, counts)
+
+    def available(self):
+        """Names of the destinations that have active tours, sorted"""
+        self.refresh()
+        return list(self.snapshot.available)
+
+    def lookup(self, text):
+        """
+        Destination IDs a place name covers, or ``None`` if it isn't a known place. The most specific
+        reading wins: a destination, then a city, a country (or alias), a region, a continent.
+        """
+        self.refresh()
+        snapshot = self.snapshot
+        name = _normalize(text)
+        if ('destination', destination_key(name)) in snapshot.members:
+            return sorted(snapshot.members[('destination', destination_key(name))])
+        for kind in ('city', 'country', 'alias', 'region', 'continent'):
+            if (kind, name) in snapshot.members:
+                return sorted(snapshot.members[(kind, name)])
+        return None
+
+    def mentioned(self, text):
+        """
+        ``(label, destination IDs)`` of the first place named in free text, preferring the longest name
+        at each position ("South Africa" over "Africa"); ``None`` if there is none. A one-word name must
+        read as a place: capitalised ("Nice") or introduced by a word like "to" or "in" ("a trip to
+        nice"), so "a nice beach trip" names nothing.
+        """
+        self.refresh()
+        snapshot = self.snapshot
+        tokens = WORD_RE.findall(text or '')
+        words = [token.lower() for token in tokens]
+        for start in range(len(words)):
+            for length in range(min(MAX_NAME_WORDS, len(words) - start), 0, -1):
+                if length == 1 and not (tokens[start][:1].isupper() or (start and words[start - 1] in PLACE_CONTEXT)):
+                    continue
+                name = ' '.join(words[start:start + length])
+                # Not aliases: "us" and "uk" are ordinary words in a sentence
+                for kind in ('city', 'country', 'region', 'continent'):
+                    if (kind, name) in snapshot.members:
+                        return snapshot.labels[(kind, name)], sorted(snapshot.members[(kind, name)])
+        return None
+
+    def autocomplete(self, prefix, limit=10):
+        """Places whose name starts with ``prefix``, the ones with the most active tours first"""
+        self.refresh()
+        snapshot = self.snapshot
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        matches = []
+        position = bisect.bisect_left(snapshot.names, prefix)
+        while position < len(snapshot.names) and snapshot.names[position].startswith(prefix):
+            name = snapshot.names[position]
+            position += 1
+            # A name can be several kinds of place at once (Singapore the city and the country)
+            for kind in snapshot.kinds[name]:
+                if snapshot.tours.get((kind, name)):
+                    matches.append((-snapshot.tours[(kind, name)], KINDS.index(kind), snapshot.labels[(kind, name)], kind, name))
+        suggestions = []
+        seen = set()
+        for tours, _, label, kind, name in sorted(matches):
+            # "Paris" the city covers the same tours as "Paris, France": keep the most specific
+            members = frozenset(snapshot.members[(kind, name)])
+            if members not in seen:
+                seen.add(members)
+                suggestions.append({'type': kind, 'name': label, 'tours': -tours})
+                if len(suggestions) == limit:
+                    break
+        return suggestions
+
+
+index = DestinationIndex()
+
+
+def destination_condition(text):
+    """
+    The tours a ``destination`` filter selects, shared by the tour list and its facet counts: a known
+    place (destination, city, country, region or continent) is an indexed lookup on the normalized
+    destination, anything else matches the destination text (ignoring case).
+    """
+    place_ids = index.lookup(text)
+    if place_ids is not None:
+        return Q(place_id__in=place_ids)
+    return Q(destination__iexact=text)
@@ -0,0 +1,312 @@
+"""
+Semantic search over tours with hashed text embeddings.
+
+Tours are embedded on the CPU by ``HashingVectorizer``: words, word pairs and character
+4-grams of the title, destination and description (so "romantic" also matches "Romance"),
+plus shared concept features for related travel terms ("mountains" and "Alps" both add the
+mountain concept), hashed into ``EMBEDDING_DIM`` signed buckets and L2-normalized.
+
+Vectors are stored as float32 bytes in ``TourEmbedding`` (one row per tour, re-embedded on
+save and after imports) and searched in process: ``VectorIndex`` keeps them in one float32
+matrix and scores queries with a matrix product. It picks up new and changed rows
+incrementally, checking the table at most every ``EMBEDDING_REFRESH_INTERVAL`` seconds
+(immediately in the process that saved them). Rows are stamped before they commit, so each
+check re-reads those stamped up to ``TOUR_CHANGES_SETTLE_SECONDS`` before the previous one
+began, which covers rows that committed after a later-stamped row had been loaded. Deleted
+tours are dropped by following the ``deleted`` entries of the tour change log (users.changes)
+from the last settled ``seq``.
+
+The matrix is held by every worker process (see ``VectorIndex`` for its size); the similar
+tours catalog (users.similarity) reads it in place rather than copying it. Deployments with
+many workers and a large catalog should lower ``EMBEDDING_DIM`` or run fewer processes with
+more threads.
+
+Build or rebuild the table with ``manage.py embed_tours``.
+"""
+import datetime
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max, Q, F
+from django.utils import timezone
+
+from . import changes
+from .models import Tour, TourChange, TourEmbedding
+
+VECTORIZER_VERSION = 1
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in into is it of on or our the their this to with your you we i me my'
+    ' want looking like some any tour tours trip trips travel show find'.split()
+)
+
+# Related words that share a concept feature, so queries match tours that describe the same idea differently
+CONCEPTS = {
+    'mountain': 'mountain mountains alps alpine peak peaks summit hiking hike trek trekking himalaya himalayas '
+                'andes dolomites ski skiing glacier glaciers',
+    'romance': 'romantic romance honeymoon couple couples sunset sunsets intimate love getaway',
+    'beach': 'beach beaches island islands coast coastal seaside sand snorkeling snorkel diving tropical lagoon reef',
+    'culture': 'cultural culture history historic historical heritage museum museums temple temples ancient art',
+    'wildlife': 'safari safaris wildlife animals savanna savannah game reserve',
+    'food': 'food foodie culinary cuisine gastronomy gastronomic wine wines tasting cooking',
+    'adventure': 'adventure adventures adventurous rafting zipline climbing canyon kayak kayaking',
+    'wellness': 'wellness spa yoga retreat relaxation relax relaxing meditation',
+    'city': 'city cities urban nightlife shopping metropolis',
+    'family': 'family families kids children',
+    'luxury': 'luxury luxurious premium exclusive boutique',
+}
+WORD_CONCEPTS = {}
+for _concept, _words in CONCEPTS.items():
+    for _word in _words.split():
+        WORD_CONCEPTS.setdefault(_word, []).append(_concept)
+
+
+def _bucket(feature, dim):
+    """Stable (not per-process salted) bucket index and sign of a feature"""
+    h = zlib.crc32(feature.encode())
+    return h % dim, 1.0 if (h // dim) & 1 else -1.0
+
+
+class HashingVectorizer:
+    def __init__(self, dim=None):
+        self.dim = dim or settings.EMBEDDING_DIM
+
+    @property
+    def signature(self):
+        """Stored with every vector; rows of another vectorizer version or size are re-embedded"""
+        return f'hashing-v{VECTORIZER_VERSION}-{self.dim}'
+
+    def features(self, text, weight=1.0):
+        words = [word for word in TOKEN_RE.findall(text.lower()) if word not in STOPWORDS]
+        for word in words:
+            yield 'w:' + word, weight
+            for concept in WORD_CONCEPTS.get(word, ()):
+                yield 'k:' + concept, 1.5 * weight
+            padded = f'#{word}#'
+            for i in range(len(padded) - 3):
+                yield 'c:' + padded[i:i + 4], 0.25 * weight
+        for first, second in zip(words, words[1:]):
+            yield f'b:{first} {second}', 0.5 * weight
+
+    def transform(self, texts):
+        """float32 matrix of L2-normalized vectors; ``texts`` items are strings or ``[(text, weight), ...]``"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, parts in enumerate(texts):
+            if isinstance(parts, str):
+                parts = [(parts, 1.0)]
+            values = {}
+            for text, weight in parts:
+                for feature, feature_weight in self.features(text or '', weight):
+                    index, sign = _bucket(feature, self.dim)
+                    values[index] = values.get(index, 0.0) + sign * feature_weight
+            if values:
+                matrix[row, list(values)] = list(values.values())
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def tour_text(tour):
+    return [(tour.title, 2.0), (tour.destination, 2.0), (tour.description, 1.0)]
+
+
+def embed_tours(tours, vectorizer=None, batch_size=1000):
+    """Compute and store the embeddings of ``tours``; returns how many were written"""
+    vectorizer = vectorizer or HashingVectorizer()
+    tours = list(tours)
+    for start in range(0, len(tours), batch_size):
+        batch = tours[start:start + batch_size]
+        vectors = vectorizer.transform([tour_text(tour) for tour in batch])
+        TourEmbedding.objects.bulk_create(
+            [
+                TourEmbedding(tour_id=tour.pk, model=vectorizer.signature, vector=vector.tobytes())
+                for tour, vector in zip(batch, vectors)
+            ],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['tour'],
+            update_fields=['model', 'vector', 'updated_at'],
+        )
+    if tours:
+        index.mark_stale()
+    return len(tours)
+
+
+def stale_tours(queryset=None, vectorizer=None):
+    """Tours without an embedding, with one older than the tour, or from another vectorizer"""
+    vectorizer = vectorizer or HashingVectorizer()
+    queryset = Tour.objects.all() if queryset is None else queryset
+    return queryset.filter(
+        Q(embedding__isnull=True)
+        | Q(embedding__updated_at__lt=F('updated_at'))
+        | ~Q(embedding__model=vectorizer.signature)
+    ).only('id', 'title', 'destination', 'description')
+
+
+def embed_stale_tours(queryset=None, batch_size=1000):
+    """Bring embeddings up to date after writes that bypass signals (bulk import, bulk_create)"""
+    vectorizer = HashingVectorizer()
+    return embed_tours(stale_tours(queryset, vectorizer).iterator(chunk_size=batch_size), vectorizer, batch_size)
+
+
+class VectorIndex:
+    """
+    In-process float32 matrix of the stored embeddings with top-k cosine search.
+
+    Every process holds its own copy: about tours x ``EMBEDDING_DIM`` x 4 bytes (200 MB for
+    100,000 tours at 512 dimensions), plus at most a quarter more of spare rows for appends.
+    """
+
+    def __init__(self):
+        self.vectorizer = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = None
+        self.size = 0
+        self.positions = {}
+        self.removed = 0
+        self.seq = 0
+        self.loaded_until = None
+        self.refreshed_at = None
+        self.checked_at = 0.0
+        self.stale = True
+        self._lock = threading.Lock()
+
+    def mark_stale(self):
+        self.stale = True
+
+    def refresh(self):
+        """Load rows added or changed since the last refresh and drop the vectors of deleted tours"""
+        interval = settings.EMBEDDING_REFRESH_INTERVAL
+        if not self.stale and time.monotonic() - self.checked_at < interval:
+            return
+        with self._lock:
+            started = timezone.now()
+            vectorizer = HashingVectorizer()
+            rows = TourEmbedding.objects.filter(model=vectorizer.signature)
+            latest = changes.latest()[0]
+            self.checked_at = time.monotonic()
+            self.stale = False
+            if (
+                self.vectorizer is None or self.vectorizer.signature != vectorizer.signature
+                # The change log went backwards (a restored database), or removals left too many holes
+                or latest < self.seq or self.removed > self.size // 4
+            ):
+                # First load, settings change, unknown state or compaction: start over
+                self.vectorizer = vectorizer
+                self.ids = np.empty(0, dtype=np.int64)
+                self.matrix = np.empty((0, vectorizer.dim), dtype=np.float32)
+                self.size = 0
+                self.positions = {}
+                self.removed = 0
+                self.seq = latest
+                self.loaded_until = None
+            else:
+                self._remove_deleted()
+            latest_update = rows.aggregate(latest=Max('updated_at'))['latest']
+            if latest_update is None:
+                return
+            if self.loaded_until is not None:
+                settle = datetime.timedelta(seconds=settings.TOUR_CHANGES_SETTLE_SECONDS)
+                rows = rows.filter(updated_at__gte=min(self.loaded_until, self.refreshed_at - settle))
+            self.refreshed_at = started
+            for tour_id, vector, updated_at in rows.values_list('tour_id', 'vector', 'updated_at').iterator(chunk_size=2000):
+                self._put(tour_id, np.frombuffer(vector, dtype=np.float32))
+                if self.loaded_until is None or updated_at > self.loaded_until:
+                    self.loaded_until = updated_at
+
+    def _remove_deleted(self):
+        """
+        Drop the tours deleted since ``seq`` (deleting a tour deletes its embedding row). Their rows
+        become zero-vector holes, so positions stay put for snapshot holders.
+        """
+        cursor = changes.cursor()
+        deleted = TourChange.objects.filter(seq__gt=self.seq, kind='deleted').values_list('tour_id', flat=True)
+        for tour_id in deleted:
+            position = self.positions.pop(tour_id, None)
+            if position is not None:
+                self.matrix[position] = 0
+                self.ids[position] = -1
+                self.removed += 1
+        # Entries up to the settled cursor can't be joined by earlier-numbered ones any more
+        self.seq = max(self.seq, cursor)
+
+    def _put(self, tour_id, vector):
+        position = self.positions.get(tour_id)
+        if position is None:
+            if self.size == len(self.matrix):
+                # Grow by a quarter so incremental appends stay cheap without doubling the footprint
+                capacity = max(1024, self.size + self.size // 4)
+                matrix = np.empty((capacity, self.vectorizer.dim), dtype=np.float32)
+                matrix[:self.size] = self.matrix[:self.size]
+                ids = np.empty(capacity, dtype=np.int64)
+                ids[:self.size] = self.ids[:self.size]
+                self.matrix, self.ids = matrix, ids
+            position = self.positions[tour_id] = self.size
+            self.size += 1
+            self.ids[position] = tour_id
+        self.matrix[position] = vector
+
+    def snapshot(self):
+        """``(positions, matrix)``: tour ID to row, and the current float32 matrix (read-only)"""
+        self.refresh()
+        with self._lock:
+            return dict(self.positions), self.matrix[:self.size]
+
+    def vector_of(self, tour_id):
+        self.refresh()
+        position = self.positions.get(tour_id)
+        return None if position is None else self.matrix[position].copy()
+
+    def search(self, query, k=10, exclude=()):
+        """``[(tour_id, similarity), ...]`` best first; ``query`` is text or a vector"""
+        return self.search_many([query], k, exclude)[0]
+
+    def search_many(self, queries, k=10, exclude=()):
+        """Top-k for a batch of queries with one matrix product"""
+        self.refresh()
+        if not queries:
+            return []
+        vectors = np.vstack([
+            self.vectorizer.transform([query])[0] if isinstance(query, str) else np.asarray(query, dtype=np.float32)
+            for query in queries
+        ])
+        with self._lock:
+            ids = self.ids[:self.size]
+            scores = vectors @ self.matrix[:self.size].T
+        if exclude:
+            scores[:, np.isin(ids, list(exclude))] = -np.inf
+        k = min(k, len(ids))
+        results = []
+        for row in scores:
+            if k == 0:
+                results.append([])
+                continue
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.lexsort((ids[top], -row[top]))]
+            results.append([(int(ids[i]), float(row[i])) for i in top if row[i] > 0])
+        return results
+
+
+index = VectorIndex()
+
+
+def similar_tours(query=None, tour_id=None, k=10, queryset=None):
+    """
+    Active tours most similar to ``query`` text or to tour ``tour_id``, as ``[(tour, similarity), ...]``.
+    Inactive tours keep their embeddings, so a few extra candidates are fetched and filtered.
+    """
+    if tour_id is not None:
+        vector = index.vector_of(tour_id)
+        if vector is None:
+            return []
+        hits = index.search(vector, k * 2 + 10, exclude=(tour_id,))
+    else:
+        hits = index.search(query or '', k * 2 + 10)
+    queryset = Tour.objects.all() if queryset is None else queryset
+    tours = queryset.filter(id__in=[hit_id for hit_id, _ in hits], is_active=True).in_bulk()
+    return [(tours[hit_id], score) for hit_id, score in hits if hit_id in tours][:k]
@@ -0,0 +1,220 @@
+"""
+Facet counts for the Discover filters ("Bali (12)", "All Inclusive (40)", price ranges).
+
+``FacetIndex`` keeps the active catalog's filterable attributes as NumPy arrays (integer codes
+for normalized destination, meal plan and flight type, plus visa flag, dollar price and dates) and answers a
+facet request with boolean masks and ``bincount``: no query per facet value, and no query at
+all apart from the catalog version check, except for ``search`` (one query for the matching
+IDs, since it is a substring match over text the index doesn't hold) and a ``destination``
+that isn't a known place (one query, matching the text as the list view does).
+
+Counts follow the usual rule for filter UIs: each dimension is counted with every *other*
+active filter applied, so the options of a selected dimension stay visible with the counts
+they would have if chosen instead. Price filters and ranges are in the display currency (see
+users.currency): filter bounds are converted to dollars, and the dollar ranges below are shown
+converted and rounded.
+"""
+import math
+
+import numpy as np
+from django.db.models import Q
+
+from .availability import parse_period
+from .catalog import CatalogCache
+from .currency import BASE_CURRENCY, base_bound, fx_table
+from .destinations import destination_condition, index as destination_index
+from .models import Destination, Tour
+
+# Lower bounds of the price ranges in dollars; the last range is open-ended
+PRICE_BUCKETS = (0, 500, 1000, 2000, 5000)
+
+CHOICES = {
+    'meal_plan': Tour.MEAL_PLAN_CHOICES,
+    'flight_type': Tour.FLIGHT_TYPE_CHOICES,
+}
+
+
+def _parse_price(value):
+    try:
+        price = float(value)
+    except ValueError:
+        return None
+    return price if math.isfinite(price) else None
+
+
+def _round_bound(value):
+    """Two significant digits: 500 dollars shows as 430 euros, not 429.99"""
+    if value <= 0:
+        return 0
+    return int(round(value, 1 - int(math.floor(math.log10(value)))))
+
+
+def price_buckets(currency):
+    """Lower bounds of the price ranges in ``currency``"""
+    rate = fx_table().rate(BASE_CURRENCY, currency)
+    bounds = []
+    for low in PRICE_BUCKETS:
+        bound = _round_bound(low * rate)
+        if not bounds or bound > bounds[-1]:
+            bounds.append(bound)
+    return bounds
+
+
+def parse_filters(params, currency=BASE_CURRENCY):
+    """
+    The tour list's filters from query parameters; invalid values are ignored, as the list view does.
+    Prices are given in ``currency`` and returned in dollars.
+    """
+    filters = {'currency': currency}
+    for name in ('search', 'destination', 'meal_plan', 'flight_type'):
+        value = params.get(name, '').strip()
+        if value:
+            filters[name] = value
+    for name in ('min_price', 'max_price'):
+        value = params.get(name, '').strip()
+        if value and _parse_price(value) is not None:
+            filters[name] = float(base_bound(_parse_price(value), currency))
+    filters.update(parse_period(params))
+    if params.get('visa_required', '').strip().lower() == 'true':
+        filters['visa_required'] = True
+    return filters
+
+
+class _Arrays:
+    """One immutable load of the catalog, swapped in whole so readers never see a partial reload"""
+
+    def __init__(self, rows, destination_names):
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        # Destinations are counted by normalized destination (users.destinations), labelled with its name
+        self.destination_ids = np.array(sorted(destination_names), dtype=np.int64)
+        self.destination_labels = [destination_names[destination_id] for destination_id in self.destination_ids.tolist()]
+        codes = {destination_id: code for code, destination_id in enumerate(self.destination_ids.tolist())}
+        # Tours not linked to a destination get a code past the end and aren't listed
+        self.destination = np.array([codes.get(row[1], len(codes)) for row in rows], dtype=np.int32)
+
+        self.choice_codes = {}
+        self.choices = {}
+        for column, name in ((2, 'meal_plan'), (3, 'flight_type')):
+            values = [value for value, _ in CHOICES[name]]
+            lookup = {value: code for code, value in enumerate(values)}
+            # Values outside the declared choices (legacy rows) get a code past the end and aren't listed
+            self.choice_codes[name] = lookup
+            self.choices[name] = np.array([lookup.get(row[column], len(values)) for row in rows], dtype=np.int16)
+        self.visa_required = np.array([row[4] for row in rows], dtype=bool)
+        self.price = np.array([float(row[5]) for row in rows], dtype=np.float64)
+        self.start = np.array([row[6].toordinal() for row in rows], dtype=np.int32)
+        self.end = np.array([row[7].toordinal() for row in rows], dtype=np.int32)
+        self.nights = np.maximum(self.end - self.start, 0)
+
+
+class FacetIndex(CatalogCache):
+    def __init__(self):
+        super().__init__()
+        self.arrays = _Arrays([], {})
+
+    def load(self):
+        rows = Tour.objects.filter(is_active=True).values_list(
+            'id', 'place_id', 'meal_plan', 'flight_type', 'visa_required', 'price_usd', 'start_date', 'end_date'
+        )
+        destination_names = dict(Destination.objects.values_list('id', 'name'))
+        self.arrays = _Arrays(list(rows.iterator(chunk_size=5000)), destination_names)
+
+    def counts(self, filters):
+        """``{'total': n, 'currency': code, 'facets': {...}}`` for ``parse_filters()`` output"""
+        self.refresh()
+        a = self.arrays
+        size = len(a.ids)
+
+        # Filters that aren't facets themselves
+        base = np.ones(size, dtype=bool)
+        if 'search' in filters:
+            search = filters['search']
+            matching = Tour.objects.filter(is_active=True).filter(
+                Q(title__icontains=search) | Q(description__icontains=search)
+                | Q(destination__icontains=search) | Q(hotel_name__icontains=search)
+            ).values_list('id', flat=True)
+            base &= np.isin(a.ids, np.fromiter(matching, dtype=np.int64))
+        # Travel period, with the same overlap semantics as users.availability
+        if 'travel_from' in filters:
+            base &= a.end >= filters['travel_from'].toordinal()
+        if 'travel_to' in filters:
+            base &= a.start <= filters['travel_to'].toordinal()
+        if 'min_nights' in filters:
+            base &= a.nights >= filters['min_nights']
+        if 'max_nights' in filters:
+            base &= a.nights <= filters['max_nights']
+
+        # Facet dimensions: the mask each one's own filter contributes
+        masks = {}
+        if 'destination' in filters:
+            # Same resolution as the list view (destination_condition): a known place is resolved in memory,
+            # other text costs one query for the tours whose destination matches it
+            place_ids = destination_index.lookup(filters['destination'])
+            if place_ids is not None:
+                codes = np.flatnonzero(np.isin(a.destination_ids, np.array(place_ids, dtype=np.int64)))
+                masks['destination'] = np.isin(a.destination, codes)
+            else:
+                matching = Tour.objects.filter(is_active=True).filter(
+                    destination_condition(filters['destination'])
+                ).values_list('id', flat=True)
+                masks['destination'] = np.isin(a.ids, np.fromiter(matching, dtype=np.int64))
+        for name in ('meal_plan', 'flight_type'):
+            if name in filters:
+                masks[name] = a.choices[name] == a.choice_codes[name].get(filters[name], -1)
+        if 'visa_required' in filters:
+            masks['visa_required'] = a.visa_required
+        if 'min_price' in filters or 'max_price' in filters:
+            price_mask = np.ones(size, dtype=bool)
+            if 'min_price' in filters:
+                price_mask &= a.price >= filters['min_price']
+            if 'max_price' in filters:
+                price_mask &= a.price <= filters['max_price']
+            masks['price'] = price_mask
+
+        def selected(excluding=None):
+            mask = base.copy()
+            for name, dimension_mask in masks.items():
+                if name != excluding:
+                    mask &= dimension_mask
+            return mask
+
+        facets = {}
+        mask = selected('destination')
+        counts = np.bincount(a.destination[mask], minlength=len(a.destination_labels) + 1)[:len(a.destination_labels)]
+        order = sorted(np.flatnonzero(counts).tolist(), key=lambda code: (-counts[code], a.destination_labels[code]))
+        facets['destination'] = [{'value': a.destination_labels[code], 'count': int(counts[code])} for code in order]
+
+        for name in ('meal_plan', 'flight_type'):
+            mask = selected(name)
+            counts = np.bincount(a.choices[name][mask], minlength=len(CHOICES[name]) + 1)
+            facets[name] = [
+                {'value': value, 'label': label, 'count': int(counts[code])}
+                for code, (value, label) in enumerate(CHOICES[name])
+            ]
+
+        mask = selected('visa_required')
+        counts = np.bincount(a.visa_required[mask].astype(np.int8), minlength=2)
+        facets['visa_required'] = [
+            {'value': True, 'count': int(counts[1])},
+            {'value': False, 'count': int(counts[0])},
+        ]
+
+        currency = filters.get('currency', BASE_CURRENCY)
+        bounds = price_buckets(currency)
+        dollar_bounds = np.array(bounds, dtype=np.float64) * fx_table().rate(currency, BASE_CURRENCY)
+        mask = selected('price')
+        buckets = np.searchsorted(dollar_bounds, a.price[mask], side='right') - 1
+        counts = np.bincount(np.maximum(buckets, 0), minlength=len(bounds))
+        facets['price'] = [
+            {
+                'min': low,
+                'max': bounds[i + 1] if i + 1 < len(bounds) else None,
+                'count': int(counts[i]),
+            }
+            for i, low in enumerate(bounds)
+        ]
+
+        return {'total': int(selected().sum()), 'currency': currency, 'facets': facets}
+
+
+index = FacetIndex()
@@ -0,0 +1,81 @@
+"""
+Destination helpers: tours store their destination as free text, usually "City, Country".
+"""
+
+COUNTRY_ALIASES = {
+    'uae': 'United Arab Emirates',
+    'usa': 'United States',
+    'us': 'United States',
+    'united states of america': 'United States',
+    'uk': 'United Kingdom',
+    'england': 'United Kingdom',
+    'scotland': 'United Kingdom',
+    'czechia': 'Czech Republic',
+}
+
+COUNTRY_REGIONS = {
+    'Indonesia': 'Southeast Asia', 'Thailand': 'Southeast Asia', 'Vietnam': 'Southeast Asia',
+    'Singapore': 'Southeast Asia', 'Malaysia': 'Southeast Asia', 'Philippines': 'Southeast Asia',
+    'Cambodia': 'Southeast Asia',
+    'Japan': 'East Asia', 'South Korea': 'East Asia', 'China': 'East Asia', 'Taiwan': 'East Asia',
+    'India': 'South Asia', 'Sri Lanka': 'South Asia', 'Nepal': 'South Asia', 'Maldives': 'South Asia',
+    'Bhutan': 'South Asia',
+    'United Arab Emirates': 'Middle East', 'Turkey': 'Middle East', 'Jordan': 'Middle East',
+    'Oman': 'Middle East', 'Qatar': 'Middle East', 'Israel': 'Middle East',
+    'Azerbaijan': 'Caucasus', 'Georgia': 'Caucasus', 'Armenia': 'Caucasus',
+    'France': 'Western Europe', 'Netherlands': 'Western Europe', 'Belgium': 'Western Europe',
+    'United Kingdom': 'Western Europe', 'Ireland': 'Western Europe', 'Switzerland': 'Western Europe',
+    'Austria': 'Western Europe', 'Germany': 'Western Europe',
+    'Italy': 'Southern Europe', 'Spain': 'Southern Europe', 'Portugal': 'Southern Europe',
+    'Greece': 'Southern Europe', 'Croatia': 'Southern Europe', 'Malta': 'Southern Europe',
+    'Czech Republic': 'Central Europe', 'Hungary': 'Central Europe', 'Poland': 'Central Europe',
+    'Iceland': 'Northern Europe', 'Norway': 'Northern Europe', 'Sweden': 'Northern Europe',
+    'Denmark': 'Northern Europe', 'Finland': 'Northern Europe',
+    'Morocco': 'North Africa', 'Egypt': 'North Africa', 'Tunisia': 'North Africa',
+    'Tanzania': 'Sub-Saharan Africa', 'Kenya': 'Sub-Saharan Africa', 'South Africa': 'Sub-Saharan Africa',
+    'Namibia': 'Sub-Saharan Africa', 'Botswana': 'Sub-Saharan Africa',
+    'United States': 'North America', 'Canada': 'North America',
+    'Mexico': 'Central America & Caribbean', 'Cuba': 'Central America & Caribbean',
+    'Costa Rica': 'Central America & Caribbean', 'Dominican Republic': 'Central America & Caribbean',
+    'Brazil': 'South America', 'Peru': 'South America', 'Argentina': 'South America', 'Chile': 'South America',
+    'Colombia': 'South America', 'Ecuador': 'South America',
+    'Australia': 'Oceania', 'New Zealand': 'Oceania', 'Fiji': 'Oceania',
+}
+
+
+def split_destination(destination):
+    """``(city, country)`` of a "City, Country" destination; a single name is treated as the country"""
+    parts = [part.strip() for part in (destination or '').split(',') if part.strip()]
+    if not parts:
+        return '', ''
+    country = COUNTRY_ALIASES.get(parts[-1].lower(), parts[-1])
+    city = parts[0] if len(parts) > 1 else ''
+    return city, country
+
+
+def region_of(country):
+    return COUNTRY_REGIONS.get(country, '')
+
+REGION_CONTINENTS = {
+    'Southeast Asia': 'Asia', 'East Asia': 'Asia', 'South Asia': 'Asia', 'Middle East': 'Asia', 'Caucasus': 'Asia',
+    'Western Europe': 'Europe', 'Southern Europe': 'Europe', 'Central Europe': 'Europe', 'Northern Europe': 'Europe',
+    'North Africa': 'Africa', 'Sub-Saharan Africa': 'Africa',
+    'North America': 'North America', 'Central America & Caribbean': 'North America',
+    'South America': 'South America',
+    'Oceania': 'Oceania',
+}
+
+
+def continent_of(region):
+    return REGION_CONTINENTS.get(region, '')
+
+
+def canonical_destination(destination):
+    """``(name, city, country)`` with the country alias resolved, e.g. "Dubai, UAE" -> "Dubai, United Arab Emirates\""""
+    city, country = split_destination(destination)
+    return (f'{city}, {country}' if city else country), city, country
+
+
+def destination_key(destination):
+    """Lookup key of a destination: case, spacing and country aliases don't matter"""
+    return canonical_destination(destination)[0].lower()
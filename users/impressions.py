@@ -0,0 +1,164 @@
+"""
+Recommendation impressions: which tours the chat assistant showed, in what position, in which
+conversation, and which agent tool found them (``RecommendationImpression``).
+
+``record()`` only appends to an in-process buffer, so a chat turn pays no write for its
+impressions. A background thread writes the buffer out every ``IMPRESSIONS_FLUSH_INTERVAL``
+seconds, or as soon as it holds ``IMPRESSIONS_BATCH_SIZE`` rows, one batch per statement: a
+``COPY`` on PostgreSQL, a multi-row INSERT elsewhere. What is left is written at exit. The
+buffer is bounded: past ``IMPRESSIONS_BUFFER_SIZE`` rows (writes failing for a while) the
+oldest are dropped and counted in ``tourai_impressions_dropped_total``, and a killed process
+loses at most one interval of impressions.
+
+Usage::
+
+    record([tour.id for tour in shown], {tour_id: 'search_tours_by_keyword', ...}, conversation)
+"""
+import atexit
+import collections
+import csv
+import io
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router
+from django.utils import timezone
+
+from .metrics import IMPRESSIONS_DROPPED, IMPRESSIONS_WRITTEN
+from .models import RecommendationImpression
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('tour_id', 'conversation_id', 'rank', 'tool', 'recorded_at')
+# Tool of a tour no single search returned (it ranked in through the combined filters)
+RANKING_TOOL = 'ranking'
+
+_lock = threading.Lock()
+_buffer = collections.deque()
+# Serializes flushes, so impressions are written in the order they were recorded
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher_started = False
+
+
+def _trim():
+    """Drop the oldest rows beyond the bound; call with ``_lock`` held"""
+    overflow = len(_buffer) - settings.IMPRESSIONS_BUFFER_SIZE
+    for _ in range(overflow):
+        _buffer.popleft()
+    return max(overflow, 0)
+
+
+def record(tour_ids, tools, conversation=None):
+    """
+    Buffer an impression of each of ``tour_ids`` (in the order shown); ``tools`` maps tour IDs to
+    the tool that found them, or is one tool name for all of them.
+    """
+    now = timezone.now()
+    conversation_id = conversation.pk if conversation is not None else None
+    rows = [
+        (tour_id, conversation_id, rank, tools if isinstance(tools, str) else tools.get(tour_id, RANKING_TOOL), now)
+        for rank, tour_id in enumerate(tour_ids)
+    ]
+    if not rows:
+        return
+    start_flusher()
+    with _lock:
+        _buffer.extend(rows)
+        dropped = _trim()
+        pending = len(_buffer)
+    if dropped:
+        IMPRESSIONS_DROPPED.inc(amount=dropped)
+    if pending >= settings.IMPRESSIONS_BATCH_SIZE:
+        _wakeup.set()
+
+
+def _write(rows):
+    using = router.db_for_write(RecommendationImpression)
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(RecommendationImpression._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(column) for column in COLUMNS)
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy'):
+                # psycopg 3
+                with raw.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+                return
+            if hasattr(raw, 'copy_expert'):
+                # psycopg2: CSV, where an unquoted empty value is NULL
+                data = io.StringIO()
+                csv.writer(data).writerows(
+                    ['' if value is None else value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+                    for row in rows
+                )
+                data.seek(0)
+                raw.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", data)
+                return
+    RecommendationImpression.objects.using(using).bulk_create(
+        [RecommendationImpression(**dict(zip(COLUMNS, row))) for row in rows]
+    )
+
+
+def flush():
+    """Write out everything buffered so far; returns the number of impressions written"""
+    with _flush_lock:
+        with _lock:
+            rows = list(_buffer)
+            _buffer.clear()
+        written = 0
+        try:
+            for start in range(0, len(rows), settings.IMPRESSIONS_BATCH_SIZE):
+                batch = rows[start:start + settings.IMPRESSIONS_BATCH_SIZE]
+                _write(batch)
+                written += len(batch)
+        except Exception:
+            logger.exception("Writing %d recommendation impressions failed; retrying later", len(rows) - written)
+            # Back in front of the ones recorded meanwhile, within the bound
+            with _lock:
+                _buffer.extendleft(reversed(rows[written:]))
+                dropped = _trim()
+            if dropped:
+                IMPRESSIONS_DROPPED.inc(amount=dropped)
+        if written:
+            IMPRESSIONS_WRITTEN.inc(amount=written)
+        return written
+
+
+def start_flusher():
+    """Start this process's flusher thread and exit flush, once"""
+    global _flusher_started
+    if _flusher_started:
+        return
+    with _flush_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+
+    def run():
+        while True:
+            _wakeup.wait(settings.IMPRESSIONS_FLUSH_INTERVAL)
+            _wakeup.clear()
+            # Drop a connection the database closed, as the request cycle does
+            close_old_connections()
+            flush()
+
+    threading.Thread(target=run, name='impressions-flusher', daemon=True).start()
+    atexit.register(flush)
+
+
+def _after_fork():
+    # A forked worker starts empty (the parent writes its own rows) with fresh locks and its own flusher
+    global _lock, _flush_lock, _wakeup, _flusher_started
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _wakeup = threading.Event()
+    _buffer.clear()
+    _flusher_started = False
+
+
+os.register_at_fork(after_in_child=_after_fork)
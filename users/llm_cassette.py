@@ -0,0 +1,110 @@
+"""
+Record and replay LLM HTTP traffic so chat tests and benchmarks are deterministic.
+
+``CassetteTransport`` is an httpx transport used by the OpenAI client (see ``LLM_CASSETTE`` and
+``LLM_CASSETTE_MODE`` in settings). In ``record`` mode requests go to the real API and each
+response is appended to a JSON Lines cassette; in ``replay`` mode responses are served from
+the cassette and unknown requests fail with ``CassetteMiss`` instead of reaching the network.
+Requests are matched on method, path and the canonical JSON body.
+"""
+import hashlib
+import json
+import threading
+
+import httpx
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+# Response headers worth keeping; the rest (dates, request ids, cookies) only add noise
+KEPT_HEADERS = ('content-type',)
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+def request_key(request):
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+    except ValueError:
+        pass
+    digest = hashlib.sha256(request.method.encode() + b' ' + request.url.path.encode() + b'\n' + body)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """Recorded responses keyed by :func:`request_key`, stored as JSON Lines"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['key']] = entry
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def add(self, key, request, response):
+        entry = {
+            'key': key,
+            'request': {'method': request.method, 'path': request.url.path},
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            'body': response.content.decode('utf-8'),
+        }
+        with self.lock:
+            self.entries[key] = entry
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+
+def get_cassette(path):
+    """One shared :class:`Cassette` per file and process"""
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
+
+
+class CassetteTransport(httpx.BaseTransport):
+    def __init__(self, path, mode=REPLAY, transport=None):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Cassette mode must be '{RECORD}' or '{REPLAY}', not {mode!r}")
+        self.cassette = get_cassette(path)
+        self.mode = mode
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        key = request_key(request)
+        entry = self.cassette.get(key)
+        if entry is not None:
+            return httpx.Response(
+                entry['status'], headers=entry['headers'], content=entry['body'].encode('utf-8'), request=request
+            )
+        if self.mode == REPLAY:
+            raise CassetteMiss(f"No recorded response for {request.method} {request.url.path} in {self.cassette.path}")
+
+        response = self.transport.handle_request(request)
+        response.read()
+        if response.status_code < 500:
+            self.cassette.add(key, request, response)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+def cassette_http_client(path, mode=REPLAY, **kwargs):
+    return httpx.Client(transport=CassetteTransport(path, mode), **kwargs)
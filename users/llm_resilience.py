@@ -0,0 +1,260 @@
+"""
+Resilience for LLM calls: deadlines, bounded retries, hedged requests and a circuit breaker.
+
+``ResilientChatOpenAI`` is a drop-in ``ChatOpenAI`` whose every completion:
+
+* gets a timeout no longer than what is left of the chat's deadline (``llm_deadline``);
+* is retried on timeouts, connection errors, rate limits and 5xx with full-jitter
+  exponential backoff, while the deadline allows;
+* optionally sends a second, hedged request when the first one is slower than the recent
+  p95 latency, and uses whichever answers first;
+* is refused while the process-wide circuit breaker is open, so callers can go straight to
+  the deterministic responder instead of waiting on an unhealthy upstream. A call counts as
+  one breaker failure when it fails after its retries, however many attempts it made.
+
+Settings: ``LLM_TIMEOUT``, ``LLM_CHAT_DEADLINE``, ``LLM_MAX_RETRIES``, ``LLM_RETRY_BACKOFF``,
+``LLM_HEDGE``, ``LLM_HEDGE_AFTER_MS``, ``LLM_BREAKER_FAILURES``, ``LLM_BREAKER_RESET``.
+"""
+import concurrent.futures
+import contextlib
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+import openai
+from django.conf import settings
+from langchain_openai import ChatOpenAI
+
+from . import metrics
+from .bench import percentile
+
+LLM_RETRIES = metrics.counter('tourai_llm_retries_total', 'LLM requests retried after a transient error', ('error',))
+LLM_HEDGES = metrics.counter('tourai_llm_hedges_total', 'Hedged LLM requests by which request answered first', ('winner',))
+LLM_BREAKER = metrics.counter('tourai_llm_breaker_transitions_total', 'LLM circuit breaker state changes', ('state',))
+LLM_REJECTED = metrics.counter('tourai_llm_rejected_total', 'LLM calls refused by the open circuit breaker or deadline', ('reason',))
+
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TimeoutException,
+    httpx.TransportError,
+)
+
+
+class LLMUnavailable(Exception):
+    """The LLM was not called: circuit breaker open or deadline already exceeded"""
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures and rejects calls for ``reset_timeout``
+    seconds. Then one probe call is let through (half-open): success closes the circuit,
+    failure opens it again, and a call that ends any other way (``release``) lets the next one
+    probe.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._prober = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                self._prober = threading.get_ident()
+                return True
+            return False
+
+    def is_open(self):
+        """True while calls are being rejected (does not claim the half-open probe)"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == self.HALF_OPEN and self._probing
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._set_state(self.OPEN)
+
+    def release(self):
+        """Free the half-open probe if this thread holds it and its call proved nothing about the upstream"""
+        with self._lock:
+            if self._probing and self._prober == threading.get_ident():
+                self._probing = False
+
+    def reset(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def _set_state(self, state):
+        self.state = state
+        LLM_BREAKER.inc(state)
+
+
+breaker = CircuitBreaker(
+    failure_threshold=getattr(settings, 'LLM_BREAKER_FAILURES', 5),
+    reset_timeout=getattr(settings, 'LLM_BREAKER_RESET', 30),
+)
+
+
+class LatencyTracker:
+    """Recent successful call latencies, used to pick the hedging delay"""
+
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def p95(self):
+        samples = list(self.samples)
+        return percentile(samples, 95) if len(samples) >= self.min_samples else None
+
+
+latencies = LatencyTracker()
+
+_deadline = contextvars.ContextVar('llm_deadline', default=None)
+
+
+@contextlib.contextmanager
+def llm_deadline(seconds):
+    """All LLM calls inside the block (e.g. one agent run) must finish within ``seconds``"""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# Hedged requests run on a small shared pool; a losing request finishes in the background
+_hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm-hedge')
+
+
+class ResilientChatOpenAI(ChatOpenAI):
+    """``ChatOpenAI`` with deadline-bounded retries, hedging and the module circuit breaker"""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if not breaker.allow():
+            LLM_REJECTED.inc('circuit_open')
+            raise LLMUnavailable("LLM circuit breaker is open")
+        try:
+            return self._generate_with_retries(messages, stop, run_manager, **kwargs)
+        finally:
+            # Deadline, bad request or a bug: not an upstream failure, but the probe must not stay claimed
+            breaker.release()
+
+    def _generate_with_retries(self, messages, stop, run_manager, **kwargs):
+        max_retries = settings.LLM_MAX_RETRIES
+        upstream_failed = False
+        try:
+            for attempt in range(max_retries + 1):
+                timeout = settings.LLM_TIMEOUT
+                remaining = remaining_time()
+                if remaining is not None:
+                    if remaining <= 0:
+                        LLM_REJECTED.inc('deadline')
+                        raise LLMUnavailable("LLM deadline exceeded")
+                    timeout = min(timeout, remaining)
+
+                start = time.monotonic()
+                try:
+                    result = self._call(messages, stop, run_manager, timeout, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    # A timeout shortened to fit the chat's deadline says nothing about the upstream
+                    if not (timeout < settings.LLM_TIMEOUT and isinstance(e, (openai.APITimeoutError, httpx.TimeoutException))):
+                        upstream_failed = True
+                    if attempt == max_retries or breaker.is_open():
+                        raise
+                    backoff = random.uniform(0, settings.LLM_RETRY_BACKOFF * 2 ** attempt)
+                    remaining = remaining_time()
+                    if remaining is not None and backoff >= remaining:
+                        raise
+                    LLM_RETRIES.inc(type(e).__name__)
+                    time.sleep(backoff)
+                    continue
+
+                latencies.add(time.monotonic() - start)
+                breaker.record_success()
+                return result
+        except (*RETRYABLE_ERRORS, LLMUnavailable):
+            # One failure per call once its retries are used up, so one slow request can't open the circuit alone
+            if upstream_failed:
+                breaker.record_failure()
+            raise
+
+    def _call(self, messages, stop, run_manager, timeout, **kwargs):
+        hedge_after = self._hedge_delay()
+        if hedge_after is None or hedge_after >= timeout:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, timeout=timeout, **kwargs)
+
+        started = time.monotonic()
+        generate = super()._generate
+
+        def submit(call_timeout):
+            return _hedge_pool.submit(
+                contextvars.copy_context().run, generate,
+                messages, stop=stop, run_manager=run_manager, timeout=call_timeout, **kwargs
+            )
+
+        primary = submit(timeout)
+        done, _ = concurrent.futures.wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        hedge = submit(max(timeout - (time.monotonic() - started), 0.001))
+        pending = {primary: 'primary', hedge: 'hedge'}
+        error = None
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                winner = pending.pop(future)
+                if future.exception() is None:
+                    LLM_HEDGES.inc(winner)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _hedge_delay():
+        if not settings.LLM_HEDGE:
+            return None
+        p95 = latencies.p95()
+        return p95 if p95 is not None else settings.LLM_HEDGE_AFTER_MS / 1000
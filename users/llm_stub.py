@@ -0,0 +1,277 @@
+"""
+A local OpenAI-compatible chat completions server for offline testing and benchmarks.
+
+Point the chat service at it with ``OPENAI_BASE_URL=http://127.0.0.1:8765/v1`` (see
+``manage.py run_llm_stub``). Responses follow a script: the last user message is matched
+against a list of rules, and the matching rule's tool calls are returned one per round trip
+(legacy ``functions``) or all at once (``tools``) before its final answer. That exercises the
+real AgentExecutor path, tool execution and persistence without network access or cost.
+
+A script file is JSON::
+
+    {"rules": [
+        {"match": "(?i)under \\$?(\\d+)",
+         "calls": [{"name": "search_tours_by_price_range", "arguments": {"max_price": "\\1"}}],
+         "answer": "Here are some budget friendly tours!"}
+    ]}
+
+``match`` is a regular expression searched in the last user message; argument strings may
+reference its groups (``\\1``) and are decoded as JSON when possible, so ``"\\1"`` becomes a number.
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RULES = [
+    {
+        'match': r'IDs: (\[[\d, ]*\])',
+        'calls': [{'name': 'get_tour_details_by_ids', 'arguments': {'tour_ids': r'\1'}}],
+        'answer': 'Here are the details of those tours.',
+    },
+    {
+        'match': r'(?i)\b(?:similar to|like|alternatives? to) tour #?(\d+)',
+        'calls': [{'name': 'find_similar_tours', 'arguments': {'tour_id': r'\1'}}],
+        'answer': 'Here are some tours similar to that one.',
+    },
+    {
+        'match': r'(?i)^\s*(hi|hello|hey|good (morning|afternoon|evening))\b',
+        'calls': [],
+        'answer': "Hello! I'm TourAI. Where would you like to travel?",
+    },
+    {
+        'match': r'\b(?i:in|to)\s+([A-Z][a-z]+(?: [A-Z][a-z]+)?)\b.*?(?i:under) \$?(\d+).*?(?i:(all[ -]inclusive|breakfast|half board|full board))',
+        'calls': [
+            {'name': 'search_tours_by_destination', 'arguments': {'destination': r'\1'}},
+            {'name': 'search_tours_by_price_range', 'arguments': {'max_price': r'\2'}},
+            {'name': 'search_tours_by_meal_plan', 'arguments': {'meal_plan': r'\3'}},
+        ],
+        'answer': 'Great! I found some tours that tick all your boxes!',
+    },
+    {
+        'match': r'(?i)under \$?(\d+)',
+        'calls': [{'name': 'search_tours_by_price_range', 'arguments': {'max_price': r'\1'}}],
+        'answer': 'Great! I found some tours within your budget!',
+    },
+    {
+        'match': r'\b(?i:in|to|visit)\s+([A-Z][a-z]+(?: [A-Z][a-z]+)?)',
+        'calls': [{'name': 'search_tours_by_destination', 'arguments': {'destination': r'\1'}}],
+        'answer': 'Excellent! I found some fantastic tours for that destination!',
+    },
+    {
+        'match': r'(?i)^(.*\b(?:getaway|somewhere|mountains?|relaxing|escape)\b.*)$',
+        'calls': [{'name': 'search_tours_semantic', 'arguments': {'query': r'\1'}}],
+        'answer': 'These tours match the kind of trip you described!',
+    },
+    {
+        'match': r'(?i)\b(adventure|cultural|safari|beach|wildlife|hiking|romantic|luxury|family|food|wellness)\b',
+        'calls': [{'name': 'search_tours_by_keyword', 'arguments': {'keyword': r'\1'}}],
+        'answer': 'I discovered some amazing tours you might enjoy!',
+    },
+    {
+        'match': r'.',
+        'calls': [{'name': 'get_all_available_destinations', 'arguments': {}}],
+        'answer': 'Here are the destinations we currently offer.',
+    },
+]
+
+
+def load_script(path):
+    with open(path) as f:
+        return json.load(f)['rules']
+
+
+class StubScript:
+    """Decides the next assistant message for a chat completions request"""
+
+    def __init__(self, rules=None):
+        self.rules = [(re.compile(rule['match']), rule) for rule in (rules or DEFAULT_RULES)]
+
+    def respond(self, messages, tools_offered=True):
+        """``(content, calls)``: either a final answer or the tool calls still to make"""
+        last_user_index = max((i for i, m in enumerate(messages) if m.get('role') == 'user'), default=-1)
+        query = _text(messages[last_user_index].get('content')) if last_user_index >= 0 else ''
+        # Results already returned for this user message tell us how far through the script we are
+        results = sum(1 for m in messages[last_user_index + 1:] if m.get('role') in ('function', 'tool'))
+
+        for pattern, rule in self.rules:
+            match = pattern.search(query)
+            if match:
+                calls = [
+                    {'name': call['name'], 'arguments': _fill(call.get('arguments', {}), match)}
+                    for call in rule.get('calls', [])
+                ]
+                if tools_offered and results < len(calls):
+                    return None, calls[results:]
+                return rule.get('answer', 'Done.'), []
+        return 'Done.', []
+
+
+def _text(content):
+    if isinstance(content, list):
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+def _fill(arguments, match):
+    filled = {}
+    for key, value in arguments.items():
+        if isinstance(value, str):
+            value = match.expand(value)
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        filled[key] = value
+    return filled
+
+
+class StubLLMServer:
+    """Threaded HTTP server answering ``POST /v1/chat/completions`` from a :class:`StubScript`"""
+
+    def __init__(self, host='127.0.0.1', port=8765, script=None, latency_ms=0, jitter_ms=0, seed=None,
+                 fail_rate=0.0, slow_rate=0.0, slow_ms=0):
+        self.script = script or StubScript()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # Fault injection: a share of requests fail with HTTP 500, another share is slowed down
+        self.fail_rate = fail_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        """Serve from a background thread (for use inside benchmarks)"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def delay(self):
+        latency = self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if self.slow_rate and self.rng.random() < self.slow_rate:
+            latency += self.slow_ms
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def should_fail(self):
+        return bool(self.fail_rate) and self.rng.random() < self.fail_rate
+
+    def completion(self, body):
+        """Build the (non-streamed) chat completion for a request body"""
+        self.requests += 1
+        tools_offered = bool(body.get('tools') or body.get('functions'))
+        content, calls = self.script.respond(body.get('messages', []), tools_offered)
+        message = {'role': 'assistant', 'content': content}
+        finish_reason = 'stop'
+
+        if calls and body.get('tools'):
+            message['tool_calls'] = [
+                {
+                    'id': f'call_stub_{next(self.ids)}',
+                    'type': 'function',
+                    'function': {'name': call['name'], 'arguments': json.dumps(call['arguments'])},
+                }
+                for call in calls
+            ]
+            finish_reason = 'tool_calls'
+        elif calls:
+            # The legacy functions API allows one call per response
+            call = calls[0]
+            message['function_call'] = {'name': call['name'], 'arguments': json.dumps(call['arguments'])}
+            finish_reason = 'function_call'
+
+        prompt_tokens = sum(len(_text(m.get('content')).split()) for m in body.get('messages', []))
+        completion_tokens = len((content or '').split()) + 10 * len(calls)
+        return {
+            'id': f'chatcmpl-stub-{next(self.ids)}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason, 'logprobs': None}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+
+def stream_chunks(completion):
+    """Split a completion into the ``chat.completion.chunk`` events of a streamed response"""
+    choice = completion['choices'][0]
+    delta = {key: value for key, value in choice['message'].items() if value is not None}
+    if 'tool_calls' in delta:
+        delta['tool_calls'] = [dict(call, index=index) for index, call in enumerate(delta['tool_calls'])]
+    base = {key: completion[key] for key in ('id', 'created', 'model')}
+    base['object'] = 'chat.completion.chunk'
+    yield {**base, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}
+    yield {**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': choice['finish_reason']}]}
+    yield {**base, 'choices': [], 'usage': completion['usage']}
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/models'):
+                self._json(200, {'object': 'list', 'data': [{'id': 'stub', 'object': 'model', 'owned_by': 'stub'}]})
+            else:
+                self._json(404, {'error': {'message': 'Not found'}})
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self._json(404, {'error': {'message': 'Not found'}})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            except ValueError:
+                self._json(400, {'error': {'message': 'Invalid JSON body'}})
+                return
+
+            server.delay()
+            if server.should_fail():
+                self._json(500, {'error': {'message': 'Injected stub failure', 'type': 'server_error'}})
+                return
+            completion = server.completion(body)
+            if not body.get('stream'):
+                self._json(200, completion)
+                return
+
+            payload = ''.join(f'data: {json.dumps(chunk)}\n\n' for chunk in stream_chunks(completion))
+            self._send(200, 'text/event-stream', (payload + 'data: [DONE]\n\n').encode())
+
+        def _json(self, status, data):
+            self._send(status, 'application/json', json.dumps(data).encode())
+
+        def _send(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
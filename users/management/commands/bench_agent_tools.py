@@ -0,0 +1,106 @@
+import contextlib
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from users import metrics
+from users.agent_executor import AGENT_TOOL_STEP
+from users.bench import environment_info, summarize, timed_ms, write_results
+from users.chat_service import TourRecommendationService
+from users.llm_stub import StubLLMServer
+
+# The stub answers this with destination, price range and meal plan calls in one response
+MESSAGE = 'Show me tours to Bali under $3000 all inclusive'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare sequential and parallel execution of the tool calls in one agent step, "
+        "against the local LLM stub and with simulated database latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='Chats per mode')
+        parser.add_argument('--latency-ms', type=float, default=20, help='Stub latency per LLM round trip')
+        parser.add_argument(
+            '--db-latency-ms', type=float, default=30,
+            help='Delay added to every SQL query, standing in for the round trip to a remote database'
+        )
+        parser.add_argument('--message', default=MESSAGE)
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def handle(self, *args, **options):
+        delay = options['db_latency_ms'] / 1000
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            if slow_query not in connection.execute_wrappers:
+                connection.execute_wrappers.append(slow_query)
+
+        server = StubLLMServer(port=0, latency_ms=options['latency_ms'], seed=0).start()
+        if delay:
+            # Tools run on pool threads, each with its own connection: add the delay to every new one
+            connection_created.connect(add_latency)
+            for connection in connections.all():
+                add_latency(None, connection)
+
+        results = {
+            'environment': environment_info(),
+            'message': options['message'],
+            'stub_latency_ms': options['latency_ms'],
+            'db_latency_ms': options['db_latency_ms'],
+        }
+        try:
+            with override_settings(LLM_BACKEND='openai', OPENAI_BASE_URL=server.base_url, LLM_CASSETTE=''):
+                for mode, parallel in (('sequential', False), ('parallel', True)):
+                    with override_settings(AGENT_PARALLEL_TOOLS=parallel):
+                        results[mode] = self._run(options)
+        finally:
+            server.stop()
+            connection_created.disconnect(add_latency)
+            for connection in connections.all():
+                if slow_query in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(slow_query)
+
+        for mode in ('sequential', 'parallel'):
+            result = results[mode]
+            self.stdout.write(
+                f"{mode:>10}: tool step mean {result['tool_step_mean_ms']:.1f} ms over {result['steps']} steps, "
+                f"chat p50 {result['latency']['p50_ms']:.1f} ms, p95 {result['latency']['p95_ms']:.1f} ms, "
+                f"{result['recommended_tours']} tours, {result['mock_fallbacks']} mock fallbacks"
+            )
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _run(self, options):
+        service = TourRecommendationService()
+        mode = 'parallel' if service.agent_executor.parallel_tools else 'sequential'
+        latencies = []
+        tours = 0
+        # The service prints progress for every chat; keep it out of the report but count fallbacks
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            service.recommend_tours(options['message'])
+            before = metrics.snapshot().get(AGENT_TOOL_STEP.name, {}).get((mode,), AGENT_TOOL_STEP.empty())
+            for _ in range(options['requests']):
+                result, elapsed = timed_ms(service.recommend_tours, options['message'])
+                latencies.append(elapsed)
+                tours = len(result['recommended_tours'])
+
+        after = metrics.snapshot().get(AGENT_TOOL_STEP.name, {}).get((mode,), AGENT_TOOL_STEP.empty())
+        steps = after[-1] - before[-1]
+        return {
+            'requests': options['requests'],
+            'steps': steps,
+            'tool_step_mean_ms': (after[-2] - before[-2]) / steps * 1000 if steps else 0.0,
+            'recommended_tours': tours,
+            'mock_fallbacks': output.getvalue().count('Falling back to mock response'),
+            'latency': summarize(latencies),
+        }
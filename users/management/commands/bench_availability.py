@@ -0,0 +1,117 @@
+import datetime
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+
+from users.availability import parse_period, period_condition
+from users import impressions
+from users.bench import environment_info, summarize, timed_ms, write_results
+from users.models import Tour
+from users.synthetic import ANCHOR_DATE, PASSWORD, SyntheticDataGenerator
+
+PAGE_SIZE = 20
+
+
+def _periods(anchor):
+    """Travel-period searches relative to the synthetic catalog's anchor date, as query parameters"""
+    soon = anchor + datetime.timedelta(days=30)
+    later = anchor + datetime.timedelta(days=300)
+    return [
+        {'month': f'{soon:%Y-%m}'},
+        {'month': f'{later:%Y-%m}', 'min_nights': '7'},
+        {'date_from': f'{soon:%Y-%m-%d}', 'date_to': f'{soon + datetime.timedelta(days=10):%Y-%m-%d}', 'flex_days': '3'},
+        {'date_from': f'{later:%Y-%m-%d}', 'date_to': f'{later + datetime.timedelta(days=14):%Y-%m-%d}', 'nights': '7'},
+        {'date_from': f'{later:%Y-%m-%d}'},
+    ]
+
+
+def naive_queryset(period):
+    """Baseline: overlap as two independent column comparisons"""
+    queryset = Tour.objects.filter(is_active=True)
+    if 'travel_from' in period:
+        queryset = queryset.filter(end_date__gte=period['travel_from'])
+    if 'travel_to' in period:
+        queryset = queryset.filter(start_date__lte=period['travel_to'])
+    if 'min_nights' in period:
+        queryset = queryset.filter(duration_nights__gte=period['min_nights'])
+    if 'max_nights' in period:
+        queryset = queryset.filter(duration_nights__lte=period['max_nights'])
+    return queryset
+
+
+class Command(BaseCommand):
+    help = (
+        "Travel-period search latency on a generated catalog (in a test database): the bounded overlap "
+        "condition of users.availability against plain column comparisons, for a count and a first page"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tours', type=int, default=100000)
+        parser.add_argument('--requests', type=int, default=10, help='Requests per period and strategy')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true', help='Keep (and reuse) the test database')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = self._run(options)
+        finally:
+            # Buffered impressions go to the test database, not to an atexit flush after it is gone
+            impressions.flush()
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _run(self, options):
+        if Tour.objects.filter(is_active=True).count() < options['tours']:
+            self.stdout.write(f"Generating {options['tours']} tours...")
+            generator = SyntheticDataGenerator(seed=options['seed'], agents=200, tours=options['tours'])
+            company_ids = generator.create_companies()
+            agent_ids = generator.create_agents(company_ids, make_password(PASSWORD))
+            generator.create_tours(agent_ids)
+        tours = Tour.objects.filter(is_active=True).count()
+        self.stdout.write(f"{tours} active tours")
+
+        strategies = {
+            'availability': lambda period: Tour.objects.filter(is_active=True).filter(period_condition(period)),
+            'naive': naive_queryset,
+        }
+        results = {'environment': environment_info(), 'tours': tours, 'strategies': {}}
+        periods = [(params, parse_period(params)) for params in _periods(ANCHOR_DATE)]
+        for params, period in periods:
+            expected = set(strategies['naive'](period).values_list('id', flat=True))
+            actual = set(strategies['availability'](period).values_list('id', flat=True))
+            if expected != actual:
+                raise CommandError(f"{params}: {len(actual)} tours matched, {len(expected)} expected")
+
+        for name, queryset_for in strategies.items():
+            latencies = []
+            queries = []
+            per_period = []
+            for params, period in periods:
+                period_latencies = []
+                for _ in range(options['requests']):
+                    def search():
+                        queryset = queryset_for(period)
+                        return queryset.count(), list(queryset.values_list('id', flat=True)[:PAGE_SIZE])
+                    with CaptureQueriesContext(connection) as captured:
+                        (count, _), elapsed = timed_ms(search)
+                    period_latencies.append(elapsed)
+                    queries.append(len(captured))
+                latencies.extend(period_latencies)
+                per_period.append({'period': params, 'tours': count, 'latency': summarize(period_latencies)})
+            results['strategies'][name] = {
+                'latency': summarize(latencies), 'max_queries': max(queries), 'periods': per_period,
+            }
+            self.stdout.write(
+                f"{name:>12}: p50 {results['strategies'][name]['latency']['p50_ms']:8.2f} ms  "
+                f"p95 {results['strategies'][name]['latency']['p95_ms']:8.2f} ms  up to {max(queries)} queries"
+            )
+            for entry in per_period:
+                self.stdout.write(f"{'':>14}{entry['tours']:>7} tours  p50 {entry['latency']['p50_ms']:8.2f} ms  {entry['period']}")
+        return results
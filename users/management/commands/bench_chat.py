@@ -0,0 +1,140 @@
+import contextlib
+import io
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from users.bench import Stopwatch, environment_info, summarize, timed_ms, write_results
+from users.llm_stub import StubLLMServer
+from users.metrics import MOCK_FALLBACKS, snapshot
+from users.models import Conversation, User
+from users.synthetic import USERNAME_PREFIX
+from users.tokens import TourAIRefreshToken
+
+MESSAGES = [
+    'Show me tours to Bali',
+    'Any beach tours under $2000?',
+    'I want an adventure trip',
+    'Tours to Japan please',
+    'Something romantic for two',
+    'Hello!',
+]
+
+
+def _mock_fallbacks():
+    """``{reason: chats}`` answered by the mock responder in this process so far"""
+    return {labels[0]: value for labels, value in snapshot().get(MOCK_FALLBACKS.name, {}).items()}
+
+
+class Command(BaseCommand):
+    help = "Benchmark /api/chat/ through the real agent and tools against a local LLM stub, with concurrent clients"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=60, help='Total chat requests')
+        parser.add_argument('--concurrency', type=int, default=4, help='Parallel clients')
+        parser.add_argument('--latency-ms', type=float, default=50, help='Stub latency per LLM round trip')
+        parser.add_argument('--jitter-ms', type=float, default=0)
+        parser.add_argument('--fail-rate', type=float, default=0, help='Share of stub requests failing with HTTP 500')
+        parser.add_argument('--slow-rate', type=float, default=0, help='Share of stub requests slowed by --slow-ms')
+        parser.add_argument('--slow-ms', type=float, default=0)
+        parser.add_argument(
+            '--base-url', help='Use an already running OpenAI-compatible server instead of the in-process stub'
+        )
+        parser.add_argument('--anonymous', action='store_true', help='Chat without a user (nothing is persisted)')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def handle(self, *args, **options):
+        user = None
+        if not options['anonymous']:
+            user = User.objects.filter(username__startswith=USERNAME_PREFIX, user_type='normal').first()
+            if user is None:
+                raise CommandError("No synthetic users found; run `manage.py generate_synthetic_data` first")
+
+        server = None
+        base_url = options['base_url']
+        if not base_url:
+            server = StubLLMServer(
+                port=0, latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'], seed=0,
+                fail_rate=options['fail_rate'], slow_rate=options['slow_rate'], slow_ms=options['slow_ms'],
+            )
+            base_url = server.start().base_url
+
+        conversations = []
+        try:
+            with override_settings(
+                LLM_BACKEND='openai', OPENAI_BASE_URL=base_url, LLM_CASSETTE='',
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            ):
+                results = self._run(options, user, conversations)
+        finally:
+            if server:
+                server.stop()
+            # Persisted chat is part of what is measured, but the benchmark leaves no rows behind
+            Conversation.objects.filter(id__in=conversations).delete()
+
+        results['llm_requests'] = server.requests if server else None
+        self.stdout.write(
+            f"{results['requests']} chats, concurrency {results['concurrency']}: {results['chats_per_sec']:.1f} chats/s, "
+            f"p50 {results['latency']['p50_ms']:.1f} ms, p95 {results['latency']['p95_ms']:.1f} ms, "
+            f"{results['errors']} errors, {results['mock_fallbacks']} mock fallbacks"
+        )
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _run(self, options, user, conversations):
+        headers = {}
+        if user is not None:
+            token = TourAIRefreshToken.for_user(user).access_token
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+
+        lock = threading.Lock()
+        latencies = []
+        counts = {'errors': 0, 'mock_fallbacks': 0}
+        worker_conversation = threading.local()
+        messages = itertools.cycle(MESSAGES)
+
+        def chat(index):
+            client = Client(**headers)
+            with lock:
+                message = next(messages)
+            data = {'message': message}
+            conversation_id = getattr(worker_conversation, 'id', None)
+            if conversation_id:
+                data['conversation_id'] = conversation_id
+
+            response, elapsed = timed_ms(client.post, '/api/chat/', data, content_type='application/json')
+
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    counts['errors'] += 1
+                elif user is not None and not conversation_id:
+                    worker_conversation.id = response.json().get('conversation_id')
+                    conversations.append(worker_conversation.id)
+
+        stopwatch = Stopwatch()
+        before = _mock_fallbacks()
+        # Views print progress; keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()), stopwatch.running():
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                list(pool.map(chat, range(options['requests'])))
+        # Every reason counts: agent errors, the open circuit breaker, an unavailable LLM
+        fallbacks = {reason: value - before.get(reason, 0) for reason, value in _mock_fallbacks().items()}
+        counts['mock_fallbacks_by_reason'] = {reason: value for reason, value in fallbacks.items() if value}
+        counts['mock_fallbacks'] = sum(fallbacks.values())
+
+        return {
+            'environment': environment_info(),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'stub_latency_ms': options['latency_ms'],
+            'chats_per_sec': options['requests'] / stopwatch.wall if stopwatch.wall else 0.0,
+            'latency': summarize(latencies),
+            **counts,
+        }
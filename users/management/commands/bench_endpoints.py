@@ -0,0 +1,304 @@
+import contextlib
+import datetime
+import io
+import logging
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+
+from users import impressions
+from users.bench import check_budgets, environment_info, load_budgets, summarize, timed_ms, write_results
+from users.models import ChatMessage, Conversation, SavedTour, Tour, User
+from users.synthetic import ANCHOR_DATE, PASSWORD, PRESETS, SyntheticDataGenerator, USERNAME_PREFIX
+from users.tokens import TourAIRefreshToken
+
+DEFAULT_BUDGETS = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'bench_budgets.json'))
+
+
+class Scenario:
+    """One request against one route. ``path`` and ``data`` may be callables of (fixtures, iteration)."""
+
+    def __init__(self, route, method, path, data=None, user=None, label=None, expect=(200,), multipart=False):
+        self.route = route
+        self.method = method
+        self.path = path
+        self.data = data
+        self.user = user
+        self.label = label or f'{route} {method}'
+        self.expect = expect
+        self.multipart = multipart
+
+    def build(self, fixtures, iteration):
+        path = self.path(fixtures, iteration) if callable(self.path) else self.path
+        data = self.data(fixtures, iteration) if callable(self.data) else self.data
+        return path, data
+
+
+def _import_file(fixtures, iteration):
+    rows = ['title,description,destination,price,hotel_name,external_id']
+    rows += [f'Bench Import {i},Imported by bench_endpoints,Bench City,{100 + i},Bench Hotel,bench-import-{i}' for i in range(20)]
+    upload = io.BytesIO('\n'.join(rows).encode())
+    upload.name = 'tours.csv'
+    return {'file': upload}
+
+
+def _new_conversation(fixtures, iteration):
+    conversation = Conversation.objects.create(user_id=fixtures['user'].id, title='Bench conversation')
+    return f'/api/conversations/{conversation.id}/'
+
+
+SCENARIOS = [
+    Scenario('user_registration', 'POST', '/api/auth/register/', expect=(201,), data=lambda fx, i: {
+        'username': f'bench_register_{i}', 'email': f'bench_register_{i}@example.com', 'password': 'Bench-Password-123',
+        'first_name': 'Bench', 'last_name': 'User',
+    }),
+    Scenario('sign_in', 'POST', '/api/auth/signin/', data=lambda fx, i: {'email': fx['user'].email, 'password': PASSWORD}),
+    Scenario('user_profile', 'GET', '/api/auth/profile/', user='user'),
+    Scenario('user_profile', 'PUT', '/api/auth/profile/', user='user', data={'bio': 'Benchmarking'}),
+    Scenario('agent_dashboard', 'GET', '/api/agent/dashboard/', user='agent'),
+    Scenario('agent_analytics', 'GET', '/api/agent/analytics/', user='agent'),
+    Scenario('token_refresh', 'POST', '/api/token/refresh/', data=lambda fx, i: {'refresh': fx['refresh']}),
+
+    Scenario('tour_list_create', 'GET', '/api/tours/'),
+    Scenario('tour_list_create', 'GET', '/api/tours/?search=beach&min_price=500&max_price=3000',
+             label='tour_list_create GET filtered'),
+    Scenario('tour_list_create', 'GET', '/api/tours/', user='user', label='tour_list_create GET authenticated'),
+    Scenario('tour_list_create', 'GET', '/api/tours/?destination=Europe', label='tour_list_create GET region'),
+    Scenario('tour_list_create', 'GET',
+             lambda fx, i: f"/api/tours/?month={ANCHOR_DATE + datetime.timedelta(days=60):%Y-%m}&flex_days=3&min_nights=5",
+             label='tour_list_create GET travel period'),
+    Scenario('tour_list_create', 'GET', '/api/tours/?currency=EUR&min_price=500&max_price=2500',
+             label='tour_list_create GET currency'),
+    Scenario('tour_list_create', 'GET', '/api/tours/?ordering=personalized', user='user',
+             label='tour_list_create GET personalized'),
+    Scenario('tour_list_create', 'POST', '/api/tours/', user='agent', expect=(201,), data={
+        'title': 'Bench Tour', 'description': 'Created by bench_endpoints', 'destination': 'Bench City',
+        'hotel_name': 'Bench Hotel', 'price': '999.00', 'meal_plan': 'half_board', 'flight_type': 'direct',
+    }),
+    Scenario('tour_detail', 'GET', lambda fx, i: f"/api/tours/{fx['tour_ids'][i % len(fx['tour_ids'])]}/", user='user'),
+    Scenario('tour_detail', 'PUT', lambda fx, i: f"/api/tours/{fx['agent_tour_ids'][0]}/", user='agent',
+             data={'title': 'Bench Updated Tour', 'description': 'Updated by bench_endpoints', 'destination': 'Bench City', 'hotel_name': 'Bench Hotel', 'price': '1099.00'}),
+    Scenario('tour_detail', 'DELETE', lambda fx, i: f"/api/tours/{fx['agent_tour_ids'][1 + i]}/", user='agent',
+             expect=(204,)),
+    Scenario('get_unique_destinations', 'GET', '/api/tours/destinations/'),
+    Scenario('destination_autocomplete', 'GET', '/api/tours/destinations/autocomplete/?q=ba'),
+    Scenario('get_similar_tours', 'GET', '/api/tours/similar/?q=romantic%20beach%20getaway'),
+    Scenario('get_similar_tours', 'GET', lambda fx, i: f"/api/tours/similar/?tour_id={fx['tour_ids'][i % len(fx['tour_ids'])]}",
+             label='get_similar_tours GET by tour'),
+    Scenario('tour_facets', 'GET', '/api/tours/facets/'),
+    Scenario('tour_facets', 'GET', '/api/tours/facets/?meal_plan=all_inclusive&max_price=3000&search=beach',
+             label='tour_facets GET filtered'),
+    Scenario('tour_changes', 'GET', '/api/tours/changes/?since=0&limit=100'),
+    Scenario('import_tours', 'POST', '/api/tours/import/', user='agent', data=_import_file, multipart=True),
+
+    Scenario('chat_with_ai', 'POST', '/api/chat/', data={'message': 'Show me beach tours in Bali'},
+             label='chat_with_ai POST anonymous'),
+    Scenario('chat_with_ai', 'POST', '/api/chat/', user='user', data=lambda fx, i: {
+        'message': 'Any adventure tours under $2000?', 'conversation_id': fx['chat_conversation'].id,
+    }),
+    Scenario('message_recommended_tours', 'GET',
+             lambda fx, i: f"/api/chat/messages/{fx['message'].id}/recommended-tours/", user='user'),
+    Scenario('conversation_list', 'GET', '/api/conversations/', user='user'),
+    Scenario('conversation_detail', 'GET', lambda fx, i: f"/api/conversations/{fx['conversation'].id}/", user='user'),
+    Scenario('conversation_detail', 'DELETE', _new_conversation, user='user', expect=(200, 204)),
+
+    Scenario('saved_tours_list', 'GET', '/api/saved-tours/', user='user'),
+    Scenario('saved_tours_list', 'POST', '/api/saved-tours/', user='user', expect=(201,),
+             data=lambda fx, i: {'tour_id': fx['unsaved_tour_ids'][i]}),
+    Scenario('unsave_tour', 'DELETE', lambda fx, i: f"/api/saved-tours/{fx['unsaved_tour_ids'][i]}/", user='user',
+             expect=(200, 204)),
+    Scenario('saved_tours_bulk', 'POST', '/api/saved-tours/bulk/', user='user',
+             data=lambda fx, i: {'tour_ids': fx['unsaved_tour_ids'][:20]}, expect=(200, 201)),
+    Scenario('saved_tours_bulk', 'DELETE', '/api/saved-tours/bulk/', user='user',
+             data=lambda fx, i: {'tour_ids': fx['unsaved_tour_ids'][:20]}),
+    Scenario('saved_tour_ids', 'GET', lambda fx, i: '/api/saved-tours/ids/?tour_ids=' + ','.join(map(str, fx['tour_ids'][:50])),
+             user='user'),
+
+    Scenario('get_tour_companies', 'GET', '/api/companies/'),
+    Scenario('get_company_tours', 'GET', lambda fx, i: f"/api/companies/{fx['company_id']}/tours/"),
+]
+
+
+def _budgets_from(endpoints):
+    return {
+        label: {
+            'p95_ms': round(max(measured['p95_ms'] * 2, 10), 1),
+            'queries': measured['queries'] + 2,
+            'bytes': int(measured['bytes'] * 1.25) + 256,
+        }
+        for label, measured in endpoints.items()
+    }
+
+
+@contextlib.contextmanager
+def _log_level(logger, level):
+    previous = logger.level
+    logger.setLevel(level)
+    try:
+        yield
+    finally:
+        logger.setLevel(previous)
+
+
+class Command(BaseCommand):
+    help = "Benchmark every API endpoint (latency, SQL queries, response size) against a synthetic test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=30, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per endpoint before timing')
+        parser.add_argument('--scale', choices=sorted(PRESETS), default='small', help='Synthetic dataset size')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--only', help='Only run endpoints whose label contains this text')
+        parser.add_argument('--budgets', default=DEFAULT_BUDGETS, help='JSON file with per-endpoint budgets')
+        parser.add_argument('--no-budgets', action='store_true', help='Report only, do not enforce budgets (unexpected statuses still fail)')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument(
+            '--write-budgets', action='store_true',
+            help='Overwrite the budgets file from this run (2x latency, +2 queries, +25%% bytes of headroom)'
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Keep (and reuse) the test database')
+
+    def handle(self, *args, **options):
+        self._check_coverage()
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            # Chat runs against the offline mock so results don't depend on the network or an API key.
+            # Similar-tours lists are refreshed after the response on a background thread; an in-memory
+            # SQLite test database can't take that concurrent writer, so it is left out here.
+            with override_settings(LLM_BACKEND='mock', SIMILAR_TOURS_REFRESH_ON_SAVE=False):
+                results = self._run(options)
+        finally:
+            # Buffered impressions go to the test database, not to an atexit flush after it is gone
+            impressions.flush()
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if options['write_budgets']:
+            write_results(options['budgets'], _budgets_from(results['endpoints']))
+            self.stdout.write(f"Budgets written to {options['budgets']}")
+
+        budgets = {}
+        if not options['write_budgets'] and not options['no_budgets'] and os.path.exists(options['budgets']):
+            budgets = load_budgets(options['budgets'])
+        # Unexpected statuses fail the run even when budgets aren't enforced
+        violations = check_budgets(results['endpoints'], budgets)
+        results['violations'] = violations
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if violations:
+            raise CommandError("Budgets exceeded:\n  " + "\n  ".join(violations))
+
+    def _check_coverage(self):
+        """Fail early when a route in users/urls.py has no scenario"""
+        from users import urls
+
+        routes = {pattern.name for pattern in urls.urlpatterns}
+        missing = routes - {scenario.route for scenario in SCENARIOS}
+        if missing:
+            raise CommandError(f"No benchmark scenario for routes: {', '.join(sorted(missing))}")
+
+    def _run(self, options):
+        if not Tour.objects.filter(external_id__startswith='synthetic-').exists():
+            self.stdout.write(f"Generating synthetic data ({options['scale']})...")
+            SyntheticDataGenerator(seed=options['seed'], **PRESETS[options['scale']]).generate()
+
+        count = options['requests']
+        fixtures = self._fixtures(count + options['warmup'])
+        clients = {None: Client()}
+        for role in ('user', 'agent'):
+            token = TourAIRefreshToken.for_user(fixtures[role]).access_token
+            clients[role] = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        results = {
+            'environment': environment_info(),
+            'config': {'requests': count, 'scale': options['scale'], 'seed': options['seed']},
+            'endpoints': {},
+        }
+        for scenario in SCENARIOS:
+            if options['only'] and options['only'] not in scenario.label:
+                continue
+            measured = self._bench(scenario, clients[scenario.user], fixtures, count, options['warmup'])
+            results['endpoints'][scenario.label] = measured
+            self.stdout.write(
+                f"{scenario.label:45} p50 {measured['p50_ms']:8.2f} ms  p95 {measured['p95_ms']:8.2f} ms  "
+                f"{measured['queries']:3d} queries  {measured['bytes']:8d} bytes"
+                + ('' if not measured['errors'] else f"  {measured['errors']} unexpected responses")
+            )
+        return results
+
+    def _fixtures(self, iterations):
+        agent = (
+            User.objects.filter(username__startswith=USERNAME_PREFIX, user_type='agent')
+            .annotate(num_tours=Count('tours')).order_by('-num_tours').first()
+        )
+        conversation = (
+            Conversation.objects.filter(user__username__startswith=USERNAME_PREFIX)
+            .annotate(num_messages=Count('messages')).order_by('-num_messages').first()
+        )
+        user = conversation.user
+        saved = set(SavedTour.objects.filter(user=user).values_list('tour_id', flat=True))
+        active_ids = list(Tour.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+        agent_tour_ids = list(Tour.objects.filter(agent=agent, is_active=True).order_by('id').values_list('id', flat=True))
+        excluded = set(agent_tour_ids)
+        if len(agent_tour_ids) <= iterations:
+            raise CommandError(f"The busiest synthetic agent has only {len(agent_tour_ids)} tours; use a larger --scale")
+
+        return {
+            'user': user,
+            'agent': agent,
+            'refresh': str(TourAIRefreshToken.for_user(user)),
+            'conversation': conversation,
+            # Chat appends messages, so it gets its own conversation to keep the other scenarios stable
+            'chat_conversation': Conversation.objects.create(user=user, title='Bench chat'),
+            'message': ChatMessage.objects.filter(conversation=conversation, sender='ai').first(),
+            'company_id': agent.tour_company_id or User.objects.filter(tour_company__isnull=False).values_list('tour_company_id', flat=True).first(),
+            'tour_ids': active_ids[:200],
+            'agent_tour_ids': agent_tour_ids,
+            # Tours the DELETE scenario deactivates are excluded so saves keep succeeding
+            'unsaved_tour_ids': [
+                tour_id for tour_id in active_ids if tour_id not in saved and tour_id not in excluded
+            ][:max(iterations, 20)],
+        }
+
+    def _bench(self, scenario, client, fixtures, count, warmup):
+        latencies, queries, sizes, errors = [], [], [], 0
+        request = getattr(client, scenario.method.lower())
+
+        # Views print debug output and Django logs 4xx responses; keep both out of the report
+        request_logger = logging.getLogger('django.request')
+        with contextlib.redirect_stdout(io.StringIO()) as sink, _log_level(request_logger, logging.ERROR):
+            for iteration in range(warmup + count):
+                path, data = scenario.build(fixtures, iteration)
+                args = () if data is None else (data,)
+                kwargs = {} if scenario.multipart or data is None else {'content_type': 'application/json'}
+                reset_queries()
+                with CaptureQueriesContext(connection) as captured:
+                    response, elapsed = timed_ms(request, path, *args, **kwargs)
+                sink.seek(0)
+                sink.truncate()
+                if response.status_code not in scenario.expect:
+                    errors += 1
+                if iteration < warmup:
+                    continue
+                latencies.append(elapsed)
+                queries.append(len(captured))
+                sizes.append(len(response.content))
+
+        return {
+            **summarize(latencies),
+            'queries': max(queries),
+            'bytes': max(sizes),
+            'errors': errors,
+        }
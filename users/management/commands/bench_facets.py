@@ -0,0 +1,160 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Q
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+
+from users import impressions
+from users.bench import environment_info, summarize, timed_ms, write_results
+from users.availability import period_condition
+from users.destinations import destination_condition
+from users.facets import CHOICES, PRICE_BUCKETS, FacetIndex, parse_filters
+from users.models import Destination, Tour
+from users.synthetic import PASSWORD, SyntheticDataGenerator
+
+# Filter combinations a Discover page sends; destination values are filled in from the data
+FILTER_SETS = [
+    {},
+    {'meal_plan': 'all_inclusive'},
+    {'max_price': '3000', 'visa_required': 'true'},
+    {'destination': None, 'flight_type': 'direct'},
+    {'destination': None, 'meal_plan': 'half_board', 'min_price': '500', 'max_price': '5000'},
+    {'search': 'beach', 'max_price': '2000'},
+]
+DISPLAYED_DESTINATIONS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Facet count latency on a generated catalog (in a test database): the facet index against one "
+        "grouped query per dimension and one count query per value"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tours', type=int, default=100000)
+        parser.add_argument('--requests', type=int, default=10, help='Requests per filter set and strategy')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true', help='Keep (and reuse) the test database')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = self._run(options)
+        finally:
+            # Buffered impressions go to the test database, not to an atexit flush after it is gone
+            impressions.flush()
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _run(self, options):
+        if Tour.objects.filter(is_active=True).count() < options['tours']:
+            self.stdout.write(f"Generating {options['tours']} tours...")
+            generator = SyntheticDataGenerator(seed=options['seed'], agents=200, tours=options['tours'])
+            company_ids = generator.create_companies()
+            agent_ids = generator.create_agents(company_ids, make_password(PASSWORD))
+            generator.create_tours(agent_ids)
+        tours = Tour.objects.filter(is_active=True).count()
+
+        destinations = list(Destination.objects.filter(tours__isnull=False).distinct().values_list('name', flat=True)[:20])
+        rng = random.Random(options['seed'])
+        filter_sets = [
+            {name: value if value is not None else rng.choice(destinations) for name, value in params.items()}
+            for params in FILTER_SETS
+        ]
+
+        index = FacetIndex()
+        _, load_ms = timed_ms(index.refresh)
+        results = {'environment': environment_info(), 'tours': tours, 'index_load_ms': round(load_ms, 1), 'strategies': {}}
+        self.stdout.write(f"{tours} active tours, facet index loaded in {load_ms:.0f} ms")
+
+        strategies = {
+            'index': lambda filters: index.counts(filters),
+            'grouped_sql': grouped_counts,
+            'query_per_value': per_value_counts,
+        }
+        for name, strategy in strategies.items():
+            latencies = []
+            queries = []
+            per_filter_set = []
+            for params in filter_sets:
+                filters = parse_filters(params)
+                set_latencies = []
+                for _ in range(options['requests']):
+                    with CaptureQueriesContext(connection) as captured:
+                        _, elapsed = timed_ms(strategy, filters)
+                    set_latencies.append(elapsed)
+                    queries.append(len(captured))
+                latencies.extend(set_latencies)
+                per_filter_set.append({'filters': params, 'latency': summarize(set_latencies)})
+            results['strategies'][name] = {
+                'latency': summarize(latencies), 'max_queries': max(queries), 'filter_sets': per_filter_set,
+            }
+            self.stdout.write(
+                f"{name:>16}: p50 {results['strategies'][name]['latency']['p50_ms']:8.2f} ms  "
+                f"p95 {results['strategies'][name]['latency']['p95_ms']:8.2f} ms  up to {max(queries)} queries"
+            )
+        return results
+
+
+def _queryset(filters, excluding=None):
+    """The list view's filters as a queryset, leaving out one facet dimension"""
+    queryset = Tour.objects.filter(is_active=True)
+    if 'search' in filters:
+        search = filters['search']
+        queryset = queryset.filter(
+            Q(title__icontains=search) | Q(description__icontains=search)
+            | Q(destination__icontains=search) | Q(hotel_name__icontains=search)
+        )
+    queryset = queryset.filter(period_condition(filters))
+    if 'destination' in filters and excluding != 'destination':
+        queryset = queryset.filter(destination_condition(filters['destination']))
+    for name in ('meal_plan', 'flight_type'):
+        if name in filters and excluding != name:
+            queryset = queryset.filter(**{name: filters[name]})
+    if 'visa_required' in filters and excluding != 'visa_required':
+        queryset = queryset.filter(visa_required=True)
+    if excluding != 'price':
+        if 'min_price' in filters:
+            queryset = queryset.filter(price_usd__gte=filters['min_price'])
+        if 'max_price' in filters:
+            queryset = queryset.filter(price_usd__lte=filters['max_price'])
+    return queryset
+
+
+def grouped_counts(filters):
+    """Baseline: one GROUP BY query per dimension"""
+    counts = {'total': _queryset(filters).count()}
+    for name in ('destination', 'meal_plan', 'flight_type', 'visa_required'):
+        column = 'place__name' if name == 'destination' else name
+        counts[name] = dict(_queryset(filters, name).values_list(column).annotate(count=Count('id')).order_by())
+    queryset = _queryset(filters, 'price')
+    counts['price'] = queryset.aggregate(**{
+        f'bucket_{low}': Count('id', filter=Q(price_usd__gte=low, **({'price_usd__lt': high} if high else {})))
+        for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + (None,))
+    })
+    return counts
+
+
+def per_value_counts(filters):
+    """What a client has to do without a facet API: one count per displayed value"""
+    counts = {'total': _queryset(filters).count()}
+    # A filter panel shows a limited number of destinations
+    destinations = _queryset(filters, 'destination').values_list('place', flat=True).distinct()[:DISPLAYED_DESTINATIONS]
+    counts['destination'] = {
+        destination: _queryset(filters, 'destination').filter(place=destination).count()
+        for destination in destinations
+    }
+    for name in ('meal_plan', 'flight_type'):
+        counts[name] = {value: _queryset(filters, name).filter(**{name: value}).count() for value, _ in CHOICES[name]}
+    counts['visa_required'] = _queryset(filters, 'visa_required').filter(visa_required=True).count()
+    counts['price'] = [
+        _queryset(filters, 'price').filter(price_usd__gte=low, **({'price_usd__lt': high} if high else {})).count()
+        for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + (None,))
+    ]
+    return counts
@@ -0,0 +1,80 @@
+import contextlib
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users.bench import environment_info, summarize, timed_ms, write_results
+from users.models import Tour, UserAffinity
+from users.personalization import personalize
+from users.views import TourListCreateView
+
+
+class Command(BaseCommand):
+    help = (
+        "Overhead of ordering=personalized on the tour list: time and queries per page with and without it, "
+        "for users that have an affinity (run `manage.py compute_affinities` first)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 5, 30], help='Page numbers to request')
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=3, help='Requests per user and page')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def handle(self, *args, **options):
+        user_ids = list(
+            UserAffinity.objects.filter(weight__gt=0).order_by('-weight').values_list('user_id', flat=True)[:options['users']]
+        )
+        if not user_ids:
+            raise CommandError("No user affinities; run `manage.py compute_affinities` first")
+        users = list(UserAffinity.objects.filter(user_id__in=user_ids).select_related('user'))
+
+        factory = APIRequestFactory(SERVER_NAME='localhost')
+        view = TourListCreateView.as_view()
+        results = {'environment': environment_info(), 'users': len(users), 'pages': {}}
+
+        for page in options['pages']:
+            page_results = {}
+            for ordering in ('default', 'personalized'):
+                query = f"?page={page}&page_size={options['page_size']}"
+                if ordering == 'personalized':
+                    query += '&ordering=personalized'
+                latencies = []
+                queries = 0
+                # The list view prints debug output for every request
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for affinity in users:
+                        for _ in range(options['repeat']):
+                            request = factory.get(f'/api/tours/{query}')
+                            force_authenticate(request, user=affinity.user)
+                            with CaptureQueriesContext(connection) as captured:
+                                response, elapsed = timed_ms(lambda: view(request).render())
+                            if response.status_code != 200:
+                                raise CommandError(f"{query} returned {response.status_code}")
+                            latencies.append(elapsed)
+                            queries = len(captured)
+                page_results[ordering] = {'latency': summarize(latencies), 'queries': queries}
+
+            overhead = page_results['personalized']['latency']['p50_ms'] - page_results['default']['latency']['p50_ms']
+            page_results['overhead_p50_ms'] = round(overhead, 3)
+            results['pages'][page] = page_results
+            self.stdout.write(
+                f"page {page:>3}: default p50 {page_results['default']['latency']['p50_ms']:.2f} ms "
+                f"({page_results['default']['queries']} queries), personalized p50 "
+                f"{page_results['personalized']['latency']['p50_ms']:.2f} ms "
+                f"({page_results['personalized']['queries']} queries), overhead {overhead:+.2f} ms"
+            )
+
+        # The re-ranking step on its own: affinity lookup, window query and scoring
+        queryset = Tour.objects.filter(is_active=True).order_by('-created_at')
+        rerank = [timed_ms(personalize, queryset, affinity.user_id)[1] for affinity in users]
+        results['rerank'] = summarize(rerank)
+        self.stdout.write(f"re-rank step: p50 {results['rerank']['p50_ms']:.2f} ms, p95 {results['rerank']['p95_ms']:.2f} ms")
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
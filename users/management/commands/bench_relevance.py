@@ -0,0 +1,118 @@
+import contextlib
+import io
+import math
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.bench import environment_info, write_results
+from users.chat_service import (
+    search_tours_by_destination, search_tours_by_meal_plan, search_tours_by_price_range,
+)
+from users.models import Tour
+from users.ranking import collect_candidates
+
+CRITERIA = ('destination', 'price', 'meal_plan')
+
+
+class Command(BaseCommand):
+    help = (
+        "Offline relevance of the tours a chat turn shows: run the search tools for generated multi-criteria "
+        "queries and compare first-seen merging with the ranked merge (precision@k, nDCG@k, MRR)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def handle(self, *args, **options):
+        catalog = list(Tour.objects.filter(is_active=True).values_list('id', 'destination', 'price', 'meal_plan'))
+        if not catalog:
+            raise CommandError("No active tours; run `manage.py generate_synthetic_data` first")
+
+        rng = random.Random(options['seed'])
+        k = options['k']
+        totals = {'first_seen': [], 'ranked': []}
+        for _ in range(options['queries']):
+            query = self._make_query(rng, catalog)
+            grades = {tour[0]: self._grade(query, tour) for tour in catalog}
+            ideal = sorted(grades.values(), reverse=True)[:k]
+            pools, ranked = self._run_tools(query)
+            for name, ids in (('first_seen', self._first_seen(pools, k)), ('ranked', ranked[:k])):
+                totals[name].append(self._score(ids, grades, ideal, len(query), k))
+
+        results = {'environment': environment_info(), 'queries': options['queries'], 'k': k}
+        for name, scores in totals.items():
+            results[name] = {
+                metric: round(sum(score[metric] for score in scores) / len(scores), 4)
+                for metric in ('precision', 'ndcg', 'mrr')
+            }
+            self.stdout.write(
+                f"{name:>10}: precision@{k} {results[name]['precision']:.3f}, nDCG@{k} {results[name]['ndcg']:.3f}, "
+                f"MRR {results[name]['mrr']:.3f}"
+            )
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    @staticmethod
+    def _make_query(rng, catalog):
+        """Two or three criteria built around a random tour, so at least one tour matches them all"""
+        _, destination, price, meal_plan = rng.choice(catalog)
+        criteria = rng.sample(CRITERIA, rng.choice((2, 3)))
+        query = {}
+        if 'destination' in criteria:
+            query['destination'] = destination.split(',')[0]
+        if 'price' in criteria:
+            query['max_price'] = int(math.ceil(price * Decimal('1.2') / 100) * 100)
+        if 'meal_plan' in criteria:
+            query['meal_plan'] = meal_plan
+        return query
+
+    @staticmethod
+    def _grade(query, tour):
+        """Number of the query's criteria the tour meets"""
+        _, destination, price, meal_plan = tour
+        grade = 0
+        if 'destination' in query and query['destination'].lower() in destination.lower():
+            grade += 1
+        if 'max_price' in query and price <= query['max_price']:
+            grade += 1
+        if 'meal_plan' in query and meal_plan == query['meal_plan']:
+            grade += 1
+        return grade
+
+    @staticmethod
+    def _run_tools(query):
+        """The tool calls an agent would make for the query, in order, as one collected turn"""
+        with contextlib.redirect_stdout(io.StringIO()), collect_candidates() as candidates:
+            if 'destination' in query:
+                search_tours_by_destination.invoke({'destination': query['destination']})
+            if 'max_price' in query:
+                search_tours_by_price_range.invoke({'max_price': query['max_price']})
+            if 'meal_plan' in query:
+                search_tours_by_meal_plan.invoke({'meal_plan': query['meal_plan']})
+            return candidates.pools, candidates.ranked()
+
+    @staticmethod
+    def _first_seen(pools, k):
+        """The previous merge: each tool's first five results in call order, first k distinct IDs"""
+        ids = []
+        for _, pool in pools:
+            ids.extend(pool[:5])
+        return list(dict.fromkeys(ids))[:k]
+
+    @staticmethod
+    def _score(ids, grades, ideal, criteria, k):
+        gains = [2 ** grades.get(tour_id, 0) - 1 for tour_id in ids]
+        dcg = sum(gain / math.log2(position + 2) for position, gain in enumerate(gains))
+        idcg = sum((2 ** grade - 1) / math.log2(position + 2) for position, grade in enumerate(ideal))
+        full = [position for position, tour_id in enumerate(ids) if grades.get(tour_id) == criteria]
+        return {
+            'precision': len(full) / k,
+            'ndcg': dcg / idcg if idcg else 0.0,
+            'mrr': 1 / (full[0] + 1) if full else 0.0,
+        }
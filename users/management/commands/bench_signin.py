@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from users.bench import Stopwatch, environment_info, summarize, timed_ms, write_results
+from users.models import User
+from users.serializers import SignInSerializer, UserTokenSerializer
+from users.tokens import TourAIRefreshToken
+
+
+class Command(BaseCommand):
+    help = "Benchmark the sign-in path (email lookup, password check, JWT issuance) and report sign-ins per second per core"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50, help='Number of sign-ins to time')
+        parser.add_argument(
+            '--iterations', type=int, nargs='*', default=[],
+            help='PBKDF2 iteration counts to compare (default: the configured value)'
+        )
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def handle(self, *args, **options):
+        iteration_counts = options['iterations'] or [None]
+        results = {'environment': environment_info(), 'runs': []}
+
+        for iterations in iteration_counts:
+            with override_settings(PASSWORD_HASHER_ITERATIONS=iterations):
+                run = self._run(options['count'], iterations)
+            results['runs'].append(run)
+            self.stdout.write(
+                f"iterations={run['iterations']}: {run['signins_per_sec_per_core']:.1f} sign-ins/s/core, "
+                f"p50 {run['success']['p50_ms']:.1f} ms, p95 {run['success']['p95_ms']:.1f} ms, "
+                f"unknown email p50 {run['unknown_email']['p50_ms']:.1f} ms, "
+                f"wrong password p50 {run['wrong_password']['p50_ms']:.1f} ms"
+            )
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _run(self, count, iterations):
+        from django.contrib.auth.hashers import get_hasher
+
+        password = 'bench-Password-123'
+        success, unknown, wrong = [], [], []
+        stopwatch = Stopwatch()
+
+        # Everything happens in a transaction that is rolled back, so the database is left untouched
+        with transaction.atomic():
+            User.objects.create_user('bench_signin', 'bench_signin@example.com', password)
+
+            for _ in range(count):
+                with stopwatch.running():
+                    _, elapsed = timed_ms(self._sign_in, 'bench_signin@example.com', password)
+                success.append(elapsed)
+                unknown.append(timed_ms(self._sign_in, 'nobody@example.com', password)[1])
+                wrong.append(timed_ms(self._sign_in, 'bench_signin@example.com', 'wrong-password')[1])
+
+            transaction.set_rollback(True)
+
+        return {
+            'iterations': get_hasher().iterations if iterations is None else iterations,
+            'signins_per_sec_per_core': count / stopwatch.cpu if stopwatch.cpu else 0.0,
+            'signins_per_sec_wall': count / stopwatch.wall if stopwatch.wall else 0.0,
+            'success': summarize(success),
+            'unknown_email': summarize(unknown),
+            'wrong_password': summarize(wrong),
+        }
+
+    def _sign_in(self, email, password):
+        serializer = SignInSerializer(data={'email': email, 'password': password})
+        if not serializer.is_valid():
+            return None
+        user = serializer.validated_data['user']
+        refresh = TourAIRefreshToken.for_user(user)
+        return {
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+            'user': UserTokenSerializer(user).data,
+        }
@@ -0,0 +1,22 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.changes import compact
+
+
+class Command(BaseCommand):
+    help = "Merge each tour's change log entries older than --days into its latest one (run periodically, e.g. daily)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=settings.TOUR_CHANGES_COMPACT_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tours per transaction')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        removed = compact(before, batch_size=options['batch_size'])
+        self.stdout.write(f"Removed {removed} change log entries in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.personalization import rebuild_affinities
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user affinities behind ordering=personalized from saved tours and chat recommendations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only this user ID (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = rebuild_affinities(options['users'], batch_size=options['batch_size'])
+        self.stdout.write(f"Rebuilt {count} user affinities in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.embeddings import embed_stale_tours
+from users.models import SimilarTour
+from users.similarity import compute_similar_tours, refresh_similar_tours
+
+
+class Command(BaseCommand):
+    help = "Precompute the similar-tours lists (all tours, or only the lists affected by --tour IDs)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=256, help='Tours scored against the catalog per batch')
+        parser.add_argument('--k', type=int, default=settings.SIMILAR_TOURS_K, help='Neighbours kept per tour')
+        parser.add_argument('--tour', type=int, action='append', dest='tours', help='Refresh after changes to this tour (repeatable)')
+        parser.add_argument('--show', type=int, help='Print the list of this tour afterwards')
+
+    def handle(self, *args, **options):
+        # Text similarity needs current embeddings
+        embedded = embed_stale_tours()
+        if embedded:
+            self.stdout.write(f"Embedded {embedded} tours first")
+
+        if options['tours']:
+            start = time.perf_counter()
+            refreshed = refresh_similar_tours(options['tours'], k=options['k'], batch_size=options['batch_size'])
+            self.stdout.write(f"Refreshed {refreshed} lists in {time.perf_counter() - start:.2f}s")
+        else:
+            stats = compute_similar_tours(k=options['k'], batch_size=options['batch_size'], log=self.stdout.write)
+            rate = stats['tours'] / stats['elapsed_seconds'] if stats['elapsed_seconds'] else 0
+            self.stdout.write(
+                f"Computed {stats['rows']} neighbours for {stats['tours']} tours in {stats['elapsed_seconds']}s "
+                f"({rate:.0f} tours/s)"
+            )
+
+        if options['show']:
+            entries = SimilarTour.objects.filter(tour_id=options['show']).select_related('tour', 'similar').order_by('rank')
+            for entry in entries:
+                similar = entry.similar
+                self.stdout.write(
+                    f"  {entry.score:.3f}  {similar.title} ({similar.destination}, ${similar.price}, "
+                    f"{similar.meal_plan}, {similar.start_date})"
+                )
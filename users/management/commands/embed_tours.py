@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.embeddings import HashingVectorizer, embed_stale_tours, embed_tours, index
+from users.models import Tour, TourEmbedding
+
+
+class Command(BaseCommand):
+    help = "Compute the embeddings used for semantic tour search (only missing or outdated ones unless --rebuild)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Re-embed every tour and drop orphaned rows')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--query', help='Run a test search after embedding and print the top matches')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['rebuild']:
+            TourEmbedding.objects.exclude(model=HashingVectorizer().signature).delete()
+            tours = Tour.objects.only('id', 'title', 'destination', 'description').iterator(chunk_size=options['batch_size'])
+            count = embed_tours(tours, batch_size=options['batch_size'])
+        else:
+            count = embed_stale_tours(batch_size=options['batch_size'])
+        self.stdout.write(f"Embedded {count} tours in {time.perf_counter() - start:.1f}s")
+
+        if options['query']:
+            start = time.perf_counter()
+            index.refresh()
+            loaded = time.perf_counter() - start
+            start = time.perf_counter()
+            hits = index.search(options['query'], k=10)
+            searched = time.perf_counter() - start
+            self.stdout.write(f"Index: {index.size} vectors loaded in {loaded * 1000:.0f} ms, search {searched * 1000:.1f} ms")
+            titles = Tour.objects.in_bulk([tour_id for tour_id, _ in hits])
+            for tour_id, score in hits:
+                tour = titles[tour_id]
+                self.stdout.write(f"  {score:.3f}  {tour.title} ({tour.destination})")
@@ -0,0 +1,35 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand
+
+from users.synthetic import ANCHOR_DATE, PRESETS, PASSWORD, SyntheticDataGenerator, clear_synthetic_data
+
+
+class Command(BaseCommand):
+    help = "Generate a deterministic synthetic dataset (companies, agents, tours, chats, saved tours) for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(PRESETS), default='small', help='Preset dataset size')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--anchor-date', type=datetime.date.fromisoformat, default=ANCHOR_DATE,
+                            help=f'Tour dates count from this day (default {ANCHOR_DATE})')
+        for name in PRESETS['small']:
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, dest=name, help=f'Override the preset {name}')
+        parser.add_argument('--clear', action='store_true', help='Delete existing synthetic data first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write(f"Deleted {clear_synthetic_data()} synthetic objects")
+
+        sizes = dict(PRESETS[options['scale']])
+        sizes.update({name: options[name] for name in sizes if options.get(name) is not None})
+
+        generator = SyntheticDataGenerator(
+            seed=options['seed'], batch_size=options['batch_size'], anchor_date=options['anchor_date'],
+            log=self.stdout.write, **sizes
+        )
+        counts = generator.generate()
+        self.stdout.write(json.dumps(counts, indent=2))
+        self.stdout.write(f"Synthetic users sign in with password '{PASSWORD}'")
@@ -0,0 +1,58 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from users.models import User
+from users.tour_import import TourImporter, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk import tours for an agent from a CSV or JSON Lines file (rows with an external_id are upserted)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for stdin")
+        parser.add_argument('--agent', required=True, help='Username or email of the agent who owns the tours')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--errors', help='Write rejected rows as JSON Lines to this file')
+
+    def handle(self, *args, **options):
+        try:
+            agent = User.objects.get(Q(username=options['agent']) | Q(email=options['agent']), user_type='agent')
+        except User.DoesNotExist:
+            raise CommandError(f"No agent found for '{options['agent']}'")
+
+        fmt = options['format'] or detect_format(options['path'])
+        error_file = open(options['errors'], 'w') if options['errors'] else None
+
+        def on_error(row_number, errors):
+            if error_file:
+                error_file.write(json.dumps({'row': row_number, 'errors': errors}) + '\n')
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8-sig')
+        try:
+            importer = TourImporter(agent, batch_size=options['batch_size'], on_error=on_error, max_errors=10)
+            report = importer.run(read_rows(stream, fmt))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if error_file:
+                error_file.close()
+
+        self.stdout.write(
+            f"Imported {report.imported} of {report.total} rows in {report.elapsed:.2f}s "
+            f"({report.rows_per_sec:.0f} rows/sec), {report.failed} failed"
+        )
+        for error in report.errors:
+            self.stdout.write(f"  row {error['row']}: {json.dumps(error['errors'])}")
+        if report.failed > len(report.errors):
+            self.stdout.write(f"  ... {report.failed - len(report.errors)} more" + (
+                f" (see {options['errors']})" if options['errors'] else ''
+            ))
+        if report.stopped:
+            raise CommandError(
+                f"Reading stopped after row {report.stopped['after_row']} ({report.stopped['error']}); "
+                f"the rows up to there were imported"
+            )
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.currency import fx_table, refresh_base_prices
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the dollar prices behind price filters and ordering after FX_RATES_FILE changes "
+        "(run compute_similar_tours and compute_affinities afterwards if rates moved a lot)"
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        updated, missing = refresh_base_prices()
+        self.stdout.write(
+            f"Updated {updated} tour prices at the rates of {fx_table().as_of or 'unknown date'} "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+        if missing:
+            self.stderr.write(f"No rate for {', '.join(sorted(missing))}: those tours keep their previous dollar price")
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.analytics import backfill, rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Count queued tour views, saves and recommendations into the daily stats behind /api/agent/analytics/ "
+        "(run every few minutes)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Events per transaction')
+        parser.add_argument(
+            '--backfill', action='store_true',
+            help='First rebuild save and recommendation counts from saved tours and chat history (once, after deploying)'
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['backfill']:
+            self.stdout.write(f"Backfilled {backfill()} daily rows in {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        counted = rollup(batch_size=options['batch_size'])
+        self.stdout.write(f"Counted {counted} events in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from users.llm_stub import StubLLMServer, StubScript, load_script
+
+
+class Command(BaseCommand):
+    help = "Run a local OpenAI-compatible chat completions server with scripted tool calls"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Added latency per completion')
+        parser.add_argument('--jitter-ms', type=float, default=0, help='Uniform +/- jitter around --latency-ms')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for the latency jitter')
+        parser.add_argument('--fail-rate', type=float, default=0, help='Share of requests answered with HTTP 500')
+        parser.add_argument('--slow-rate', type=float, default=0, help='Share of requests slowed by --slow-ms')
+        parser.add_argument('--slow-ms', type=float, default=0)
+        parser.add_argument('--script', help='JSON file with scripted rules (default: built-in tour rules)')
+
+    def handle(self, *args, **options):
+        script = StubScript(load_script(options['script']) if options['script'] else None)
+        server = StubLLMServer(
+            options['host'], options['port'], script=script,
+            latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'], seed=options['seed'],
+            fail_rate=options['fail_rate'], slow_rate=options['slow_rate'], slow_ms=options['slow_ms'],
+        )
+        self.stdout.write(f"LLM stub listening on {server.base_url} (set OPENAI_BASE_URL={server.base_url})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
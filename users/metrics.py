@@ -0,0 +1,353 @@
+"""
+In-process metrics with Prometheus text exposition (served at ``/metrics``).
+
+Recording is lock-free: every thread writes to its own shard (a plain dict only that thread
+mutates), and shards are summed when metrics are scraped. When a thread ends (servers that
+start one per request), its shard is folded into a retired total, so memory and scrape time
+stay bounded by the number of live threads. Under gunicorn each worker process
+also writes its totals to ``METRICS_DIR/metrics-<pid>.json`` every ``METRICS_FLUSH_INTERVAL``
+seconds and at exit; a scrape merges the files of all workers with its own live values.
+Clear ``METRICS_DIR`` when deploying, as with prometheus_client's multiprocess mode.
+
+Usage::
+
+    REQUESTS = counter('tourai_things_total', 'Things done', ('kind',))
+    REQUESTS.inc('big')
+    LATENCY = histogram('tourai_thing_seconds', 'Thing latency', ('kind',))
+    LATENCY.observe(0.25, 'big')
+"""
+import atexit
+import bisect
+import functools
+import glob
+import json
+import os
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+_metrics = {}
+_shards = []
+# Totals of the shards of threads that have ended
+_retired = {}
+# Reentrant: a thread-local can be released (retiring its shard) while the lock is held
+_shards_lock = threading.RLock()
+_local = threading.local()
+
+
+class _Owner:
+    """Lives in the thread-local, so it is released when its thread ends"""
+
+
+def _retire(shard):
+    with _shards_lock:
+        # By identity: another thread's shard may hold equal values
+        position = next((i for i, other in enumerate(_shards) if other is shard), None)
+        if position is None:
+            # Cleared by a fork since
+            return
+        del _shards[position]
+        for key, value in shard.items():
+            metric = _metrics[key[0]]
+            _retired[key] = metric.merge(_retired.get(key, metric.empty()), value)
+
+
+def _shard():
+    """This thread's ``{(metric name, label values): value}`` dict"""
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        owner = _local.owner = _Owner()
+        with _shards_lock:
+            _shards.append(shard)
+        weakref.finalize(owner, _retire, shard)
+    return shard
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labelvalues, amount=1):
+        shard = _shard()
+        key = (self.name, labelvalues)
+        shard[key] = shard.get(key, 0) + amount
+
+    def empty(self):
+        return 0
+
+    @staticmethod
+    def merge(total, value):
+        return total + value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        shard = _shard()
+        key = (self.name, labelvalues)
+        # Per-bucket (not cumulative) counts, then sum and count
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = self.empty()
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def empty(self):
+        return [0] * (len(self.buckets) + 1) + [0.0, 0]
+
+    @staticmethod
+    def merge(total, value):
+        return [a + b for a, b in zip(total, value)]
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+
+class _Timer:
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def _register(metric):
+    if metric.name in _metrics:
+        raise ValueError(f"Metric {metric.name} is already registered")
+    _metrics[metric.name] = metric
+    return metric
+
+
+def snapshot():
+    """This process's totals as ``{name: {label values: value}}``"""
+    with _shards_lock:
+        shards = [dict(_retired), *_shards]
+    totals = {}
+    for shard in shards:
+        # Copy first: the owning thread may add keys while we read
+        for (name, labelvalues), value in list(shard.items()):
+            metric = _metrics[name]
+            series = totals.setdefault(name, {})
+            series[labelvalues] = metric.merge(series.get(labelvalues, metric.empty()), value)
+    return totals
+
+
+def _merge_into(totals, other):
+    for name, series in other.items():
+        metric = _metrics.get(name)
+        if metric is None:
+            continue
+        target = totals.setdefault(name, {})
+        for labelvalues, value in series.items():
+            target[labelvalues] = metric.merge(target.get(labelvalues, metric.empty()), value)
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', '')
+
+
+def write_snapshot():
+    """Write this process's totals for other workers' scrapes to pick up"""
+    directory = _metrics_dir()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    data = {name: [[list(labels), value] for labels, value in series.items()] for name, series in snapshot().items()}
+    path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+def collect():
+    """Totals of every worker process: live values for this one, snapshot files for the others"""
+    totals = snapshot()
+    directory = _metrics_dir()
+    if directory:
+        own = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            _merge_into(totals, {name: {tuple(labels): value for labels, value in series} for name, series in data.items()})
+    return totals
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def exposition():
+    """Prometheus text format (version 0.0.4)"""
+    totals = collect()
+    lines = []
+    for name, metric in sorted(_metrics.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for labelvalues, value in sorted(totals.get(name, {}).items()):
+            if metric.type == 'counter':
+                lines.append(f'{name}{_format_labels(metric.labelnames, labelvalues)} {_format_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip([*metric.buckets, '+Inf'], value):
+                cumulative += count
+                labels = _format_labels(metric.labelnames, labelvalues, [('le', bound)])
+                lines.append(f'{name}_bucket{labels} {cumulative}')
+            labels = _format_labels(metric.labelnames, labelvalues)
+            lines.append(f'{name}_sum{labels} {_format_number(value[-2])}')
+            lines.append(f'{name}_count{labels} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+_flusher_started = False
+_flusher_lock = threading.Lock()
+
+
+def start_flusher():
+    """Periodically write this process's snapshot (no-op without METRICS_DIR)"""
+    global _flusher_started
+    if not _metrics_dir():
+        return
+    with _flusher_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+
+    threading.Thread(target=run, name='metrics-flusher', daemon=True).start()
+    atexit.register(write_snapshot)
+
+
+def _after_fork():
+    # gunicorn --preload forks after the app is loaded: start each worker with its own
+    # empty shards and flusher thread (threads do not survive fork)
+    global _flusher_started, _local
+    _shards.clear()
+    _retired.clear()
+    _local = threading.local()
+    _flusher_started = False
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+# Metrics recorded across the app
+
+HTTP_REQUESTS = counter('tourai_http_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status'))
+HTTP_LATENCY = histogram('tourai_http_request_duration_seconds', 'HTTP request latency', ('route', 'method'))
+DB_QUERIES = histogram('tourai_db_queries_per_request', 'SQL queries per HTTP request', ('route',), COUNT_BUCKETS)
+TOOL_LATENCY = histogram('tourai_tool_duration_seconds', 'Agent tool latency', ('tool',))
+TOOL_RESULTS = histogram('tourai_tool_results', 'Items returned per agent tool call', ('tool',), COUNT_BUCKETS)
+TOOL_ERRORS = counter('tourai_tool_errors_total', 'Agent tool calls that raised', ('tool',))
+AGENT_ITERATIONS = histogram('tourai_agent_iterations', 'Agent tool-calling iterations per chat', (), COUNT_BUCKETS)
+LLM_LATENCY = histogram('tourai_llm_request_duration_seconds', 'LLM request latency', ('model',))
+LLM_ERRORS = counter('tourai_llm_errors_total', 'Failed LLM requests', ('model',))
+MOCK_FALLBACKS = counter('tourai_chat_mock_fallbacks_total', 'Chats answered by the mock responder', ('reason',))
+CACHE_REQUESTS = counter('tourai_cache_requests_total', 'Cache lookups by cache and result (hit/miss)', ('cache', 'result'))
+IMPRESSIONS_WRITTEN = counter('tourai_impressions_written_total', 'Recommendation impressions written to the database')
+IMPRESSIONS_DROPPED = counter('tourai_impressions_dropped_total', 'Recommendation impressions dropped from a full buffer')
+
+
+def track_tool(func):
+    """Record latency, result count and errors of an agent tool"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            TOOL_ERRORS.inc(name)
+            raise
+        finally:
+            TOOL_LATENCY.observe(time.perf_counter() - start, name)
+        if isinstance(result, (list, tuple, dict)):
+            TOOL_RESULTS.observe(len(result), name)
+        return result
+    return wrapper
+
+
+def llm_callback():
+    """LangChain callback handler recording LLM latency and errors"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMMetricsCallback(BaseCallbackHandler):
+        def __init__(self):
+            self.started = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self.started[run_id] = (time.perf_counter(), _model_name(serialized, kwargs))
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self.started[run_id] = (time.perf_counter(), _model_name(serialized, kwargs))
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            start, model = self.started.pop(run_id, (None, 'unknown'))
+            if start is not None:
+                LLM_LATENCY.observe(time.perf_counter() - start, model)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            start, model = self.started.pop(run_id, (None, 'unknown'))
+            LLM_ERRORS.inc(model)
+
+    return LLMMetricsCallback()
+
+
+def _model_name(serialized, kwargs):
+    params = kwargs.get('invocation_params') or {}
+    return params.get('model') or params.get('model_name') or ((serialized or {}).get('kwargs') or {}).get('model_name', 'unknown')
@@ -0,0 +1,179 @@
+import logging
+import random
+import time
+import uuid
+
+from django.conf import settings
+
+from . import metrics, routers
+from .db import count_queries, time_new_connections
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionTimingMiddleware:
+    """
+    Time the database connections each request had to open.
+
+    Connections are timed when the request's queries open them (``connection_created``), so a
+    request that reuses a persistent connection, or needs no database, pays nothing extra. Each
+    one is exposed as a ``Server-Timing`` header (``db-connect``, described by the database
+    alias) so it shows up in browser dev tools and any metrics pipeline that scrapes response
+    headers. The total is also stored on the request as ``db_connect_ms``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with time_new_connections() as opened:
+            response = self.get_response(request)
+        if opened:
+            request.db_connect_ms = sum(elapsed_ms or 0 for _, elapsed_ms in opened)
+        for alias, elapsed_ms in opened:
+            logger.debug("Opened new %s database connection in %s ms", alias, elapsed_ms)
+            add_server_timing(response, 'db-connect', elapsed_ms, alias)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Per-request state for ``users.routers.ReplicaRouter``.
+
+    Models written during a request are remembered in a short-lived cookie so the same
+    client keeps reading them from the primary until the replicas have caught up.
+    """
+    cookie_name = 'tourai_primary_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        carried = set(filter(None, request.COOKIES.get(self.cookie_name, '').split('|')))
+        routers.start_request(carried)
+
+        response = self.get_response(request)
+
+        written = routers.written_models()
+        if written and routers.get_replica_aliases():
+            response.set_cookie(
+                self.cookie_name,
+                '|'.join(sorted(written | carried)),
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+
+class MetricsMiddleware:
+    """Record latency, status and SQL query count of every request (see users.metrics)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        metrics.start_flusher()
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        # Agent tool threads add their queries too (users.agent_executor)
+        with count_queries() as queries:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        metrics.HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+        metrics.HTTP_LATENCY.observe(elapsed, route, request.method)
+        metrics.DB_QUERIES.observe(queries.count, route)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile staff users' requests on demand.
+
+    Every response gets an ``X-Request-ID``. A request is profiled when it sends the
+    ``PROFILING_HEADER`` header (``X-Profile: 1``) or is picked by ``PROFILING_SAMPLE_RATE``,
+    and its bearer token belongs to a staff user (checked before the profiler starts, so other
+    clients can't add profiling overhead). The profile is written to ``PROFILE_DIR`` and indexed
+    by a ``RequestProfile`` row (browsable in the admin), and ``X-Profile-ID`` is returned.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.request_id = uuid.uuid4().hex
+        user = self._staff_user(request) if self._should_profile(request) else None
+        if user is None:
+            response = self.get_response(request)
+            response['X-Request-ID'] = request.request_id
+            return response
+
+        from .profiling import RequestProfiler
+
+        profiler = RequestProfiler(settings.PROFILING_MODE, settings.PROFILING_INTERVAL_MS).start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+
+        response['X-Request-ID'] = request.request_id
+        try:
+            self._save(request, response, profiler, user)
+            response['X-Profile-ID'] = request.request_id
+        except Exception as e:
+            logger.warning("Could not save request profile: %s", e)
+        return response
+
+    def _should_profile(self, request):
+        if not settings.PROFILING_ENABLED:
+            return False
+        if request.headers.get(settings.PROFILING_HEADER):
+            return True
+        return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+    @staticmethod
+    def _staff_user(request):
+        """The staff user the request's bearer token belongs to, else None (DRF authenticates later, in the view)"""
+        from .authentication import ClaimsJWTAuthentication
+
+        try:
+            authenticated = ClaimsJWTAuthentication().authenticate(request)
+        except Exception:
+            return None
+        if authenticated is None or not authenticated[0].is_staff:
+            return None
+        return authenticated[0]
+
+    def _save(self, request, response, profiler, user):
+        from .models import RequestProfile
+        from .profiling import prune_profiles
+
+        path = profiler.save(settings.PROFILE_DIR, request.request_id)
+        RequestProfile.objects.create(
+            request_id=request.request_id,
+            method=request.method,
+            path=request.get_full_path()[:500],
+            status_code=response.status_code,
+            user_id=user.pk,
+            mode=profiler.mode,
+            duration_ms=profiler.duration_ms,
+            cpu_ms=profiler.cpu_ms,
+            sql_count=len(profiler.sql.queries),
+            sql_ms=profiler.sql.total_ms,
+            samples=profiler.samples,
+            top_frames=profiler.top_frames(),
+            slowest_queries=profiler.sql.slowest(),
+            profile_path=path,
+        )
+        prune_profiles(settings.PROFILE_KEEP)
+
+
+def add_server_timing(response, name, duration_ms, description=None):
+    """Append a metric to the response's Server-Timing header (without a duration if it's None)"""
+    entry = name if duration_ms is None else f'{name};dur={duration_ms:.1f}'
+    if description:
+        entry += f';desc="{description}"'
+    existing = response.get('Server-Timing')
+    response['Server-Timing'] = f'{existing}, {entry}' if existing else entry
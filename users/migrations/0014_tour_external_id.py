@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-19 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_savedtour'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Agency-supplied identifier used to update the tour on re-import', max_length=100, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='tour',
+            constraint=models.UniqueConstraint(fields=('agent', 'external_id'), name='users_tour_agent_external_id_unique'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-19 05:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_requestprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TourEmbedding',
+            fields=[
+                ('tour', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='embedding', serialize=False, to='users.tour')),
+                ('model', models.CharField(help_text='Vectorizer that produced the vector', max_length=50)),
+                ('vector', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
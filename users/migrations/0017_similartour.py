@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-19 05:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_tourembedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarTour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(help_text='0 is the closest match')),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.tour')),
+                ('tour', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='similar_tours', to='users.tour')),
+            ],
+            options={
+                'ordering': ['tour', 'rank'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='similartour',
+            index=models.Index(fields=['tour', 'rank'], name='similartour_tour_rank_idx'),
+        ),
+    ]
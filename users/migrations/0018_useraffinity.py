@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-19 05:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_similartour'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAffinity',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='affinity', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('features', models.JSONField(default=dict)),
+                ('weight', models.FloatField(default=0, help_text='Total decayed weight of the interactions')),
+                ('price_log_sum', models.FloatField(default=0)),
+                ('price_log_sq_sum', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(help_text='Time the weights are decayed to')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tour',
+            index=models.Index(fields=['-created_at'], name='tour_created_idx'),
+        ),
+    ]
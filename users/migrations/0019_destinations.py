@@ -0,0 +1,69 @@
+# Generated by Django 4.2 on 2026-10-19 06:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from users.geography import canonical_destination, continent_of, region_of
+
+
+def link_tours(apps, schema_editor):
+    """Create countries and destinations from the existing destination texts and point tours at them"""
+    Tour = apps.get_model('users', 'Tour')
+    Country = apps.get_model('users', 'Country')
+    Destination = apps.get_model('users', 'Destination')
+
+    countries = {}
+    destinations = {}
+    for text in Tour.objects.order_by().values_list('destination', flat=True).distinct():
+        if not text or not text.strip():
+            continue
+        name, city, country = canonical_destination(text)
+        if country.lower() not in countries:
+            region = region_of(country)
+            countries[country.lower()] = Country.objects.create(name=country, region=region, continent=continent_of(region))
+        key = name.lower()
+        if key not in destinations:
+            destinations[key] = Destination.objects.create(key=key, name=name, city=city, country=countries[country.lower()])
+        Tour.objects.filter(destination=text).update(place=destinations[key])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0018_useraffinity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Country',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('region', models.CharField(blank=True, db_index=True, max_length=50)),
+                ('continent', models.CharField(blank=True, db_index=True, max_length=30)),
+            ],
+            options={
+                'verbose_name_plural': 'countries',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Destination',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Lowercased canonical name', max_length=100, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('city', models.CharField(blank=True, max_length=100)),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='destinations', to='users.country')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='place',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Normalized destination, set from the destination text on save', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='tours', to='users.destination'),
+        ),
+        migrations.RunPython(link_tours, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-19 06:31
+
+from django.db import migrations, models
+
+
+def set_duration_nights(apps, schema_editor):
+    Tour = apps.get_model('users', 'Tour')
+    batch = []
+    for tour in Tour.objects.only('id', 'start_date', 'end_date').iterator(chunk_size=2000):
+        tour.duration_nights = max((tour.end_date - tour.start_date).days, 0)
+        batch.append(tour)
+        if len(batch) == 2000:
+            Tour.objects.bulk_update(batch, ['duration_nights'])
+            batch = []
+    Tour.objects.bulk_update(batch, ['duration_nights'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_destinations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='duration_nights',
+            field=models.PositiveSmallIntegerField(db_index=True, default=7, editable=False, help_text='Nights from start to end date, set on save'),
+        ),
+        migrations.AddIndex(
+            model_name='tour',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['start_date', 'end_date', 'duration_nights'], name='tour_active_dates_idx'),
+        ),
+        migrations.RunPython(set_duration_nights, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-19 06:38
+
+from decimal import Decimal
+from django.db import migrations, models
+import users.currency
+
+
+def set_price_usd(apps, schema_editor):
+    # Every existing tour is priced in dollars
+    Tour = apps.get_model('users', 'Tour')
+    Tour.objects.update(price_usd=models.F('price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_tour_duration_nights'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='currency',
+            field=models.CharField(default='USD', help_text='ISO 4217 code of the price', max_length=3, validators=[users.currency.validate_currency]),
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='price_usd',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=Decimal('0.00'), editable=False, help_text='Price in US dollars at the current exchange rate, set on save (see users.currency)', max_digits=12),
+        ),
+        migrations.RunPython(set_price_usd, migrations.RunPython.noop),
+    ]
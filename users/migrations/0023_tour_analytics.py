@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-19 06:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0022_tour_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TourEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('view', 'View'), ('save', 'Save'), ('recommendation', 'Recommendation')], max_length=16)),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tour', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.tour')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TourDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('saves', models.PositiveIntegerField(default=0)),
+                ('recommendations', models.PositiveIntegerField(default=0)),
+                ('agent', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('tour', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='users.tour')),
+            ],
+            options={
+                'verbose_name_plural': 'tour daily stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tourdailystats',
+            index=models.Index(fields=['agent', 'day'], name='tourdailystats_agent_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tourdailystats',
+            constraint=models.UniqueConstraint(fields=('tour', 'day'), name='tourdailystats_tour_day_unique'),
+        ),
+    ]
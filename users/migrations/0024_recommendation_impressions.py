@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-19 06:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0023_tour_analytics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationImpression',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tour_id', models.BigIntegerField()),
+                ('conversation_id', models.BigIntegerField(blank=True, null=True)),
+                ('rank', models.PositiveSmallIntegerField(help_text='0 is the first tour shown')),
+                ('tool', models.CharField(max_length=64)),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
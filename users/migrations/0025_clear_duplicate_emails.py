@@ -0,0 +1,42 @@
+import logging
+
+from django.db import migrations
+from django.db.models import Count, F
+
+logger = logging.getLogger(__name__)
+
+
+def clear_duplicate_emails(apps, schema_editor):
+    """
+    Make User.email unique ahead of the constraint in 0026: of the accounts sharing an email, the
+    one signed in most recently (else the oldest) keeps it and the others get a blank email, which
+    the partial constraint allows. Those can't sign in to the API (by email) until they are given
+    an address again, so the affected IDs are logged (and
+    returned) to follow up.
+    """
+    User = apps.get_model('users', 'User')
+    duplicates = (
+        User.objects.exclude(email='').values('email').annotate(accounts=Count('id')).filter(accounts__gt=1)
+    )
+    cleared = []
+    for row in duplicates.iterator():
+        users = User.objects.filter(email=row['email']).order_by(F('last_login').desc(nulls_last=True), 'id')
+        keep, *others = users.values_list('id', flat=True)
+        User.objects.filter(id__in=others).update(email='')
+        cleared.append((row['email'], keep, others))
+    for email, keep, others in cleared:
+        logger.warning(
+            'Cleared the email %s of users %s; kept by user %s', email, ', '.join(map(str, others)), keep,
+        )
+    return cleared
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0024_recommendation_impressions'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicate_emails, migrations.RunPython.noop),
+    ]
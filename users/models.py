@@ -1,10 +1,14 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, connections, router, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from decimal import Decimal
 import datetime
 
+from .currency import format_price, to_base, validate_currency
+from .geography import canonical_destination, continent_of, region_of
+
 
 def default_start_date():
     return timezone.now().date()
@@ -72,12 +76,88 @@ class User(AbstractUser):
     # Timestamps
     profile_updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Unique index backing sign-in by email; blank emails (e.g. admin-created users) are exempt
+            models.UniqueConstraint(
+                fields=['email'],
+                condition=~models.Q(email=''),
+                name='users_user_email_unique',
+            ),
+        ]
+    
     def __str__(self):
         if self.user_type == 'agent' and self.tour_company:
             return f"{self.username} ({self.tour_company.name})"
         return f"{self.username} ({self.get_user_type_display()})"
 
 
+class Country(models.Model):
+    """A country tours go to, with the region and continent it rolls up to (see users.geography)"""
+    name = models.CharField(max_length=100, unique=True)
+    region = models.CharField(max_length=50, blank=True, db_index=True)
+    continent = models.CharField(max_length=30, blank=True, db_index=True)
+    
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = 'countries'
+    
+    def __str__(self):
+        return self.name
+
+
+class DestinationManager(models.Manager):
+    def resolve(self, names):
+        """
+        ``{name: destination ID}`` for free-text destinations, creating the missing countries and
+        destinations. One query when they all exist already, four when some don't.
+        """
+        canonical = {name: canonical_destination(name) for name in set(names) if name and name.strip()}
+        if not canonical:
+            return {}
+        keys = {name: entry[0].lower() for name, entry in canonical.items()}
+        ids = dict(self.filter(key__in=set(keys.values())).values_list('key', 'id'))
+        missing = {keys[name]: canonical[name] for name in canonical if keys[name] not in ids}
+        if missing:
+            # Few enough countries to match case-insensitively in Python
+            countries = {name.lower(): country_id for name, country_id in Country.objects.values_list('name', 'id')}
+            new_countries = {country.lower(): country for _, _, country in missing.values() if country.lower() not in countries}
+            if new_countries:
+                Country.objects.bulk_create([
+                    Country(name=country, region=region_of(country), continent=continent_of(region_of(country)))
+                    for country in new_countries.values()
+                ], ignore_conflicts=True)
+                countries.update(
+                    (name.lower(), country_id)
+                    for name, country_id in Country.objects.filter(name__in=new_countries.values()).values_list('name', 'id')
+                )
+            self.bulk_create([
+                Destination(key=key, name=name, city=city, country_id=countries[country.lower()])
+                for key, (name, city, country) in missing.items()
+            ], ignore_conflicts=True)
+            ids.update(self.filter(key__in=list(missing)).values_list('key', 'id'))
+        return {name: ids[key] for name, key in keys.items()}
+
+
+class Destination(models.Model):
+    """
+    A normalized tour destination ("City, Country", or just a country). ``Tour.destination`` keeps
+    the text as entered; ``Tour.place`` points here (see users.destinations for the lookups).
+    """
+    key = models.CharField(max_length=100, unique=True, help_text="Lowercased canonical name")
+    name = models.CharField(max_length=100)
+    city = models.CharField(max_length=100, blank=True)
+    country = models.ForeignKey(Country, on_delete=models.PROTECT, related_name='destinations')
+    
+    objects = DestinationManager()
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+
+
 class Tour(models.Model):
     
     MEAL_PLAN_CHOICES = [
@@ -97,10 +177,36 @@ class Tour(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
     destination = models.CharField(max_length=100)
+    place = models.ForeignKey(
+        Destination,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='tours',
+        help_text="Normalized destination, set from the destination text on save"
+    )
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.00'))])
+    currency = models.CharField(
+        max_length=3, default='USD', validators=[validate_currency], help_text="ISO 4217 code of the price"
+    )
+    price_usd = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        db_index=True,
+        help_text="Price in US dollars at the current exchange rate, set on save (see users.currency)"
+    )
     hotel_name = models.CharField(max_length=200, blank=True, help_text="Name of the hotel included in the tour")
     start_date = models.DateField(default=default_start_date)
     end_date = models.DateField(default=default_end_date)
+    duration_nights = models.PositiveSmallIntegerField(
+        default=7,
+        editable=False,
+        db_index=True,
+        help_text="Nights from start to end date, set on save"
+    )
     visa_required = models.BooleanField(default=False, help_text="Check if visa is required for this destination")
     meal_plan = models.CharField(
         max_length=20, 
@@ -114,19 +220,167 @@ class Tour(models.Model):
         default='direct',
         help_text="Type of flight included in the tour"
     )
+    external_id = models.CharField(
+        max_length=100,
+        null=True,
+        blank=True,
+        help_text="Agency-supplied identifier used to update the tour on re-import"
+    )
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            # Upsert key for bulk imports; tours without an external_id are unaffected (NULLs are distinct)
+            models.UniqueConstraint(fields=['agent', 'external_id'], name='users_tour_agent_external_id_unique'),
+        ]
+        indexes = [
+            # The Discover feed (and the window ordering=personalized re-ranks): newest tours first
+            models.Index(fields=['-created_at'], name='tour_created_idx'),
+            # Travel-period queries (see users.availability); only active tours are searched
+            models.Index(
+                fields=['start_date', 'end_date', 'duration_nights'], condition=models.Q(is_active=True), name='tour_active_dates_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.title} by {self.agent.get_full_name() or self.agent.username}"
     
+    def save(self, *args, **kwargs):
+        # Bulk writers (import, synthetic data) set place_id from Destination.objects.resolve() per batch,
+        # duration_nights and price_usd themselves, and QuerySet.update() of destination, dates or price
+        # must set them too
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'destination' in update_fields:
+            self.place_id = Destination.objects.resolve([self.destination]).get(self.destination)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'place'}
+        if update_fields is None or {'start_date', 'end_date'} & set(update_fields):
+            self.duration_nights = self.nights_between(self.start_date, self.end_date)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'duration_nights'}
+        if update_fields is None or {'price', 'currency'} & set(update_fields):
+            self.price_usd = to_base(self.price, self.currency)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'price_usd'}
+        # The change log entry is written in the same transaction as the change (users.changes)
+        using = kwargs.get('using') or router.db_for_write(Tour, instance=self)
+        previous = getattr(self, '_loaded', None)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            change = TourChange.objects.entry(self, previous, kwargs.get('update_fields'))
+            if change:
+                change.save(using=using)
+        self._loaded = {**(previous or {}), **TourChange.objects.state(self, kwargs.get('update_fields'))}
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        tour = super().from_db(db, field_names, values)
+        # The loaded values, so a save logs only what it changed
+        tour._loaded = dict(zip(field_names, values))
+        return tour
+    
+    @staticmethod
+    def nights_between(start_date, end_date):
+        return max((end_date - start_date).days, 0)
+    
     @property
     def formatted_price(self):
-        return f"${self.price:,.2f}"
+        return format_price(self.price, self.currency)
+
+
+class TourChangeManager(models.Manager):
+    def state(self, tour, update_fields=None):
+        """``tour``'s logged field values, only the ones in ``update_fields`` if given"""
+        names = ('is_active', *TourChange.TRACKED_FIELDS)
+        if update_fields is not None:
+            names = [name for name in names if name in update_fields or name.removesuffix('_id') in update_fields]
+        return {name: getattr(tour, name) for name in names}
+
+    def entry(self, tour, previous=None, update_fields=None):
+        """
+        The (unsaved) log entry for writing ``tour`` (its ``update_fields``) over ``previous``, the
+        field values before the write (``None`` for a new tour); ``None`` if clients see no change.
+        Inactive tours aren't listed, so their edits aren't logged, and reactivating one logs it as
+        created.
+        """
+        current = self.state(tour, update_fields)
+        was_active = previous is not None and previous.get('is_active', True)
+        if not current.get('is_active', was_active):
+            return TourChange(tour_id=tour.pk, kind='deactivated') if was_active else None
+        if not was_active:
+            fields = self.state(tour)
+            del fields['is_active']
+            return TourChange(tour_id=tour.pk, kind='created', fields=fields)
+        # Deferred fields weren't loaded: log them as changed
+        fields = {
+            name: value for name, value in current.items()
+            if name != 'is_active' and (name not in previous or previous[name] != value)
+        }
+        return TourChange(tour_id=tour.pk, kind='updated', fields=fields) if fields else None
+
+
+class TourChange(models.Model):
+    """
+    Append-only log of what clients see change in the catalog (see users.changes): tours created
+    (or reactivated) with all their fields, updated with the changed ones, deactivated or deleted.
+    """
+    KIND_CHOICES = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('deactivated', 'Deactivated'),
+        ('deleted', 'Deleted'),
+    ]
+    TRACKED_FIELDS = (
+        'agent_id', 'title', 'description', 'destination', 'hotel_name', 'price', 'currency', 'price_usd',
+        'start_date', 'end_date', 'visa_required', 'meal_plan', 'flight_type',
+    )
+    
+    seq = models.BigAutoField(primary_key=True)
+    # Not a foreign key: entries outlive deleted tours
+    tour_id = models.BigIntegerField(db_index=True)
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    fields = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    recorded_at = models.DateTimeField(default=timezone.now)
+    
+    objects = TourChangeManager()
+    
+    class Meta:
+        ordering = ['seq']
+    
+    def __str__(self):
+        return f"#{self.seq} tour {self.tour_id} {self.kind}"
+
+
+class TourEmbedding(models.Model):
+    """Float32 text embedding of a tour for semantic search (see users.embeddings)"""
+    tour = models.OneToOneField(Tour, on_delete=models.CASCADE, primary_key=True, related_name='embedding')
+    model = models.CharField(max_length=50, help_text="Vectorizer that produced the vector")
+    vector = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    def __str__(self):
+        return f"Embedding of tour {self.tour_id} ({self.model})"
+
+
+class SimilarTour(models.Model):
+    """One entry of a tour's precomputed neighbour list (see users.similarity)"""
+    tour = models.ForeignKey(Tour, on_delete=models.CASCADE, related_name='similar_tours', db_index=False)
+    similar = models.ForeignKey(Tour, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField(help_text="0 is the closest match")
+    score = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['tour', 'rank']
+        indexes = [
+            models.Index(fields=['tour', 'rank'], name='similartour_tour_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Tour {self.tour_id} ~ {self.similar_id} (#{self.rank})"
 
 
 class Conversation(models.Model):
@@ -176,14 +430,171 @@ class ChatMessage(models.Model):
         return f"{self.sender}: {self.content[:100]}{'...' if len(self.content) > 100 else ''}"
 
 
+class SavedTourManager(models.Manager):
+    def save_tours(self, user_id, tour_ids):
+        """
+        Save several tours for a user in a single statement.
+
+        Uses INSERT ... ON CONFLICT DO NOTHING, so tours that are already saved (or that
+        don't exist / aren't active) are skipped without a failed insert and rollback.
+        Returns a list of ``(saved_tour_id, tour_id)`` pairs for the newly saved tours.
+        """
+        tour_ids = list(dict.fromkeys(int(tour_id) for tour_id in tour_ids))
+        if not tour_ids:
+            return []
+
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        tour_table = quote(Tour._meta.db_table)
+        placeholders = ', '.join(['%s'] * len(tour_ids))
+        saved_at = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        sql = (
+            f"INSERT INTO {table} (user_id, tour_id, saved_at) "
+            f"SELECT %s, id, %s FROM {tour_table} WHERE id IN ({placeholders}) AND is_active = %s "
+            f"ON CONFLICT (user_id, tour_id) DO NOTHING "
+            f"RETURNING id, tour_id"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user_id, saved_at, *tour_ids, True])
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def unsave_tours(self, user_id, tour_ids):
+        """
+        Remove several saved tours in one DELETE. Returns ``(tour_id, saved_at)`` pairs of the rows
+        this call removed: the rows are locked first, so a concurrent unsave of the same tour waits
+        and then finds nothing to remove.
+        """
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            rows = list(
+                self.select_for_update().filter(user_id=user_id, tour_id__in=list(tour_ids))
+                .values_list('id', 'tour_id', 'saved_at')
+            )
+            if rows:
+                self.filter(id__in=[saved_id for saved_id, _, _ in rows]).delete()
+        return [(tour_id, saved_at) for _, tour_id, saved_at in rows]
+
+
 class SavedTour(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_tours')
     tour = models.ForeignKey(Tour, on_delete=models.CASCADE, related_name='saved_by_users')
     saved_at = models.DateTimeField(auto_now_add=True)
     
+    objects = SavedTourManager()
+    
     class Meta:
         unique_together = ('user', 'tour')
         ordering = ['-saved_at']
     
     def __str__(self):
         return f"{self.user.username} saved {self.tour.title}"
+
+
+class TourEvent(models.Model):
+    """
+    A view, save or chat recommendation of a tour, waiting to be counted into ``TourDailyStats``
+    (see users.analytics); the rollup deletes the events it has counted.
+    """
+    KIND_CHOICES = [
+        ('view', 'View'),
+        ('save', 'Save'),
+        ('recommendation', 'Recommendation'),
+    ]
+    
+    # The queue is drained continuously: no index beyond the primary key it is read in
+    tour = models.ForeignKey(Tour, on_delete=models.CASCADE, related_name='+', db_index=False)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    occurred_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.kind} of tour {self.tour_id} at {self.occurred_at}"
+
+
+class TourDailyStats(models.Model):
+    """Per-tour, per-day event counts behind the agent analytics (see users.analytics)"""
+    tour = models.ForeignKey(Tour, on_delete=models.CASCADE, related_name='daily_stats', db_index=False)
+    # The tour's agent, copied so a dashboard is one range of the (agent, day) index
+    agent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    saves = models.PositiveIntegerField(default=0)
+    recommendations = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = 'tour daily stats'
+        constraints = [
+            # The rollup's upsert key, and a tour's own series
+            models.UniqueConstraint(fields=['tour', 'day'], name='tourdailystats_tour_day_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['agent', 'day'], name='tourdailystats_agent_day_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Tour {self.tour_id} on {self.day}: {self.views} views, {self.saves} saves"
+
+
+class RecommendationImpression(models.Model):
+    """
+    One tour shown in a chat answer: its position, the conversation (``None`` for anonymous
+    chats) and the agent tool that found it. Written in batches (see users.impressions) and
+    append-only, so consumers read it in ``id`` ranges.
+    """
+    # Not foreign keys: the log outlives deleted tours and conversations, and inserts skip the checks
+    tour_id = models.BigIntegerField()
+    conversation_id = models.BigIntegerField(null=True, blank=True)
+    rank = models.PositiveSmallIntegerField(help_text="0 is the first tour shown")
+    tool = models.CharField(max_length=64)
+    recorded_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Tour {self.tour_id} #{self.rank} via {self.tool}"
+
+
+class UserAffinity(models.Model):
+    """
+    A user's preferences learned from saved tours and chat recommendations (see users.personalization).
+    ``features`` is a sparse vector of decayed weights keyed "destination:<name>", "country:<name>",
+    "meal_plan:<code>" and "flight_type:<code>"; the price band is kept as weighted log-price sums.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='affinity')
+    features = models.JSONField(default=dict)
+    weight = models.FloatField(default=0, help_text="Total decayed weight of the interactions")
+    price_log_sum = models.FloatField(default=0)
+    price_log_sq_sum = models.FloatField(default=0)
+    updated_at = models.DateTimeField(help_text="Time the weights are decayed to")
+    
+    def __str__(self):
+        return f"Affinity of user {self.user_id} ({self.weight:.1f})"
+
+
+class RequestProfile(models.Model):
+    """A profiled request; the stack profile itself is stored on disk (see users.profiling)"""
+    MODE_CHOICES = [
+        ('sampler', 'Stack sampler'),
+        ('cprofile', 'cProfile'),
+    ]
+    
+    request_id = models.CharField(max_length=64, unique=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='request_profiles')
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default='sampler')
+    duration_ms = models.FloatField()
+    cpu_ms = models.FloatField()
+    sql_count = models.PositiveIntegerField(default=0)
+    sql_ms = models.FloatField(default=0)
+    samples = models.PositiveIntegerField(default=0)
+    top_frames = models.JSONField(default=list, blank=True)
+    slowest_queries = models.JSONField(default=list, blank=True)
+    profile_path = models.CharField(max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
@@ -0,0 +1,240 @@
+"""
+Personalized ordering of the Discover feed.
+
+Each user has a ``UserAffinity``: a sparse vector of the destinations, countries, meal plans
+and flight types of the tours they saved (weight ``SAVED_WEIGHT``) or were recommended in
+chat (``RECOMMENDED_WEIGHT``), plus the weighted mean and spread of their log dollar prices. Weights
+halve every ``AFFINITY_HALF_LIFE_DAYS``, so recent interest counts most.
+
+The vector is maintained incrementally: ``record_interactions`` decays the stored weights to
+now and adds the new tours (a handful of queries, done when tours are saved and when chat
+recommends them), and ``forget_saved_tours`` subtracts the tours an unsave removed the same way.
+``manage.py compute_affinities`` rebuilds everyone's from scratch, e.g. after loading data.
+
+``ordering=personalized`` on the tour list re-ranks only a window of the newest
+``PERSONALIZED_WINDOW`` matching tours by affinity score: one query for the affinity, one
+for the window's attributes and a scoring pass over at most that many rows, whatever the
+catalog size. A page inside the window is then fetched by ID; tours past the window keep
+the default newest-first order.
+"""
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .geography import split_destination
+from .models import ChatMessage, SavedTour, Tour, UserAffinity
+
+SAVED_WEIGHT = 3.0
+RECOMMENDED_WEIGHT = 1.0
+# Features kept per user (the strongest ones); bounds the row size and the scoring work
+MAX_FEATURES = 100
+# Share of the score each attribute contributes
+SCORE_WEIGHTS = {
+    'destination': 0.35,
+    'country': 0.2,
+    'price': 0.2,
+    'meal_plan': 0.15,
+    'flight_type': 0.1,
+}
+# Narrowest price band: a user with a single saved tour still matches tours of similar price
+MIN_PRICE_SPREAD = 0.25
+
+TOUR_FIELDS = ('destination', 'price_usd', 'meal_plan', 'flight_type')
+
+
+def tour_features(destination, meal_plan, flight_type):
+    _, country = split_destination(destination)
+    features = [f'destination:{destination}', f'meal_plan:{meal_plan}', f'flight_type:{flight_type}']
+    if country:
+        features.append(f'country:{country}')
+    return features
+
+
+def _decay(days):
+    return 0.5 ** (max(days, 0.0) / settings.AFFINITY_HALF_LIFE_DAYS)
+
+
+def _add(affinity, tours, weight):
+    """Add ``(destination, price, meal_plan, flight_type)`` tuples with ``weight`` each"""
+    features = affinity.features
+    for destination, price, meal_plan, flight_type in tours:
+        for feature in tour_features(destination, meal_plan, flight_type):
+            features[feature] = features.get(feature, 0.0) + weight
+        log_price = math.log(max(float(price), 1.0))
+        affinity.weight += weight
+        affinity.price_log_sum += weight * log_price
+        affinity.price_log_sq_sum += weight * log_price * log_price
+
+
+def _prune(affinity):
+    if len(affinity.features) > MAX_FEATURES:
+        strongest = sorted(affinity.features.items(), key=lambda item: item[1], reverse=True)[:MAX_FEATURES]
+        affinity.features = dict(strongest)
+    affinity.features = {feature: round(value, 6) for feature, value in affinity.features.items()}
+
+
+def _apply(user_id, weighted_tours):
+    """Decay the user's affinity to now and add ``(weight, tour)`` pairs (negative weights remove)"""
+    now = timezone.now()
+    with transaction.atomic(savepoint=False):
+        affinity = UserAffinity.objects.select_for_update().filter(user_id=user_id).first()
+        if affinity is None:
+            # A missing row can't be locked, so concurrent first interactions would both insert it.
+            # Insert with ON CONFLICT DO NOTHING instead: the loser waits for the winner's row and locks it.
+            UserAffinity.objects.bulk_create([UserAffinity(user_id=user_id, updated_at=now)], ignore_conflicts=True)
+            affinity = UserAffinity.objects.select_for_update().get(user_id=user_id)
+        factor = _decay((now - affinity.updated_at).total_seconds() / 86400)
+        affinity.features = {feature: value * factor for feature, value in affinity.features.items()}
+        affinity.weight *= factor
+        affinity.price_log_sum *= factor
+        affinity.price_log_sq_sum *= factor
+        affinity.updated_at = now
+        for weight, tour in weighted_tours:
+            _add(affinity, [tour], weight)
+        # Removals can leave rounding residue behind
+        affinity.features = {feature: value for feature, value in affinity.features.items() if value > 1e-6}
+        if affinity.weight <= 1e-6:
+            affinity.weight = affinity.price_log_sum = affinity.price_log_sq_sum = 0.0
+        _prune(affinity)
+        affinity.save()
+    return affinity
+
+
+def record_interactions(user_id, tour_ids, weight=SAVED_WEIGHT):
+    """Fold newly saved or recommended tours into the user's affinity"""
+    tours = list(Tour.objects.filter(id__in=list(tour_ids)).values_list(*TOUR_FIELDS))
+    if not tours:
+        return None
+    return _apply(user_id, [(weight, tour) for tour in tours])
+
+
+def forget_saved_tours(user_id, removed):
+    """
+    Take unsaved tours back out of the user's affinity. ``removed`` is the ``(tour_id, saved_at)``
+    pairs returned by ``SavedTour.objects.unsave_tours``, so each removal is subtracted once
+    however many requests raced to unsave it; the weight subtracted is the saved weight decayed
+    since ``saved_at``.
+    """
+    now = timezone.now()
+    saved_at = dict(removed)
+    if not saved_at:
+        return None
+    tours = Tour.objects.filter(id__in=list(saved_at)).values_list('id', *TOUR_FIELDS)
+    removed = [
+        (-SAVED_WEIGHT * _decay((now - saved_at[tour_id]).total_seconds() / 86400), tour) for tour_id, *tour in tours
+    ]
+    if not removed:
+        return None
+    return _apply(user_id, removed)
+
+
+def rebuild_affinities(user_ids=None, batch_size=2000):
+    """Recompute affinities from all saved tours and chat recommendations; returns how many were written"""
+    now = timezone.now()
+    events = defaultdict(list)
+
+    saved = SavedTour.objects.all()
+    recommended = ChatMessage.recommended_tours.through.objects.all()
+    if user_ids is not None:
+        saved = saved.filter(user_id__in=list(user_ids))
+        recommended = recommended.filter(chatmessage__conversation__user_id__in=list(user_ids))
+    rows = saved.values_list('user_id', 'saved_at', *[f'tour__{field}' for field in TOUR_FIELDS])
+    for user_id, at, *tour in rows.iterator(chunk_size=batch_size):
+        events[user_id].append((SAVED_WEIGHT, at, tour))
+    rows = recommended.values_list(
+        'chatmessage__conversation__user_id', 'chatmessage__created_at', *[f'tour__{field}' for field in TOUR_FIELDS]
+    )
+    for user_id, at, *tour in rows.iterator(chunk_size=batch_size):
+        events[user_id].append((RECOMMENDED_WEIGHT, at, tour))
+
+    affinities = []
+    for user_id, user_events in events.items():
+        affinity = UserAffinity(user_id=user_id, updated_at=now)
+        for weight, at, tour in user_events:
+            _add(affinity, [tour], weight * _decay((now - at).total_seconds() / 86400))
+        _prune(affinity)
+        affinities.append(affinity)
+
+    with transaction.atomic():
+        if user_ids is not None:
+            # Users whose last saved tour or recommendation is gone start from scratch
+            UserAffinity.objects.filter(user_id__in=list(user_ids)).exclude(user_id__in=list(events)).delete()
+        UserAffinity.objects.bulk_create(
+            affinities,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['features', 'weight', 'price_log_sum', 'price_log_sq_sum', 'updated_at'],
+        )
+    return len(affinities)
+
+
+class AffinityScorer:
+    """Scores tours against one user's affinity"""
+
+    def __init__(self, affinity):
+        weight = affinity.weight or 1.0
+        self.shares = {feature: value / weight for feature, value in affinity.features.items()}
+        self.price_mean = affinity.price_log_sum / weight
+        variance = affinity.price_log_sq_sum / weight - self.price_mean ** 2
+        self.price_spread = max(math.sqrt(max(variance, 0.0)), MIN_PRICE_SPREAD)
+
+    def score(self, destination, price, meal_plan, flight_type):
+        shares = self.shares
+        _, country = split_destination(destination)
+        distance = (math.log(max(float(price), 1.0)) - self.price_mean) / self.price_spread
+        return (
+            SCORE_WEIGHTS['destination'] * shares.get(f'destination:{destination}', 0.0)
+            + SCORE_WEIGHTS['country'] * shares.get(f'country:{country}', 0.0)
+            + SCORE_WEIGHTS['price'] * math.exp(-0.5 * distance * distance)
+            + SCORE_WEIGHTS['meal_plan'] * shares.get(f'meal_plan:{meal_plan}', 0.0)
+            + SCORE_WEIGHTS['flight_type'] * shares.get(f'flight_type:{flight_type}', 0.0)
+        )
+
+
+class PersonalizedFeed:
+    """
+    The filtered tours with the first ``len(ranked_ids)`` (the window) in affinity order and the rest in
+    the queryset's own order. Sliceable and countable, so the paginator treats it like the queryset.
+    """
+
+    def __init__(self, queryset, ranked_ids):
+        self.queryset = queryset
+        self.ranked_ids = ranked_ids
+
+    def count(self):
+        return self.queryset.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop
+        window = len(self.ranked_ids)
+        page_ids = self.ranked_ids[start:stop if stop is not None else window]
+        tours = self.queryset.filter(pk__in=page_ids).in_bulk() if page_ids else {}
+        result = [tours[tour_id] for tour_id in page_ids if tour_id in tours]
+        # Past the window both orders agree, so the rest is a plain slice of the queryset
+        if stop is None or stop > window:
+            result.extend(self.queryset[max(start, window):stop])
+        return result
+
+
+def personalize(queryset, user_id, window=None):
+    """
+    Re-rank the first ``window`` tours of ``queryset`` (already in its default order) for the user.
+    Returns ``queryset`` unchanged when the user has no affinity yet.
+    """
+    affinity = UserAffinity.objects.filter(user_id=user_id).first()
+    if affinity is None or affinity.weight <= 0:
+        return queryset
+    scorer = AffinityScorer(affinity)
+    candidates = list(queryset.values_list('id', *TOUR_FIELDS)[:window or settings.PERSONALIZED_WINDOW])
+    # Stable sort: equally scored tours keep their default (newest first) order
+    ranked = sorted(candidates, key=lambda tour: -scorer.score(*tour[1:]))
+    return PersonalizedFeed(queryset, [tour[0] for tour in ranked])
@@ -0,0 +1,190 @@
+"""
+On-demand request profiling (see ``users.middleware.ProfilingMiddleware``).
+
+Two profilers are available:
+
+* ``sampler`` (default): a background thread samples the request thread's stack every few
+  milliseconds and counts identical stacks. The result is written in the collapsed-stack
+  ("folded") format, one ``frame;frame;frame count`` line per stack, which speedscope
+  (https://www.speedscope.app) and flamegraph.pl open directly.
+* ``cprofile``: deterministic profiling with cProfile, saved as a ``.prof`` file for pstats
+  or snakeviz. Accurate call counts, but much higher overhead.
+
+SQL statements are timed for both with a connection ``execute_wrapper``. Only the newest
+``PROFILE_KEEP`` profiles are kept (``prune_profiles``).
+"""
+import cProfile
+import collections
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+SAMPLER = 'sampler'
+CPROFILE = 'cprofile'
+
+
+def frame_label(code):
+    """``function (path:line)`` with the path shortened to the project or site-packages"""
+    filename = code.co_filename
+    base = str(settings.BASE_DIR) + os.sep
+    if filename.startswith(base):
+        filename = filename[len(base):]
+    elif 'site-packages' + os.sep in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    # ';' separates frames in the collapsed format
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class StackSampler:
+    """Samples one thread's Python stack on an interval and counts collapsed stacks"""
+
+    def __init__(self, thread_id=None, interval_ms=2.0):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval_ms / 1000
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_frames = os.path.abspath(__file__)
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code.co_filename != own_frames:
+                    label = self._labels.get(code)
+                    if label is None:
+                        label = self._labels[code] = frame_label(code)
+                    stack.append(label)
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def top_frames(self, limit=20):
+        """Leaf frames with the most samples (self time), as ``[label, samples]`` pairs"""
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return [[label, count] for label, count in leaves.most_common(limit)]
+
+
+class SQLRecorder:
+    """``execute_wrapper`` that times every statement run on a connection"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - start) * 1000))
+
+    @property
+    def total_ms(self):
+        return sum(duration for _, duration in self.queries)
+
+    def slowest(self, limit=10):
+        return [
+            {'sql': sql[:2000], 'ms': round(duration, 3)}
+            for sql, duration in sorted(self.queries, key=lambda query: -query[1])[:limit]
+        ]
+
+
+class RequestProfiler:
+    """Profiles the current thread between ``start()`` and ``stop()``"""
+
+    def __init__(self, mode=SAMPLER, interval_ms=2.0):
+        self.mode = mode
+        self.interval_ms = interval_ms
+        self.sql = SQLRecorder()
+        self.sampler = None
+        self.profile = None
+        self.duration_ms = self.cpu_ms = 0.0
+        self._wrappers = []
+
+    def start(self):
+        for connection in connections.all():
+            wrapper = connection.execute_wrapper(self.sql)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+
+        self._wall, self._cpu = time.perf_counter(), time.thread_time()
+        if self.mode == CPROFILE:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler = StackSampler(interval_ms=self.interval_ms).start()
+        return self
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.duration_ms = (time.perf_counter() - self._wall) * 1000
+        self.cpu_ms = (time.thread_time() - self._cpu) * 1000
+        for wrapper in reversed(self._wrappers):
+            wrapper.__exit__(None, None, None)
+        self._wrappers = []
+
+    def top_frames(self, limit=20):
+        if self.sampler is not None:
+            return self.sampler.top_frames(limit)
+        stats = pstats.Stats(self.profile, stream=io.StringIO())
+        by_time = sorted(stats.stats.items(), key=lambda item: -item[1][2])[:limit]
+        return [
+            [f'{func} ({filename}:{line})', round(tottime * 1000, 3)]
+            for (filename, line, func), (_, _, tottime, _, _) in by_time
+        ]
+
+    @property
+    def samples(self):
+        return self.sampler.samples if self.sampler is not None else 0
+
+    def save(self, directory, name):
+        """Write the profile to ``directory`` and return its path"""
+        os.makedirs(directory, exist_ok=True)
+        if self.profile is not None:
+            path = os.path.join(directory, f'{name}.prof')
+            self.profile.dump_stats(path)
+        else:
+            path = os.path.join(directory, f'{name}.folded')
+            with open(path, 'w') as f:
+                f.write(self.sampler.collapsed())
+        return path
+
+
+def prune_profiles(keep):
+    """Delete all but the newest ``keep`` profiles (0 keeps all), their files with them; returns how many"""
+    from .models import RequestProfile
+
+    if not keep:
+        return 0
+    old = list(RequestProfile.objects.order_by('-created_at', '-id').values_list('id', flat=True)[keep:])
+    if old:
+        # Per-row delete signals remove the files (users.signals)
+        RequestProfile.objects.filter(id__in=old).delete()
+    return len(old)
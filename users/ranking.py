@@ -0,0 +1,131 @@
+"""
+Ranking of the tours found by the agent's tool calls in one chat turn.
+
+Each search tool records its filter and an ID-only candidate pool (its first
+``RANKING_CANDIDATE_POOL`` IDs in the tool's own order) with the turn's
+``CandidateCollector``. ``rank_candidates`` then scores the pooled tours by how many of the
+turn's searches they match, with one ID-only query over the pooled IDs, so a tour matching
+the destination, price range and meal plan searches ranks above one matching only the
+destination even when no single tool returned it near the top. Ties are broken by
+reciprocal rank fusion of the positions in the tools' pools, then by ID. Only the final top
+``RANKING_TOP_K`` tours are loaded in full.
+
+Usage::
+
+    with collect_candidates() as candidates:
+        ...  # run the agent; tools call candidate_ids(tool_name, queryset, condition)
+    top_ids = candidates.ranked()[:settings.RANKING_TOP_K]
+"""
+import contextlib
+import contextvars
+import functools
+import operator
+import threading
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+
+# Reciprocal rank fusion constant: position p contributes 1 / (RRF_K + p + 1)
+RRF_K = 60
+
+_collector = contextvars.ContextVar('candidate_collector', default=None)
+
+
+class CandidateCollector:
+    """Candidate pools and filters of one turn; tools may add from several threads"""
+
+    def __init__(self):
+        self.pools = []
+        self.conditions = []
+        self._lock = threading.Lock()
+
+    def add(self, tool, ids, condition=None):
+        with self._lock:
+            self.pools.append((tool, list(ids)))
+            if condition is not None:
+                self.conditions.append((tool, condition))
+
+    def ranked(self):
+        with self._lock:
+            pools, conditions = list(self.pools), list(self.conditions)
+        return rank_candidates(pools, conditions)
+
+    def sources(self):
+        """``{tour ID: the tool whose pool has it highest}``, ties going to the first tool by name"""
+        with self._lock:
+            pools = list(self.pools)
+        best = {}
+        for tool, ids in pools:
+            for position, tour_id in enumerate(ids):
+                if tour_id not in best or (position, tool) < best[tour_id]:
+                    best[tour_id] = (position, tool)
+        return {tour_id: tool for tour_id, (_, tool) in best.items()}
+
+
+@contextlib.contextmanager
+def collect_candidates():
+    """Collect the candidates recorded by tools inside the block"""
+    collector = CandidateCollector()
+    token = _collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _collector.reset(token)
+
+
+def record_candidates(tool, ids, condition=None):
+    """Add ``ids`` (best first) and the filter that found them to the current turn, if collecting"""
+    collector = _collector.get()
+    if collector is not None:
+        collector.add(tool, ids, condition)
+
+
+def candidate_ids(tool, queryset, condition=None):
+    """The first ``RANKING_CANDIDATE_POOL`` IDs of ``queryset``, recorded as ``tool``'s candidates"""
+    # ID as the last sort key so equal sort values (e.g. bulk-created tours) give a stable pool
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    ids = list(queryset.order_by(*ordering, 'id').values_list('id', flat=True)[:settings.RANKING_CANDIDATE_POOL])
+    record_candidates(tool, ids, condition)
+    return ids
+
+
+def matched_counts(conditions, ids):
+    """
+    ``{tour ID: number of tools whose filter it matches}`` for the active tours among ``ids``.
+    Several calls of one tool (e.g. two destinations) count as one alternative criterion.
+    """
+    from .models import Tour
+
+    by_tool = {}
+    for tool, condition in conditions:
+        by_tool[tool] = by_tool[tool] | condition if tool in by_tool else condition
+    if not by_tool or not ids:
+        return {}
+    matched = functools.reduce(operator.add, (
+        Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField())
+        for condition in by_tool.values()
+    ))
+    # Filtered to the candidate IDs before annotating, so the CASEs only run over the pools
+    rows = (
+        Tour.objects.filter(id__in=ids, is_active=True)
+        .annotate(matched=matched)
+        .values_list('id', 'matched')
+    )
+    return dict(rows)
+
+
+def rank_candidates(pools, conditions=()):
+    """Tour IDs of ``[(tool, ids), ...]`` pools ordered by searches matched, then fused rank, then ID"""
+    tools = {}
+    scores = {}
+    for tool, ids in pools:
+        for position, tour_id in enumerate(ids):
+            tools.setdefault(tour_id, set()).add(tool)
+            scores[tour_id] = scores.get(tour_id, 0.0) + 1 / (RRF_K + position + 1)
+
+    matched = matched_counts(conditions, list(tools))
+    for tour_id, found_by in tools.items():
+        # Tours the query did not return (no filters, or since deactivated) count the tools that found them
+        matched.setdefault(tour_id, len(found_by))
+    # Rounded so the order does not depend on the (thread-dependent) order pools were added in
+    return sorted(matched, key=lambda tour_id: (-matched[tour_id], -round(scores.get(tour_id, 0.0), 9), tour_id))
@@ -0,0 +1,183 @@
+"""
+Read-replica routing.
+
+Reads are only sent to a replica inside a ``read_from_replica()`` block, so endpoints opt in
+explicitly (public catalog listings, company listings, chat tool searches, conversation
+history). Everything else, and every write, goes to ``default``.
+
+Read-your-writes: once a request writes to a model, later reads of that model in the same
+request go to the primary. The set of written models is carried to the client's next requests
+in a short-lived cookie by ``ReplicaRoutingMiddleware`` so they also see their own writes
+while the replicas catch up. Routing goes by the queryset's model; ``using_pins`` extends the
+pin to the other models a query reads.
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+_pinned_models = contextvars.ContextVar('pinned_models', default=None)
+_written_models = contextvars.ContextVar('written_models', default=None)
+
+_replica_cycle = None
+_replica_cycle_lock = threading.Lock()
+
+# alias -> (checked_at, lag_seconds or None when the replica is unreachable)
+_lag_cache = {}
+
+
+def get_replica_aliases():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+@contextmanager
+def read_from_replica():
+    """Allow reads in this block to be served by a replica"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads(view_func):
+    """View decorator equivalent of ``read_from_replica()``"""
+    @wraps(view_func)
+    def wrapped(*args, **kwargs):
+        with read_from_replica():
+            return view_func(*args, **kwargs)
+    return wrapped
+
+
+def start_request(pinned_labels=()):
+    """Reset routing state at the start of a request, pinning models the client wrote recently"""
+    _replica_reads.set(False)
+    _pinned_models.set(set(pinned_labels))
+    _written_models.set(set())
+
+
+def written_models():
+    """Labels of the models written during this request"""
+    return set(_written_models.get() or ())
+
+
+def pin_to_primary(model):
+    """Send later reads of ``model`` to the primary for the rest of this request"""
+    written = _written_models.get()
+    if written is None:
+        written = set()
+        _written_models.set(written)
+    written.add(model._meta.label_lower)
+
+
+def is_pinned(model):
+    label = model._meta.label_lower
+    return label in (_pinned_models.get() or ()) or label in (_written_models.get() or ())
+
+
+def using_pins(queryset, *models):
+    """
+    ``queryset`` read from the primary if any of ``models`` is pinned. The router only sees the
+    queryset's own model, so pass the models its subqueries and joins read (e.g. ``SavedTour`` in
+    an ``is_saved`` annotation of tours) for a client to see its own writes there too.
+    """
+    if any(is_pinned(model) for model in models):
+        return queryset.using(DEFAULT_DB_ALIAS)
+    return queryset
+
+
+def replica_lag(alias):
+    """
+    Replication lag of ``alias`` in seconds, or None if it could not be measured.
+
+    Checked at most once per ``REPLICA_LAG_CHECK_INTERVAL`` seconds per process.
+    """
+    interval = getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5)
+    now = time.monotonic()
+    cached = _lag_cache.get(alias)
+    if cached and now - cached[0] < interval:
+        return cached[1]
+
+    lag = None
+    try:
+        connection = connections[alias]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # The last replayed transaction only dates the lag while WAL is still being replayed:
+                # a caught-up replica of an idle primary would otherwise look further behind every second
+                cursor.execute(
+                    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+                    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                )
+                lag = float(cursor.fetchone()[0])
+        else:
+            # Local stand-ins (e.g. SQLite copies) have no replication to lag behind
+            lag = 0.0
+    except Exception as e:
+        logger.warning("Replica %s is unavailable: %s", alias, e)
+
+    _lag_cache[alias] = (now, lag)
+    return lag
+
+
+def _next_replica(aliases):
+    global _replica_cycle
+    with _replica_cycle_lock:
+        if _replica_cycle is None or _replica_cycle[0] != aliases:
+            _replica_cycle = (aliases, itertools.cycle(aliases))
+        return next(_replica_cycle[1])
+
+
+def choose_replica():
+    """Pick a healthy replica round-robin, or None to fall back to the primary"""
+    aliases = tuple(get_replica_aliases())
+    if not aliases:
+        return None
+
+    max_lag = getattr(settings, 'REPLICA_MAX_LAG', 10)
+    for _ in range(len(aliases)):
+        alias = _next_replica(aliases)
+        lag = replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            return alias
+    return None
+
+
+class ReplicaRouter:
+    """Database router sending opted-in reads to replicas and everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if is_pinned(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related lookups stay on the database the instance was loaded from
+            return instance._state.db
+        if not _replica_reads.get():
+            return None
+        # Reads inside a transaction on the primary must see that transaction's writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return choose_replica()
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary(model)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive their schema through replication
+        return db not in get_replica_aliases()
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User, Tour, TourCompany, Conversation, ChatMessage, SavedTour
+from django.db import models
+from .currency import display_currency, display_prices, format_price, round_price, supported
+from .models import User, Tour, TourCompany, Conversation, ChatMessage, SavedTour, default_start_date, default_end_date
 
 
 class TourCompanySerializer(serializers.ModelSerializer):
@@ -30,6 +32,13 @@ class UserSerializer(serializers.ModelSerializer):
         return f"{obj.first_name} {obj.last_name}".strip()
 
 
+class UserTokenSerializer(serializers.ModelSerializer):
+    """Slim user payload returned with auth tokens - no nested company lookup"""
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'email', 'first_name', 'last_name', 'user_type', 'tour_company_id')
+
+
 class SignInSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField(write_only=True)
@@ -39,37 +48,80 @@ class SignInSerializer(serializers.Serializer):
         password = data.get('password')
 
         if email and password:
-            try:
-                user_obj = User.objects.get(email=email)
-                user = authenticate(username=user_obj.username, password=password)
-                
-                if user:
-                    if user.is_active:
-                        data['user'] = user
-                        return data
-                    else:
-                        raise serializers.ValidationError('User account is disabled.')
-                else:
-                    raise serializers.ValidationError('Invalid credentials.')
-            except User.DoesNotExist:
-                raise serializers.ValidationError('Invalid credentials.')
+            # EmailBackend: one indexed lookup, same cost for unknown emails, wrong passwords and disabled accounts
+            user = authenticate(self.context.get('request'), email=email, password=password)
+            if user:
+                data['user'] = user
+                return data
+            raise serializers.ValidationError('Invalid credentials.')
         else:
             raise serializers.ValidationError('Must provide email and password.')
 
 
+def validate_currency_code(value):
+    code = supported(value)
+    if not code:
+        raise serializers.ValidationError(f"Unsupported currency: {value}.")
+    return code
+
+
+class TourListSerializer(serializers.ListSerializer):
+    """Converts the prices of a whole page to the display currency at once"""
+
+    def to_representation(self, data):
+        tours = list(data.all() if isinstance(data, models.Manager) else data)
+        if tours:
+            currency = display_currency(self.context.get('request'))
+            for tour, price in zip(tours, display_prices(tours, currency)):
+                tour.display_price = price
+        return super().to_representation(tours)
+
+
 class TourSerializer(serializers.ModelSerializer):
     agent = UserSerializer(read_only=True)
     formatted_price = serializers.ReadOnlyField()
+    # Declared so the code is upper-cased before it is checked (the model validator wants it exact)
+    currency = serializers.CharField(max_length=3, required=False)
+    display_price = serializers.SerializerMethodField()
+    display_currency = serializers.SerializerMethodField()
+    formatted_display_price = serializers.SerializerMethodField()
+    is_saved = serializers.SerializerMethodField()
     
     class Meta:
         model = Tour
+        list_serializer_class = TourListSerializer
         fields = [
             'id', 'agent', 'title', 'description', 'destination', 'hotel_name',
-            'price', 'formatted_price', 
+            'price', 'currency', 'formatted_price',
+            'display_price', 'display_currency', 'formatted_display_price',
             'start_date', 'end_date', 'visa_required', 'meal_plan', 'flight_type', 'is_active',
-            'created_at', 'updated_at'
+            'is_saved', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'agent', 'created_at', 'updated_at']
+    
+    def get_is_saved(self, obj):
+        # Only set when the queryset was annotated for the requesting user (see TourListCreateView)
+        return getattr(obj, 'is_saved', None)
+
+    def validate_currency(self, value):
+        return validate_currency_code(value)
+
+    def _display(self, obj):
+        # (currency, amount); set for the whole page by TourListSerializer, converted here for a single tour
+        if getattr(obj, 'display_price', None) is None:
+            obj.display_price = display_prices([obj], display_currency(self.context.get('request')))[0]
+        return obj.display_price
+
+    def get_display_price(self, obj):
+        currency, amount = self._display(obj)
+        return round_price(amount, currency)
+
+    def get_display_currency(self, obj):
+        return self._display(obj)[0]
+
+    def get_formatted_display_price(self, obj):
+        currency, amount = self._display(obj)
+        return format_price(amount, currency)
 
     def create(self, validated_data):
         # Set the agent to the current user
@@ -78,19 +130,35 @@ class TourSerializer(serializers.ModelSerializer):
 
 
 class TourCreateSerializer(serializers.ModelSerializer):
+    currency = serializers.CharField(max_length=3, required=False)
+
     class Meta:
         model = Tour
         fields = [
             'title', 'description', 'destination', 'hotel_name', 
-            'price', 'start_date', 'end_date', 'visa_required', 'meal_plan', 'flight_type'
+            'price', 'currency', 'start_date', 'end_date', 'visa_required', 'meal_plan', 'flight_type'
         ]
 
+    def validate_currency(self, value):
+        return validate_currency_code(value)
+
     def validate(self, data):
-        if data['end_date'] <= data['start_date']:
+        # Fall back to the model defaults (or the instance being updated) for omitted dates
+        start_date = data.get('start_date', getattr(self.instance, 'start_date', None) or default_start_date())
+        end_date = data.get('end_date', getattr(self.instance, 'end_date', None) or default_end_date())
+        if end_date <= start_date:
             raise serializers.ValidationError("End date must be after start date.")
         return data
 
 
+class TourImportSerializer(TourCreateSerializer):
+    """Validates one row of a bulk import - the TourCreateSerializer rules plus the upsert key"""
+    external_id = serializers.CharField(max_length=100, required=False, allow_blank=True)
+
+    class Meta(TourCreateSerializer.Meta):
+        fields = TourCreateSerializer.Meta.fields + ['external_id']
+
+
 class ChatMessageSerializer(serializers.ModelSerializer):
     recommended_tours = TourSerializer(many=True, read_only=True)
     
@@ -145,5 +213,16 @@ class SavedTourSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'saved_at']
     
     def create(self, validated_data):
-        validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        validated_data['user_id'] = self.context['request'].user.id
+        return super().create(validated_data)
+
+
+class SavedTourBulkSerializer(serializers.Serializer):
+    # Also the most tours GET saved-tours/ids/ checks at once
+    MAX_TOUR_IDS = 100
+
+    tour_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_TOUR_IDS
+    )
\ No newline at end of file
@@ -0,0 +1,66 @@
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user
+from .catalog import catalog_changed
+from .models import Country, RequestProfile, Tour, TourChange
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, created=False, **kwargs):
+    # Covers deactivation and user type / company changes made through the ORM or admin.
+    # A newly created user has no tokens or cache entries yet.
+    if not created:
+        invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=RequestProfile)
+def delete_profile_file(sender, instance, **kwargs):
+    try:
+        os.remove(instance.profile_path)
+    except OSError:
+        pass
+
+
+@receiver(post_save, sender=Tour)
+def embed_saved_tour(sender, instance, update_fields=None, **kwargs):
+    # Bulk writes skip signals; they call embeddings.embed_stale_tours() instead
+    if update_fields is not None and not {'title', 'destination', 'description'} & set(update_fields):
+        return
+    from .embeddings import embed_tours
+    embed_tours([instance])
+
+
+@receiver(post_delete, sender=Tour)
+def log_deleted_tour(sender, instance, using, **kwargs):
+    # Sent inside the deletion's transaction, for queryset deletes too; saves log themselves (Tour.save)
+    TourChange.objects.using(using).create(tour_id=instance.pk, kind='deleted')
+
+
+@receiver(post_save, sender=Tour)
+@receiver(post_delete, sender=Tour)
+@receiver(post_save, sender=Country)
+def invalidate_catalog_caches(sender, **kwargs):
+    # Country edits (region, continent) touch no tour: other processes see them after the next catalog change
+    catalog_changed()
+
+
+SIMILARITY_FIELDS = {'title', 'destination', 'description', 'price', 'currency', 'meal_plan', 'start_date', 'is_active'}
+
+
+@receiver(post_save, sender=Tour)
+def refresh_similar_lists(sender, instance, update_fields=None, **kwargs):
+    # Registered after embed_saved_tour, so the tour's new embedding is already stored.
+    # Until `manage.py compute_similar_tours` has built the table there is nothing to keep current.
+    if not settings.SIMILAR_TOURS_REFRESH_ON_SAVE:
+        return
+    if update_fields is not None and not SIMILARITY_FIELDS & set(update_fields):
+        return
+    from .similarity import lists_built, schedule_refresh
+    if lists_built():
+        transaction.on_commit(lambda: schedule_refresh([instance.pk]))
@@ -0,0 +1,336 @@
+"""
+Precomputed "similar tours" neighbour lists.
+
+The similarity of two active tours combines their text embeddings (see users.embeddings)
+with attributes: same destination, country or region, price band (distance of log dollar prices),
+meal plan and start date proximity. The score is symmetric. ``compute_similar_tours``
+scores every tour against the whole catalog in vectorized batches and stores the best
+``SIMILAR_TOURS_K`` per tour in ``SimilarTour``, so serving a list is one indexed query.
+
+``refresh_similar_tours`` updates the lists after tours change: the changed tours' own
+lists, the lists that contain them, and the lists of their closest matches (the tours most
+likely to take them in as a new neighbour). Saves schedule it on a background worker with
+``schedule_refresh``, so a write does not wait for the scoring; changes that arrive while a
+refresh runs are merged into the next one. The process keeps its ``Catalog`` between
+refreshes and re-reads only the changed tours (and those the change log shows other
+processes changed), so a refresh costs a few queries plus the scoring of the affected lists.
+Run ``manage.py compute_similar_tours`` periodically to also catch the rare list the
+incremental pass misses.
+"""
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import changes
+from .embeddings import index
+from .geography import region_of, split_destination
+from .models import SimilarTour, Tour, TourChange
+
+CATALOG_FIELDS = ('id', 'destination', 'price_usd', 'meal_plan', 'start_date')
+
+WEIGHTS = {
+    'text': 0.35,
+    'destination': 0.25,
+    'price': 0.15,
+    'meal_plan': 0.10,
+    'dates': 0.15,
+}
+# Destination score: same destination, else same country, else same region
+SAME_COUNTRY = 0.6
+SAME_REGION = 0.3
+# Prices a factor of PRICE_RANGE apart, or start dates DATE_RANGE_DAYS apart, no longer count as similar
+PRICE_RANGE = 3.0
+DATE_RANGE_DAYS = 90
+# Closest matches of a changed tour whose lists are refreshed too
+REVERSE_CANDIDATES = 50
+
+logger = logging.getLogger(__name__)
+
+
+class Catalog:
+    """
+    Attribute arrays of the active tours, aligned by position, and where each tour's embedding
+    sits in the shared ``VectorIndex`` matrix (text scores read it there instead of copying it).
+
+    ``update()`` re-reads only the given tours plus those the change log (users.changes) lists
+    since the catalog last looked, so a refresh costs queries on the changed tours rather than a
+    reload of the whole catalog.
+    """
+
+    def __init__(self):
+        # Equal values get equal codes; empty values get unique negative ones, so they never match
+        self._mappings = {name: {} for name in ('destination', 'country', 'region', 'meal_plan')}
+        self._blank = itertools.count(-1, -1)
+        self.seq = changes.latest()[0]
+        rows = list(Tour.objects.filter(is_active=True).order_by('id').values_list(*CATALOG_FIELDS))
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.positions = {tour_id: i for i, tour_id in enumerate(self.ids.tolist())}
+        self.attributes = self._attributes(rows)
+        self.sync_vectors()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _code(self, name, value):
+        if not value:
+            return next(self._blank)
+        mapping = self._mappings[name]
+        return mapping.setdefault(value, len(mapping))
+
+    def _attributes(self, rows):
+        places = [split_destination(row[1]) for row in rows]
+        return {
+            'destination': np.array([self._code('destination', row[1].strip().lower()) for row in rows], dtype=np.int32),
+            'country': np.array([self._code('country', country) for _, country in places], dtype=np.int32),
+            # A country without a known region is its own region, so each level implies the next
+            'region': np.array([self._code('region', region_of(country) or country) for _, country in places], dtype=np.int32),
+            'log_price': np.log(np.maximum(np.array([float(row[2]) for row in rows], dtype=np.float64), 1.0)).astype(np.float32),
+            'meal_plan': np.array([self._code('meal_plan', row[3]) for row in rows], dtype=np.int32),
+            'start': np.array([row[4].toordinal() for row in rows], dtype=np.int32),
+        }
+
+    def update(self, tour_ids=()):
+        """Re-read ``tour_ids`` and the tours the change log lists since the last look"""
+        tour_ids = set(tour_ids)
+        entries = list(
+            TourChange.objects.filter(seq__gt=self.seq).order_by('seq').values_list('seq', 'tour_id', 'recorded_at')
+        )
+        tour_ids.update(tour_id for _, tour_id, _ in entries)
+        # An unsettled entry may still be joined by an earlier-numbered one: look from before it next time
+        settled = changes.settled_before()
+        for seq, _, recorded_at in entries:
+            if recorded_at >= settled:
+                break
+            self.seq = seq
+        rows = {
+            row[0]: row for row in Tour.objects.filter(id__in=list(tour_ids), is_active=True).values_list(*CATALOG_FIELDS)
+        }
+        present = [tour_id for tour_id in rows if tour_id in self.positions]
+        if present:
+            attributes = self._attributes([rows[tour_id] for tour_id in present])
+            positions = [self.positions[tour_id] for tour_id in present]
+            for name, values in attributes.items():
+                self.attributes[name][positions] = values
+        # Deactivated or deleted tours leave; the arrays are small (no vectors), so this is a cheap copy
+        gone = [self.positions[tour_id] for tour_id in tour_ids if tour_id in self.positions and tour_id not in rows]
+        added = sorted(tour_id for tour_id in rows if tour_id not in self.positions)
+        if gone or added:
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[gone] = False
+            attributes = self._attributes([rows[tour_id] for tour_id in added])
+            self.ids = np.concatenate([self.ids[keep], np.array(added, dtype=np.int64)])
+            for name, values in attributes.items():
+                self.attributes[name] = np.concatenate([self.attributes[name][keep], values])
+            self.positions = {tour_id: i for i, tour_id in enumerate(self.ids.tolist())}
+        self.sync_vectors()
+
+    def sync_vectors(self):
+        """Point the catalog at the index's current matrix; tours without an embedding get none"""
+        vector_positions, self.matrix = index.snapshot()
+        self.vector_rows = np.fromiter(
+            (vector_positions.get(tour_id, -1) for tour_id in self.ids.tolist()), dtype=np.int64, count=len(self.ids)
+        )
+
+    def text_scores(self, rows):
+        """``len(rows) x len(catalog)`` float32 cosine similarities of the embeddings (0 without one)"""
+        scores = np.zeros((len(rows), len(self)), dtype=np.float32)
+        if not len(self.matrix):
+            return scores
+        query_rows, catalog_rows = self.vector_rows[rows], self.vector_rows
+        queries = self.matrix[np.maximum(query_rows, 0)] * (query_rows >= 0)[:, None]
+        embedded = catalog_rows >= 0
+        scores[:, embedded] = (queries @ self.matrix.T)[:, catalog_rows[embedded]]
+        return scores
+
+    def scores(self, rows):
+        """``len(rows) x len(catalog)`` float32 similarities of the tours at positions ``rows``"""
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = self.text_scores(rows)
+        scores *= np.float32(WEIGHTS['text'])
+        attributes = self.attributes
+
+        # Same destination implies same country implies same region, so the levels add up to 1 / 0.6 / 0.3
+        weight = WEIGHTS['destination']
+        for codes, value in (
+            (attributes['region'], weight * SAME_REGION),
+            (attributes['country'], weight * (SAME_COUNTRY - SAME_REGION)),
+            (attributes['destination'], weight * (1 - SAME_COUNTRY)),
+            (attributes['meal_plan'], WEIGHTS['meal_plan']),
+        ):
+            np.add(scores, np.float32(value), out=scores, where=codes[rows, None] == codes[None, :])
+
+        price_distance = np.abs(attributes['log_price'][rows, None] - attributes['log_price'][None, :])
+        price_distance *= np.float32(1 / np.log(PRICE_RANGE))
+        np.minimum(price_distance, 1, out=price_distance)
+        scores += np.float32(WEIGHTS['price']) * (1 - price_distance)
+        date_distance = np.abs(attributes['start'][rows, None] - attributes['start'][None, :]).astype(np.float32)
+        date_distance *= np.float32(1 / DATE_RANGE_DAYS)
+        np.minimum(date_distance, 1, out=date_distance)
+        scores += np.float32(WEIGHTS['dates']) * (1 - date_distance)
+
+        # A tour is not its own neighbour
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores
+
+    def neighbours(self, rows, k):
+        """For each row, ``[(tour_id, score), ...]`` of its ``k`` best matches, best first"""
+        scores = self.scores(rows)
+        k = min(k, len(self) - 1)
+        if k <= 0:
+            return [[] for _ in rows]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        result = []
+        for row_scores, candidates in zip(scores, top):
+            ordered = candidates[np.lexsort((self.ids[candidates], -row_scores[candidates]))]
+            result.append([(int(self.ids[i]), float(row_scores[i])) for i in ordered])
+        return result
+
+
+def _write_lists(catalog, rows, k, batch_size):
+    """Replace the neighbour lists of the tours at positions ``rows``; returns rows written"""
+    written = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        lists = catalog.neighbours(batch, k)
+        objects = [
+            SimilarTour(tour_id=int(catalog.ids[row]), similar_id=similar_id, rank=rank, score=round(score, 5))
+            for row, neighbours in zip(batch, lists)
+            for rank, (similar_id, score) in enumerate(neighbours)
+        ]
+        with transaction.atomic():
+            SimilarTour.objects.filter(tour_id__in=catalog.ids[batch].tolist()).delete()
+            SimilarTour.objects.bulk_create(objects, batch_size=2000)
+        written += len(objects)
+    return written
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+# Set once the SimilarTour table is known to be built; until then saves have no lists to refresh
+_lists_built = False
+_lists_checked_at = None
+
+
+def lists_built():
+    """Whether ``compute_similar_tours`` has built the table (a missing table is checked again after a while)"""
+    global _lists_built, _lists_checked_at
+    if _lists_built:
+        return True
+    now = time.monotonic()
+    if _lists_checked_at is None or now - _lists_checked_at >= settings.CATALOG_REFRESH_INTERVAL:
+        _lists_checked_at = now
+        _lists_built = SimilarTour.objects.exists()
+    return _lists_built
+
+
+def compute_similar_tours(k=None, batch_size=256, log=None):
+    """Rebuild every neighbour list; returns counts and timings"""
+    global _catalog, _lists_built
+    k = k or settings.SIMILAR_TOURS_K
+    start = time.perf_counter()
+    catalog = Catalog()
+    with _catalog_lock:
+        _catalog = catalog
+    loaded = time.perf_counter() - start
+    if log:
+        log(f"Loaded {len(catalog)} active tours in {loaded:.1f}s")
+
+    # Tours that are no longer active keep no list
+    SimilarTour.objects.exclude(tour__is_active=True).delete()
+    written = _write_lists(catalog, list(range(len(catalog))), k, batch_size)
+    _lists_built = True
+    return {
+        'tours': len(catalog),
+        'rows': written,
+        'load_seconds': round(loaded, 2),
+        'elapsed_seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+def refresh_similar_tours(tour_ids, k=None, batch_size=256):
+    """Update the neighbour lists affected by changes to ``tour_ids``; returns the tours refreshed"""
+    global _catalog
+    k = k or settings.SIMILAR_TOURS_K
+    with _catalog_lock:
+        # The process keeps its catalog between refreshes and re-reads only the changed tours;
+        # a change log that went backwards (restored database) means starting over
+        tour_ids = set(tour_ids)
+        if _catalog is None or changes.latest()[0] < _catalog.seq:
+            _catalog = Catalog()
+        else:
+            _catalog.update(tour_ids)
+        catalog = _catalog
+
+    # Inactive (or deleted) tours have no list of their own
+    SimilarTour.objects.filter(tour_id__in=[tour_id for tour_id in tour_ids if tour_id not in catalog.positions]).delete()
+
+    changed = [catalog.positions[tour_id] for tour_id in tour_ids if tour_id in catalog.positions]
+    affected = set(changed)
+    # Lists that contain a changed tour may drop it or reorder
+    for tour_id in SimilarTour.objects.filter(similar_id__in=tour_ids).values_list('tour_id', flat=True):
+        if tour_id in catalog.positions:
+            affected.add(catalog.positions[tour_id])
+    # The score is symmetric: the changed tours' closest matches are the lists most likely to take them in
+    if changed:
+        candidates = min(REVERSE_CANDIDATES, len(catalog) - 1)
+        if candidates > 0:
+            scores = catalog.scores(changed)
+            affected.update(np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates].ravel().tolist())
+
+    _write_lists(catalog, sorted(affected), k, batch_size)
+    return len(affected)
+
+
+_refresh_pool = None
+_pending = set()
+_pending_lock = threading.Lock()
+_scheduled = False
+
+
+def _pool():
+    global _refresh_pool
+    if _refresh_pool is None:
+        # One worker: refreshes never overlap, and pending changes pile up into one batch meanwhile
+        _refresh_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similar-tours')
+    return _refresh_pool
+
+
+def schedule_refresh(tour_ids):
+    """Refresh the lists affected by ``tour_ids`` in the background; returns the pending future, if any"""
+    global _scheduled
+    with _pending_lock:
+        _pending.update(tour_ids)
+        if _scheduled or not _pending:
+            return None
+        _scheduled = True
+    return _pool().submit(_run_pending)
+
+
+def _run_pending():
+    global _scheduled
+    with _pending_lock:
+        tour_ids = set(_pending)
+        _pending.clear()
+        _scheduled = False
+    close_old_connections()
+    try:
+        refresh_similar_tours(tour_ids)
+    except Exception:
+        logger.exception("Refreshing similar tours for %d changed tours failed", len(tour_ids))
+    finally:
+        close_old_connections()
+
+
+def similar_tours_for(tour_id, limit=None):
+    """Active tours similar to ``tour_id``, best first (one indexed query)"""
+    return (
+        SimilarTour.objects.filter(tour_id=tour_id, similar__is_active=True)
+        .select_related('similar')
+        .order_by('rank')[:limit or settings.SIMILAR_TOURS_K]
+    )
@@ -0,0 +1,362 @@
+"""
+Deterministic synthetic data for local load testing and benchmarks.
+
+The same seed and sizes always produce the same catalog, users, conversations and saved tours,
+so benchmark numbers are comparable between runs and machines. Everything is written with
+batched ``bulk_create`` and generated in chunks, so memory stays flat even for millions of
+chat messages. All synthetic users have usernames starting with ``synth_`` and all synthetic
+tours have an ``external_id`` starting with ``synthetic-``.
+"""
+import bisect
+import datetime
+import itertools
+import math
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from . import analytics
+from .embeddings import embed_stale_tours
+from .models import User, Tour, TourCompany, Conversation, ChatMessage, SavedTour, Destination, TourChange
+from .personalization import rebuild_affinities
+from .similarity import compute_similar_tours
+
+USERNAME_PREFIX = 'synth_'
+EXTERNAL_ID_PREFIX = 'synthetic-'
+PASSWORD = 'synthetic-password'
+# Tour dates count from this day rather than today, so a seed always yields the same catalog
+ANCHOR_DATE = datetime.date(2026, 1, 1)
+
+# (city, country, base price in USD, relative popularity)
+DESTINATIONS = [
+    ('Bali', 'Indonesia', 1800, 10), ('Jakarta', 'Indonesia', 1300, 2), ('Bangkok', 'Thailand', 1400, 9),
+    ('Phuket', 'Thailand', 1600, 8), ('Chiang Mai', 'Thailand', 1200, 4), ('Tokyo', 'Japan', 3200, 9),
+    ('Kyoto', 'Japan', 3000, 7), ('Osaka', 'Japan', 2800, 4), ('Seoul', 'South Korea', 2400, 5),
+    ('Hanoi', 'Vietnam', 1300, 4), ('Ho Chi Minh City', 'Vietnam', 1250, 3), ('Singapore', 'Singapore', 2600, 5),
+    ('Kuala Lumpur', 'Malaysia', 1400, 3), ('Maldives', 'Maldives', 4200, 7), ('Colombo', 'Sri Lanka', 1500, 2),
+    ('Kathmandu', 'Nepal', 1700, 3), ('Goa', 'India', 1100, 4), ('Jaipur', 'India', 1200, 3),
+    ('Dubai', 'United Arab Emirates', 2500, 8), ('Istanbul', 'Turkey', 1300, 8), ('Cappadocia', 'Turkey', 1500, 5),
+    ('Antalya', 'Turkey', 1100, 6), ('Baku', 'Azerbaijan', 1000, 4), ('Tbilisi', 'Georgia', 950, 4),
+    ('Paris', 'France', 2600, 10), ('Nice', 'France', 2400, 4), ('Rome', 'Italy', 2300, 9),
+    ('Venice', 'Italy', 2500, 6), ('Florence', 'Italy', 2300, 5), ('Amalfi Coast', 'Italy', 2900, 5),
+    ('Barcelona', 'Spain', 2100, 8), ('Madrid', 'Spain', 1900, 5), ('Seville', 'Spain', 1800, 3),
+    ('Lisbon', 'Portugal', 1700, 6), ('Porto', 'Portugal', 1600, 3), ('Santorini', 'Greece', 2700, 8),
+    ('Athens', 'Greece', 1800, 5), ('Mykonos', 'Greece', 2800, 4), ('Zermatt', 'Switzerland', 4300, 5),
+    ('Interlaken', 'Switzerland', 3900, 4), ('Vienna', 'Austria', 2100, 4), ('Prague', 'Czech Republic', 1500, 5),
+    ('Budapest', 'Hungary', 1400, 4), ('Amsterdam', 'Netherlands', 2200, 6), ('London', 'United Kingdom', 2700, 8),
+    ('Edinburgh', 'United Kingdom', 2300, 3), ('Dublin', 'Ireland', 2100, 3), ('Reykjavik', 'Iceland', 3300, 4),
+    ('Tromso', 'Norway', 3500, 3), ('Bergen', 'Norway', 3100, 2), ('Stockholm', 'Sweden', 2600, 2),
+    ('Dubrovnik', 'Croatia', 1900, 4), ('Marrakech', 'Morocco', 1400, 5), ('Cairo', 'Egypt', 1500, 5),
+    ('Zanzibar', 'Tanzania', 2400, 3), ('Serengeti', 'Tanzania', 4800, 3), ('Cape Town', 'South Africa', 2900, 4),
+    ('Nairobi', 'Kenya', 3100, 3), ('New York', 'United States', 3100, 8), ('Los Angeles', 'United States', 2900, 5),
+    ('Miami', 'United States', 2600, 4), ('Cancun', 'Mexico', 2000, 6), ('Mexico City', 'Mexico', 1700, 3),
+    ('Havana', 'Cuba', 1800, 2), ('Rio de Janeiro', 'Brazil', 2500, 4), ('Cusco', 'Peru', 2700, 4),
+    ('Buenos Aires', 'Argentina', 2400, 3), ('Patagonia', 'Argentina', 3800, 2), ('Sydney', 'Australia', 3800, 5),
+    ('Queenstown', 'New Zealand', 4000, 3), ('Fiji', 'Fiji', 3600, 2),
+]
+
+THEMES = [
+    ('Adventure', 'Hike, raft and explore rugged landscapes with expert guides.'),
+    ('Cultural Journey', 'Discover ancient temples, local markets and living traditions.'),
+    ('Beach Escape', 'Relax on pristine beaches with crystal-clear water and sunsets.'),
+    ('Romantic Getaway', 'A romantic escape for couples with candlelit dinners and private tours.'),
+    ('Family Holiday', 'Kid-friendly activities, spacious rooms and easy day trips.'),
+    ('Food & Wine Tour', 'Cooking classes, tastings and the best local restaurants.'),
+    ('Wellness Retreat', 'Spa treatments, yoga sessions and mindful relaxation.'),
+    ('City Break', 'Museums, landmarks, nightlife and shopping in the heart of the city.'),
+    ('Wildlife Safari', 'Game drives and wildlife encounters in their natural habitat.'),
+    ('Mountain Trek', 'Alpine trails, mountain huts and breathtaking summit views.'),
+    ('Luxury Experience', 'Five-star hotels, private transfers and exclusive experiences.'),
+    ('Island Hopping', 'Sail between islands, snorkel hidden coves and explore villages.'),
+]
+
+ADJECTIVES = ['Classic', 'Ultimate', 'Hidden', 'Grand', 'Essential', 'Signature', 'Authentic', 'Scenic', 'Deluxe', 'Magical']
+HOTEL_BRANDS = ['Grand Hyatt', 'Hilton', 'Marriott', 'Four Seasons', 'Radisson', 'Boutique Hotel', 'Sheraton', 'Novotel', 'Ritz-Carlton', 'Ibis']
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Jamie', 'Riley', 'Avery', 'Quinn', 'Aylin', 'Kenji', 'Leila', 'Mateo', 'Nadia', 'Omar']
+LAST_NAMES = ['Smith', 'Garcia', 'Kim', 'Aliyev', 'Rossi', 'Novak', 'Silva', 'Tanaka', 'Muller', 'Dubois', 'Haddad', 'Okafor']
+
+MEAL_PLAN_WEIGHTS = [('room_only', 2), ('bed_breakfast', 4), ('half_board', 3), ('full_board', 1), ('all_inclusive', 2)]
+FLIGHT_TYPE_WEIGHTS = [('direct', 3), ('layover', 2)]
+
+USER_PROMPTS = [
+    'I want a {theme} in {country}', 'Show me tours to {city}', 'Any {theme} under ${budget}?',
+    'Looking for something in {country} with all inclusive', 'What can I do in {city} in {month}?',
+    'Do I need a visa for {country}?', 'Cheap trips to {city} please',
+]
+AI_REPLIES = [
+    'Great! I found some amazing options for you!', 'Here are a few tours that match what you are looking for.',
+    'Excellent choice! These tours would be perfect.', 'I discovered some fantastic trips you might enjoy!',
+]
+
+PRESETS = {
+    'small': dict(companies=10, agents=50, users=200, tours=2000, conversations=500, messages_per_conversation=6, saved_tours=3000),
+    'medium': dict(companies=200, agents=1000, users=5000, tours=20000, conversations=20000, messages_per_conversation=8, saved_tours=50000),
+    'large': dict(companies=2000, agents=5000, users=50000, tours=100000, conversations=150000, messages_per_conversation=10, saved_tours=500000),
+}
+
+
+class ZipfSampler:
+    """Sample indexes 0..n-1 with probability proportional to 1 / (rank + 1) ** exponent"""
+
+    def __init__(self, n, exponent=1.1):
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+    def sample(self, rng):
+        return bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+
+
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+class SyntheticDataGenerator:
+    def __init__(self, seed=42, batch_size=2000, companies=10, agents=50, users=200, tours=2000,
+                 conversations=500, messages_per_conversation=6, saved_tours=3000, log=None,
+                 anchor_date=ANCHOR_DATE):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.sizes = dict(
+            companies=companies, agents=agents, users=users, tours=tours, conversations=conversations,
+            messages_per_conversation=messages_per_conversation, saved_tours=saved_tours,
+        )
+        self.log = log or (lambda message: None)
+        self.counts = {}
+        self.anchor_date = anchor_date
+
+    def generate(self):
+        """Create the whole dataset and return row counts and timings"""
+        start = time.perf_counter()
+        password_hash = make_password(PASSWORD)
+
+        with transaction.atomic():
+            company_ids = self._timed('companies', self.create_companies)
+            agent_ids = self._timed('agents', self.create_agents, company_ids, password_hash)
+            user_ids = self._timed('users', self.create_users, password_hash)
+        tour_ids = self._timed('tours', self.create_tours, agent_ids)
+        self._timed('tour_embeddings', self.embed_tours)
+        self._timed('similar_tours', self.compute_similar_tours)
+        self._timed('chat_messages', self.create_conversations, user_ids, tour_ids)
+        self._timed('saved_tours', self.create_saved_tours, user_ids, tour_ids)
+        self._timed('user_affinities', self.compute_affinities, user_ids)
+        self._timed('tour_daily_stats', self.compute_tour_stats)
+
+        self.counts['elapsed_seconds'] = round(time.perf_counter() - start, 2)
+        return self.counts
+
+    def embed_tours(self):
+        # bulk_create skips the post_save signal that embeds tours for semantic search
+        tours = Tour.objects.filter(external_id__startswith=EXTERNAL_ID_PREFIX)
+        self.counts['tour_embeddings'] = embed_stale_tours(tours, self.batch_size)
+
+    def compute_affinities(self, user_ids):
+        # Saved tours and recommendations were bulk inserted, so nothing updated the affinities as they came in
+        self.counts['user_affinities'] = rebuild_affinities(user_ids, self.batch_size) if user_ids else 0
+
+    def compute_tour_stats(self):
+        # Analytics count events as they happen; the generated history goes in directly
+        self.counts['tour_daily_stats'] = analytics.backfill()
+
+    def compute_similar_tours(self):
+        self.counts['similar_tours'] = compute_similar_tours()['rows']
+
+    def _timed(self, name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        self.log(f"{name}: {self.counts.get(name, 0)} rows in {elapsed:.1f}s")
+        return result
+
+    def _bulk_create(self, model, objects):
+        created = []
+        for chunk in _chunks(objects, self.batch_size):
+            created.extend(model.objects.bulk_create(chunk, batch_size=self.batch_size))
+        return created
+
+    def create_companies(self):
+        companies = [
+            TourCompany(
+                name=f'Synthetic Travel {index:05d}',
+                description='Synthetic tour company for load testing',
+                email=f'company{index}@synthetic.example.com',
+            )
+            for index in range(self.sizes['companies'])
+        ]
+        self.counts['companies'] = len(companies)
+        return [company.id for company in self._bulk_create(TourCompany, companies)]
+
+    def create_agents(self, company_ids, password_hash):
+        agents = []
+        for index in range(self.sizes['agents']):
+            # About one agent in ten works independently
+            company_id = self.rng.choice(company_ids) if company_ids and self.rng.random() > 0.1 else None
+            agents.append(self._user(f'{USERNAME_PREFIX}agent_{index}', 'agent', password_hash, tour_company_id=company_id))
+        self.counts['agents'] = len(agents)
+        return [agent.id for agent in self._bulk_create(User, agents)]
+
+    def create_users(self, password_hash):
+        users = [
+            self._user(f'{USERNAME_PREFIX}user_{index}', 'normal', password_hash)
+            for index in range(self.sizes['users'])
+        ]
+        self.counts['users'] = len(users)
+        return [user.id for user in self._bulk_create(User, users)]
+
+    def _user(self, username, user_type, password_hash, **extra):
+        return User(
+            username=username,
+            email=f'{username}@synthetic.example.com',
+            password=password_hash,
+            first_name=self.rng.choice(FIRST_NAMES),
+            last_name=self.rng.choice(LAST_NAMES),
+            user_type=user_type,
+            **extra
+        )
+
+    def create_tours(self, agent_ids):
+        if not agent_ids:
+            return []
+        destination_sampler = ZipfSampler(len(DESTINATIONS), exponent=0.8)
+        destinations = sorted(DESTINATIONS, key=lambda destination: -destination[3])
+        agent_sampler = ZipfSampler(len(agent_ids), exponent=0.7)
+
+        tour_ids = []
+        for chunk in _chunks(range(self.sizes['tours']), self.batch_size):
+            tours = [self._tour(index, agent_ids[agent_sampler.sample(self.rng)],
+                                destinations[destination_sampler.sample(self.rng)]) for index in chunk]
+            place_ids = Destination.objects.resolve(tour.destination for tour in tours)
+            for tour in tours:
+                tour.place_id = place_ids[tour.destination]
+            # bulk_create skips the change log that Tour.save() writes (users.changes)
+            with transaction.atomic():
+                Tour.objects.bulk_create(tours, batch_size=self.batch_size)
+                TourChange.objects.bulk_create([TourChange.objects.entry(tour) for tour in tours], batch_size=self.batch_size)
+            tour_ids.extend(tour.id for tour in tours)
+        self.counts['tours'] = len(tour_ids)
+        return tour_ids
+
+    def _tour(self, index, agent_id, destination):
+        city, country, base_price, _ = destination
+        theme, theme_description = self.rng.choice(THEMES)
+        nights = self.rng.choice([3, 4, 5, 6, 7, 7, 7, 8, 10, 10, 12, 14])
+        start_date = self.anchor_date + datetime.timedelta(days=self.rng.randint(7, 540))
+        price = base_price * nights / 7 * math.exp(self.rng.gauss(0, 0.35))
+        if theme == 'Luxury Experience':
+            price *= 2
+        price = Decimal(f'{max(price, 99):.2f}')
+        return Tour(
+            agent_id=agent_id,
+            title=f'{self.rng.choice(ADJECTIVES)} {city} {theme}',
+            description=f'{theme_description} Spend {nights} nights in {city}, {country}.',
+            destination=f'{city}, {country}',
+            price=price,
+            price_usd=price,
+            hotel_name=f'{self.rng.choice(HOTEL_BRANDS)} {city}',
+            start_date=start_date,
+            end_date=start_date + datetime.timedelta(days=nights),
+            duration_nights=nights,
+            visa_required=self.rng.random() < 0.3,
+            meal_plan=_weighted(self.rng, MEAL_PLAN_WEIGHTS),
+            flight_type=_weighted(self.rng, FLIGHT_TYPE_WEIGHTS),
+            external_id=f'{EXTERNAL_ID_PREFIX}{index}',
+        )
+
+    def create_conversations(self, user_ids, tour_ids):
+        """Conversations with alternating user/AI messages; AI messages recommend 1-5 popular-skewed tours"""
+        if not user_ids:
+            return
+        tour_sampler = ZipfSampler(len(tour_ids)) if tour_ids else None
+        user_sampler = ZipfSampler(len(user_ids), exponent=0.5)
+        through = ChatMessage.recommended_tours.through
+        conversations_created = messages_created = recommendations_created = 0
+
+        for chunk in _chunks(range(self.sizes['conversations']), max(1, self.batch_size // 10)):
+            conversations = Conversation.objects.bulk_create([
+                Conversation(user_id=user_ids[user_sampler.sample(self.rng)], title=self._prompt()[:50])
+                for _ in chunk
+            ])
+            conversations_created += len(conversations)
+
+            messages = []
+            for conversation in conversations:
+                for position in range(self.sizes['messages_per_conversation']):
+                    is_user = position % 2 == 0
+                    messages.append(ChatMessage(
+                        conversation_id=conversation.id,
+                        content=self._prompt() if is_user else self.rng.choice(AI_REPLIES),
+                        sender='user' if is_user else 'ai',
+                    ))
+            messages = self._bulk_create(ChatMessage, messages)
+            messages_created += len(messages)
+
+            if tour_sampler:
+                links = []
+                for message in messages:
+                    if message.sender != 'ai':
+                        continue
+                    recommended = {tour_ids[tour_sampler.sample(self.rng)] for _ in range(self.rng.randint(1, 5))}
+                    links.extend(through(chatmessage_id=message.id, tour_id=tour_id) for tour_id in recommended)
+                self._bulk_create(through, links)
+                recommendations_created += len(links)
+
+        self.counts['conversations'] = conversations_created
+        self.counts['chat_messages'] = messages_created
+        self.counts['recommended_tours'] = recommendations_created
+
+    def _prompt(self):
+        city, country, base_price, _ = self.rng.choice(DESTINATIONS)
+        theme, _ = self.rng.choice(THEMES)
+        return self.rng.choice(USER_PROMPTS).format(
+            theme=theme.lower(), country=country, city=city, budget=base_price,
+            month=self.rng.choice(['March', 'June', 'September', 'December']),
+        )
+
+    def create_saved_tours(self, user_ids, tour_ids):
+        """Saved tours with popularity skew: a few tours are saved by many users, most by few"""
+        if not user_ids or not tour_ids:
+            return
+        tour_sampler = ZipfSampler(len(tour_ids))
+        user_sampler = ZipfSampler(len(user_ids), exponent=0.6)
+        seen = set()
+        saved = []
+        target = min(self.sizes['saved_tours'], len(user_ids) * len(tour_ids))
+        attempts = 0
+        while len(seen) < target and attempts < target * 5:
+            attempts += 1
+            pair = (user_ids[user_sampler.sample(self.rng)], tour_ids[tour_sampler.sample(self.rng)])
+            if pair in seen:
+                continue
+            seen.add(pair)
+            saved.append(SavedTour(user_id=pair[0], tour_id=pair[1]))
+            if len(saved) >= self.batch_size:
+                SavedTour.objects.bulk_create(saved, batch_size=self.batch_size)
+                saved = []
+        if saved:
+            SavedTour.objects.bulk_create(saved, batch_size=self.batch_size)
+        self.counts['saved_tours'] = len(seen)
+
+
+def clear_synthetic_data():
+    """Delete everything created by the generator"""
+    users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+    SavedTour.objects.filter(user__in=users).delete()
+    ChatMessage.recommended_tours.through.objects.filter(chatmessage__conversation__user__in=users).delete()
+    ChatMessage.objects.filter(conversation__user__in=users).delete()
+    Conversation.objects.filter(user__in=users).delete()
+    SavedTour.objects.filter(tour__external_id__startswith=EXTERNAL_ID_PREFIX).delete()
+    Tour.objects.filter(external_id__startswith=EXTERNAL_ID_PREFIX).delete()
+    deleted, _ = users.delete()
+    TourCompany.objects.filter(email__endswith='@synthetic.example.com').delete()
+    return deleted
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -1,3 +1,1087 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import openai
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, connections
+from django.db.backends.signals import connection_created
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from langchain.agents import BaseMultiActionAgent
+from langchain.schema import AIMessage, HumanMessage
+from langchain.tools import Tool
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_openai import ChatOpenAI
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import analytics, authentication, changes, impressions, metrics, routers, similarity
+from .agent_budget import ENOUGH_TOURS, FINISHED, MAX_TOOL_CALLS, AgentBudget, final_answer, run_with_budget
+from .agent_executor import ParallelAgentExecutor
+from .availability import month_window, parse_period, period_condition
+from .authentication import ClaimsJWTAuthentication, ClaimsUser, invalidate_user
+from .bench import check_budgets
+from .catalog import catalog_changed
+from .db import count_queries
+from .destinations import index as destination_index
+from .currency import base_bound, display_currency, format_price, refresh_base_prices, round_price, supported, to_base
+from .embeddings import VectorIndex, embed_tours
+from .facets import FacetIndex, parse_filters
+from .llm_resilience import CircuitBreaker, LLMUnavailable, ResilientChatOpenAI, breaker, llm_deadline
+from .middleware import ConnectionTimingMiddleware, ReplicaRoutingMiddleware
+from .models import (
+    Country, Destination, RecommendationImpression, RequestProfile, SavedTour, SimilarTour, Tour, TourChange, TourDailyStats, TourEmbedding, TourEvent, User,
+    UserAffinity,
+)
+from .personalization import SAVED_WEIGHT, forget_saved_tours, rebuild_affinities, record_interactions
+from .ranking import candidate_ids, collect_candidates, matched_counts, record_candidates
+from .similarity import compute_similar_tours, refresh_similar_tours
+from .synthetic import ANCHOR_DATE, DESTINATIONS, SyntheticDataGenerator
+from .tokens import TourAIRefreshToken
+from .tour_import import TourImporter
+
+
+def make_tour(agent, **fields):
+    fields = {
+        'title': 'Beach escape', 'description': 'Sun and sand', 'destination': 'Bali',
+        'price': Decimal('1000.00'), **fields,
+    }
+    return Tour.objects.create(agent=agent, **fields)
+
+
+def api_client(user):
+    return Client(HTTP_AUTHORIZATION=f'Bearer {TourAIRefreshToken.for_user(user).access_token}')
+
+
+class UserCacheTestCase(TestCase):
+    """Rolled-back users' IDs are reused (SQLite), so the per-process user cache starts empty"""
+
+    def setUp(self):
+        super().setUp()
+        authentication._user_cache.clear()
+
+@override_settings(LLM_MAX_RETRIES=0, LLM_HEDGE=False, LLM_TIMEOUT=20)
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+        self.llm = ResilientChatOpenAI(api_key='test')
+
+    def _open_then_half_open(self):
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        breaker.opened_at = time.monotonic() - breaker.reset_timeout
+
+    def test_opens_after_consecutive_failures_and_closes_after_successful_probe(self):
+        local = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        local.record_failure()
+        self.assertTrue(local.allow())
+        local.record_failure()
+        self.assertEqual(local.state, CircuitBreaker.OPEN)
+        self.assertFalse(local.allow())
+        local.opened_at -= 60
+        self.assertTrue(local.allow())
+        self.assertEqual(local.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(local.allow())
+        local.record_success()
+        self.assertEqual(local.state, CircuitBreaker.CLOSED)
+
+    def test_probe_ending_in_non_retryable_error_is_released(self):
+        self._open_then_half_open()
+        with mock.patch.object(ChatOpenAI, '_generate', side_effect=ValueError('bad')):
+            with self.assertRaises(ValueError):
+                self.llm._generate([])
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.is_open())
+        self.assertTrue(breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self._open_then_half_open()
+        error = openai.APIConnectionError(request=mock.Mock())
+        with mock.patch.object(ChatOpenAI, '_generate', side_effect=error):
+            with self.assertRaises(openai.APIConnectionError):
+                self.llm._generate([])
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.is_open())
+
+    @override_settings(LLM_MAX_RETRIES=3, LLM_RETRY_BACKOFF=0)
+    def test_a_call_counts_as_one_failure_however_many_attempts_it_made(self):
+        error = openai.APIConnectionError(request=mock.Mock())
+        with mock.patch.object(ChatOpenAI, '_generate', side_effect=error) as generate:
+            with self.assertRaises(openai.APIConnectionError):
+                self.llm._generate([])
+        self.assertEqual((generate.call_count, breaker.failures), (4, 1))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        # Retries that end in a success record none
+        with mock.patch.object(ChatOpenAI, '_generate', side_effect=[error, error, 'result']):
+            self.assertEqual(self.llm._generate([]), 'result')
+        self.assertEqual(breaker.failures, 0)
+
+    def test_deadline_rejection_is_not_a_failure(self):
+        with mock.patch.object(ChatOpenAI, '_generate') as generate, llm_deadline(0):
+            with self.assertRaises(LLMUnavailable):
+                self.llm._generate([])
+        generate.assert_not_called()
+        self.assertEqual(breaker.failures, 0)
+
+    def test_deadline_rejected_probe_is_released(self):
+        self._open_then_half_open()
+        with llm_deadline(0), self.assertRaises(LLMUnavailable):
+            self.llm._generate([])
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+
+class ClaimsAuthenticationTests(UserCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('claims', 'claims@example.com', 'pw', user_type='agent')
+        self.auth = ClaimsJWTAuthentication()
+
+    def _authenticate(self):
+        token = TourAIRefreshToken.for_user(self.user).access_token
+        return self.auth.get_user(self.auth.get_validated_token(str(token)))
+
+    @override_settings(USER_CACHE_TTL=0)
+    def test_local_cache_loads_the_user_and_rejects_deactivated_users(self):
+        user = self._authenticate()
+        self.assertNotIsInstance(user, ClaimsUser)
+        # Not through save(): no invalidation reaches the cache
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self._authenticate()
+
+    def test_shared_cache_trusts_claims_until_invalidated(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }):
+            # Not through save(), which would distrust tokens issued within the same second
+            User.objects.filter(pk=self.user.pk).update(preferred_currency='EUR')
+            self.user.refresh_from_db()
+            token = str(TourAIRefreshToken.for_user(self.user).access_token)
+            with self.assertNumQueries(0):
+                user = self.auth.get_user(self.auth.get_validated_token(token))
+                self.assertIsInstance(user, ClaimsUser)
+                self.assertEqual(user.user_type, 'agent')
+                request = RequestFactory().get('/api/tours/')
+                request.user = user
+                self.assertEqual(display_currency(request), 'EUR')
+
+            User.objects.filter(pk=self.user.pk).update(user_type='normal')
+            invalidate_user(self.user.pk)
+            user = self.auth.get_user(self.auth.get_validated_token(token))
+            self.assertNotIsInstance(user, ClaimsUser)
+            self.assertEqual(user.user_type, 'normal')
+
+
+class ClearDuplicateEmailsMigrationTests(TransactionTestCase):
+    before = [('users', '0024_recommendation_impressions')]
+    after = [('users', '0026_user_email_unique')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_duplicates_are_cleared_and_the_constraint_then_holds(self):
+        self.addCleanup(self.migrate, self.after)
+        OldUser = self.migrate(self.before).get_model('users', 'User')
+        recent = timezone.now()
+        first = OldUser.objects.create(username='first', email='dup@example.com')
+        signed_in = OldUser.objects.create(username='signed-in', email='dup@example.com', last_login=recent)
+        third = OldUser.objects.create(username='third', email='dup@example.com')
+        other = OldUser.objects.create(username='other', email='other@example.com')
+
+        with self.assertLogs(level='WARNING') as logs:
+            self.migrate(self.after)
+        self.assertIn(f'users {first.id}, {third.id}; kept by user {signed_in.id}', logs.output[0])
+        emails = dict(User.objects.values_list('id', 'email'))
+        self.assertEqual(emails[signed_in.id], 'dup@example.com')
+        self.assertEqual((emails[first.id], emails[third.id]), ('', ''))
+        self.assertEqual(emails[other.id], 'other@example.com')
+        with self.assertRaises(IntegrityError):
+            User.objects.create(username='fourth', email='dup@example.com')
+
+
+class FakeExecutor:
+    """Yields one intermediate step per ``(tool, observation)``, then the final output"""
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def iter(self, agent_input):
+        for tool, observation in self.steps:
+            yield {'intermediate_step': [(mock.Mock(tool=tool), observation)]}
+        yield {'output': 'done'}
+
+
+def _tour_ids(steps):
+    return list(dict.fromkeys(item['id'] for _, observation in steps for item in observation))
+
+
+class AgentBudgetTests(SimpleTestCase):
+    tours = [{'id': tour_id, 'title': f'Tour {tour_id}', 'destination': 'Bali', 'visa_required': True} for tour_id in range(5)]
+
+    def test_enough_tours_stops_searches(self):
+        executor = FakeExecutor([('search_tours_by_keyword', self.tours), ('search_tours_by_destination', [])])
+        result = run_with_budget(executor, {'input': 'beach'}, _tour_ids, budget=AgentBudget(enough_tours=5, strategy='force'))
+        self.assertEqual(result['stop_reason'], ENOUGH_TOURS)
+        self.assertEqual(len(result['intermediate_steps']), 1)
+
+    def test_detail_lookups_do_not_count_towards_enough_tours(self):
+        executor = FakeExecutor([('get_tour_details_by_ids', self.tours)])
+        result = run_with_budget(executor, {'input': 'visa?'}, _tour_ids, budget=AgentBudget(enough_tours=5))
+        self.assertEqual(result['stop_reason'], FINISHED)
+        self.assertEqual(result['output'], 'done')
+
+    def test_zero_disables_a_limit(self):
+        executor = FakeExecutor([('search_tours_by_keyword', [])] * 3)
+        budget = AgentBudget(max_iterations=0, max_tool_calls=0, max_seconds=0, enough_tours=0)
+        self.assertEqual(run_with_budget(executor, {'input': 'x'}, _tour_ids, budget=budget)['stop_reason'], FINISHED)
+        budget = AgentBudget(max_iterations=0, max_tool_calls=2, max_seconds=0, enough_tours=0, strategy='force')
+        self.assertEqual(run_with_budget(executor, {'input': 'x'}, _tour_ids, budget=budget)['stop_reason'], MAX_TOOL_CALLS)
+
+    def test_final_answer_gets_history_and_details(self):
+        llm = mock.Mock()
+        llm.invoke.return_value = AIMessage(content='Yes, it needs a visa.')
+        history = [HumanMessage(content='Beach tours in Bali'), AIMessage(content='Here are some!')]
+        steps = [(mock.Mock(tool='get_tour_details_by_ids'), self.tours[:1])]
+        answer = final_answer({'input': 'Do I need a visa?', 'chat_history': history}, steps, MAX_TOOL_CALLS, llm)
+        self.assertEqual(answer, 'Yes, it needs a visa.')
+        messages = llm.invoke.call_args[0][0]
+        self.assertEqual(messages[1:3], history)
+        self.assertIn('"visa_required": true', messages[-1].content)
+
+
+class TwoSearchesAgent(BaseMultiActionAgent):
+    """Asks for two searches in one step, then answers with what they returned"""
+
+    @property
+    def input_keys(self):
+        return ['input']
+
+    def plan(self, intermediate_steps, callbacks=None, **kwargs):
+        if intermediate_steps:
+            return AgentFinish({'output': [observation for _, observation in intermediate_steps]}, '')
+        return [AgentAction('search', 'slow', ''), AgentAction('search', 'fast', '')]
+
+    async def aplan(self, intermediate_steps, callbacks=None, **kwargs):
+        raise NotImplementedError
+
+
+class ParallelAgentExecutorTests(SimpleTestCase):
+    databases = {'default'}
+
+    def run_agent(self, parallel, wait):
+        calls = []
+
+        def search(query):
+            calls.append(query)
+            wait()
+            if query == 'slow':
+                time.sleep(0.05)
+            calls.append(f'{query} done')
+            return f'{query}:{"replica" if routers._replica_reads.get() else "primary"}'
+
+        executor = ParallelAgentExecutor(
+            agent=TwoSearchesAgent(), tools=[Tool(name='search', func=search, description='Search tours')],
+            parallel_tools=parallel,
+        )
+        with routers.read_from_replica():
+            return executor.invoke({'input': 'tours'})['output'], calls
+
+    def test_a_steps_calls_run_together_in_the_callers_context_and_keep_their_order(self):
+        # Both calls must be in flight at once to get past the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        output, calls = self.run_agent(True, barrier.wait)
+        self.assertEqual(output, ['slow:replica', 'fast:replica'])
+        self.assertLess(calls.index('fast done'), calls.index('slow done'))
+
+    def test_tool_threads_queries_count_towards_the_callers(self):
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        with count_queries() as queries:
+            self.run_agent(True, query)
+        self.assertEqual(queries.count, 2)
+
+    def test_sequential_mode_runs_one_call_at_a_time(self):
+        output, calls = self.run_agent(False, lambda: None)
+        self.assertEqual(output, ['slow:replica', 'fast:replica'])
+        self.assertEqual(calls, ['slow', 'slow done', 'fast', 'fast done'])
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0)
+class ProfilingMiddlewareTests(UserCacheTestCase):
+    def _client(self, user=None):
+        headers = {'HTTP_X_PROFILE': '1'}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {TourAIRefreshToken.for_user(user).access_token}'
+        return Client(**headers)
+
+    def test_only_staff_requests_start_the_profiler(self):
+        user = User.objects.create_user('plain', 'plain@example.com', 'pw')
+        with mock.patch('users.profiling.RequestProfiler') as profiler:
+            for client in (self._client(), self._client(user)):
+                response = client.get('/api/auth/profile/')
+                self.assertNotIn('X-Profile-ID', response)
+        profiler.assert_not_called()
+
+    def test_staff_request_is_profiled_and_saved(self):
+        staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILE_DIR=directory):
+            response = self._client(staff).get('/api/auth/profile/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(RequestProfile.objects.filter(request_id=response['X-Profile-ID'], user_id=staff.pk).exists())
+
+    def test_only_the_newest_profiles_are_kept(self):
+        staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILE_DIR=directory, PROFILE_KEEP=2):
+            ids = [self._client(staff).get('/api/auth/profile/')['X-Profile-ID'] for _ in range(3)]
+            files = sorted(os.listdir(directory))
+        self.assertEqual(sorted(RequestProfile.objects.values_list('request_id', flat=True)), sorted(ids[1:]))
+        self.assertEqual(files, sorted(f'{request_id}.folded' for request_id in ids[1:]))
+
+
+class CheckBudgetsTests(SimpleTestCase):
+    def test_unexpected_statuses_are_violations_with_or_without_a_budget(self):
+        results = {
+            'fast GET': {'p95_ms': 1.0, 'queries': 1, 'bytes': 10, 'errors': 30},
+            'unbudgeted GET': {'p95_ms': 1.0, 'queries': 1, 'bytes': 10, 'errors': 2},
+            'ok GET': {'p95_ms': 1.0, 'queries': 3, 'bytes': 10, 'errors': 0},
+        }
+        budgets = {'fast GET': {'p95_ms': 10, 'queries': 5}, 'ok GET': {'queries': 2}}
+        self.assertEqual(check_budgets(results, budgets), [
+            'fast GET: 30 unexpected responses',
+            'unbudgeted GET: 2 unexpected responses',
+            'ok GET: queries 3 > budget 2',
+        ])
+
+
+class VectorIndexTests(TestCase):
+    def setUp(self):
+        agent = User.objects.create_user('embed', 'embed@example.com', 'pw', user_type='agent')
+        self.first = make_tour(agent, title='Alpine hiking')
+        self.late = make_tour(agent, title='Island snorkeling')
+        # Saving embeds synchronously: the late tour's row is written during the test
+        TourEmbedding.objects.filter(tour=self.late).delete()
+
+    def test_row_committed_after_a_later_stamped_one_is_loaded(self):
+        index = VectorIndex()
+        index.refresh()
+        loaded_until = index.loaded_until
+        # Stamped before the loaded row but committed after it (a longer transaction in another process)
+        embed_tours([self.late])
+        TourEmbedding.objects.filter(tour=self.late).update(updated_at=loaded_until - datetime.timedelta(seconds=1))
+        index.mark_stale()
+        index.refresh()
+        self.assertIn(self.late.id, index.positions)
+
+    def test_a_delete_and_an_insert_between_refreshes_drop_the_deleted_vector(self):
+        embed_tours([self.late])
+        index = VectorIndex()
+        index.refresh()
+        self.assertEqual(index.search('alpine hiking', k=1)[0][0], self.first.id)
+        first_id = self.first.id
+        self.first.delete()
+        replacement = make_tour(self.late.agent, title='City museums')
+        index.mark_stale()
+        index.refresh()
+        self.assertNotIn(first_id, index.positions)
+        self.assertIn(replacement.id, index.positions)
+        self.assertNotIn(first_id, [tour_id for tour_id, _ in index.search('alpine hiking', k=3)])
+        self.assertEqual(index.search('snorkeling island', k=1)[0][0], self.late.id)
+
+
+class SimilarToursRefreshTests(TestCase):
+    def setUp(self):
+        agent = User.objects.create_user('similar', 'similar@example.com', 'pw', user_type='agent')
+        beach = {'title': 'Island snorkeling', 'description': 'Reef and lagoon', 'meal_plan': 'all_inclusive'}
+        city = {'title': 'Museum walks', 'description': 'Historic art', 'meal_plan': 'breakfast', 'price': Decimal('4000.00')}
+        self.ubud = make_tour(agent, destination='Ubud, Indonesia', **beach)
+        self.kuta = make_tour(agent, destination='Kuta, Indonesia', **beach)
+        self.paris = make_tour(agent, destination='Paris, France', **city)
+        self.lyon = make_tour(agent, destination='Lyon, France', **city)
+        compute_similar_tours(k=1)
+        # The built lists are process state: later tests' saves must not start refreshes in the background
+        self.addCleanup(self.forget_lists)
+
+    @staticmethod
+    def forget_lists():
+        similarity._lists_built, similarity._lists_checked_at, similarity._catalog = False, None, None
+
+    def nearest(self, tour):
+        return SimilarTour.objects.filter(tour=tour).values_list('similar_id', flat=True).first()
+
+    def test_refresh_updates_affected_lists_and_drops_inactive_tours(self):
+        self.assertEqual(self.nearest(self.ubud), self.kuta.id)
+        self.kuta.is_active = False
+        self.kuta.save()
+        # Lyon turns into a beach tour: Ubud's list takes it in
+        self.lyon.title, self.lyon.description, self.lyon.destination = 'Island snorkeling', 'Reef and lagoon', 'Ubud, Indonesia'
+        self.lyon.meal_plan, self.lyon.price = 'all_inclusive', Decimal('1000.00')
+        self.lyon.save()
+        with CaptureQueriesContext(connection) as queries:
+            refresh_similar_tours([self.kuta.id, self.lyon.id], k=1)
+        # Only the changed tours are read back, not the whole catalog
+        self.assertFalse([query for query in queries if 'FROM "users_tour"' in query['sql'] and 'IN (' not in query['sql']])
+        self.assertFalse(SimilarTour.objects.filter(tour=self.kuta).exists())
+        self.assertFalse(SimilarTour.objects.filter(similar=self.kuta).exists())
+        self.assertEqual(self.nearest(self.ubud), self.lyon.id)
+        self.assertEqual(self.nearest(self.lyon), self.ubud.id)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_ended_threads_shards_are_retired_without_losing_counts(self):
+        before = metrics.snapshot().get('tourai_cache_requests_total', {}).get(('test', 'hit'), 0)
+        shards = len(metrics._shards)
+        threads = [threading.Thread(target=metrics.CACHE_REQUESTS.inc, args=('test', 'hit')) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(len(metrics._shards), shards)
+        self.assertEqual(metrics.snapshot()['tourai_cache_requests_total'][('test', 'hit')], before + 20)
+
+    def test_scrape_needs_the_token_or_a_local_client(self):
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(Client().get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 200)
+            self.assertEqual(Client().get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(Client().get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+            response = Client().get('/metrics', REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+
+class SyntheticDataTests(SimpleTestCase):
+    def tour_dates(self, **options):
+        generator = SyntheticDataGenerator(seed=7, **options)
+        return [generator._tour(index, 1, DESTINATIONS[0]).start_date for index in range(50)]
+
+    def test_tour_dates_follow_the_anchor_not_today(self):
+        with mock.patch('datetime.date', wraps=datetime.date) as date:
+            date.today.return_value = datetime.date(2031, 6, 1)
+            dates = self.tour_dates()
+        self.assertEqual(dates, self.tour_dates(anchor_date=ANCHOR_DATE))
+        self.assertTrue(all(ANCHOR_DATE + datetime.timedelta(days=7) <= day <= ANCHOR_DATE + datetime.timedelta(days=540)
+                            for day in dates))
+        shifted = self.tour_dates(anchor_date=ANCHOR_DATE + datetime.timedelta(days=10))
+        self.assertEqual(shifted, [day + datetime.timedelta(days=10) for day in dates])
+
+
+class TourImportTests(TestCase):
+    def setUp(self):
+        self.agent = User.objects.create_user('importer', 'importer@example.com', 'pw', user_type='agent')
+
+    def row(self, external_id, **fields):
+        return {
+            'external_id': external_id, 'title': 'Imported tour', 'description': 'From a catalog',
+            'destination': 'Bali', 'hotel_name': 'Hotel', 'price': '900.00', **fields,
+        }
+
+    def run_import(self, *rows, batch_size=10):
+        return TourImporter(self.agent, batch_size=batch_size).run(
+            (row_number, row, None) for row_number, row in enumerate(rows, start=2)
+        )
+
+    def test_reimport_updates_and_reactivates(self):
+        self.run_import(self.row('a'))
+        tour = Tour.objects.get(external_id='a')
+        tour.is_active = False
+        tour.save()
+        report = self.run_import(self.row('a', price='950.00'))
+        self.assertEqual(report.imported, 1)
+        tour = Tour.objects.get(external_id='a')
+        self.assertTrue(tour.is_active)
+        self.assertEqual(tour.price, Decimal('950.00'))
+        # Clients see it come back
+        self.assertEqual(TourChange.objects.filter(tour_id=tour.id).last().kind, 'created')
+
+    def test_a_read_error_keeps_the_rows_before_it_and_reports_where_it_stopped(self):
+        def rows():
+            yield 2, self.row('a'), None
+            yield 3, self.row('b'), None
+            raise UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte')
+
+        report = TourImporter(self.agent, batch_size=1).run(rows())
+        self.assertEqual((report.total, report.imported), (2, 2))
+        self.assertEqual(report.to_dict()['stopped']['after_row'], 3)
+        self.assertEqual(Tour.objects.filter(agent=self.agent).count(), 2)
+
+    def test_duplicate_keys_in_a_batch_are_row_errors(self):
+        report = self.run_import(self.row('a'), self.row('b'), self.row('a', title='Again'))
+        self.assertEqual((report.total, report.imported, report.failed), (3, 2, 1))
+        self.assertEqual(report.errors[0]['row'], 4)
+        self.assertEqual(Tour.objects.get(external_id='a').title, 'Imported tour')
+        # Across batches a repeated key is an update
+        report = self.run_import(self.row('c'), self.row('c'), batch_size=1)
+        self.assertEqual((report.imported, report.failed), (2, 0))
+
+    def test_a_refused_batch_is_reported_not_raised(self):
+        with mock.patch.object(Tour.objects, 'bulk_create', side_effect=IntegrityError('duplicate key')):
+            report = self.run_import(self.row('a'), self.row(None), self.row('b'), batch_size=2)
+        self.assertEqual((report.total, report.imported, report.failed), (3, 0, 3))
+        self.assertEqual([error['row'] for error in report.errors], [2, 3, 4])
+        self.assertFalse(Tour.objects.filter(agent=self.agent).exists())
+
+
+class ConnectionTimingMiddlewareTests(SimpleTestCase):
+    def test_only_connections_the_request_opens_are_timed(self):
+        def view(request):
+            connection = connections['default']
+            # As connect() leaves it, 5 ms after it started
+            with mock.patch.object(connection, 'connect_started_at', time.monotonic() - 0.005, create=True):
+                connection_created.send(sender=type(connection), connection=connection)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        response = ConnectionTimingMiddleware(view)(request)
+        alias, duration, description = response['Server-Timing'].split(';')
+        self.assertEqual((alias, description), ('db-connect', 'desc="default"'))
+        self.assertGreaterEqual(float(duration.removeprefix('dur=')), 5)
+        self.assertGreaterEqual(request.db_connect_ms, 5)
+
+        response = ConnectionTimingMiddleware(lambda request: HttpResponse())(RequestFactory().get('/'))
+        self.assertNotIn('Server-Timing', response)
+        # Outside a request nothing is collected
+        connection_created.send(sender=type(connections['default']), connection=connections['default'])
+
+    def test_connect_is_timed_whatever_the_conn_max_age(self):
+        for max_age in (0, None):
+            # A private connection of the same backend: the shared test database stays untouched
+            connection = type(connections['default'])(
+                {**connections['default'].settings_dict, 'NAME': ':memory:', 'CONN_MAX_AGE': max_age}, alias='timed'
+            )
+
+            def view(request):
+                connection.connect()
+                connection.close()
+                return HttpResponse()
+
+            with self.subTest(max_age=max_age):
+                request = RequestFactory().get('/')
+                response = ConnectionTimingMiddleware(view)(request)
+                self.assertIn('desc="timed"', response['Server-Timing'])
+                self.assertGreater(request.db_connect_ms, 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'], REPLICA_MAX_LAG=10, REPLICA_PIN_SECONDS=15)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        routers.start_request()
+        self.addCleanup(routers.start_request)
+        self.router = routers.ReplicaRouter()
+
+    def read_alias(self, model, lag=0.0):
+        with mock.patch('users.routers.replica_lag', return_value=lag), routers.read_from_replica():
+            return self.router.db_for_read(model)
+
+    def test_opted_in_reads_use_a_replica_unless_it_lags_or_is_down(self):
+        self.assertEqual(self.read_alias(Tour), 'replica_1')
+        self.assertIsNone(self.router.db_for_read(Tour))
+        self.assertIsNone(self.read_alias(Tour, lag=30.0))
+        self.assertIsNone(self.read_alias(Tour, lag=None))
+
+    def test_written_models_stay_on_the_primary_for_the_client(self):
+        def write(request):
+            self.router.db_for_write(SavedTour)
+            # Later reads of the written model in the same request
+            self.assertIsNone(self.read_alias(SavedTour))
+            self.assertEqual(self.read_alias(Tour), 'replica_1')
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(write)(RequestFactory().get('/'))
+        cookie = response.cookies[ReplicaRoutingMiddleware.cookie_name]
+        self.assertEqual((cookie.value, cookie['max-age']), ('users.savedtour', 15))
+
+        def read(request):
+            self.assertIsNone(self.read_alias(SavedTour))
+            self.assertEqual(self.read_alias(Tour), 'replica_1')
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES[ReplicaRoutingMiddleware.cookie_name] = cookie.value
+        response = ReplicaRoutingMiddleware(read)(request)
+        # A read-only request doesn't extend the pin
+        self.assertNotIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+        routers.start_request()
+        self.assertEqual(self.read_alias(SavedTour), 'replica_1')
+
+    def test_a_pinned_model_read_in_a_subquery_keeps_the_whole_query_on_the_primary(self):
+        def read_with_saves():
+            queryset = routers.using_pins(Tour.objects.all(), SavedTour)
+            with mock.patch('users.routers.replica_lag', return_value=0.0), routers.read_from_replica():
+                return queryset.db
+
+        self.assertEqual(read_with_saves(), 'replica_1')
+        routers.start_request(['users.savedtour'])
+        self.assertEqual(read_with_saves(), 'default')
+
+    def test_a_caught_up_replica_of_an_idle_primary_has_no_lag(self):
+        replica = mock.MagicMock(vendor='postgresql')
+        cursor = replica.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (0,)
+        routers._lag_cache.clear()
+        self.addCleanup(routers._lag_cache.clear)
+        with mock.patch('users.routers.connections', {'replica_1': replica}):
+            self.assertEqual(routers.replica_lag('replica_1'), 0.0)
+        self.assertIn('pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()', cursor.execute.call_args[0][0])
+
+
+class TourChangeLogTests(TestCase):
+    def setUp(self):
+        self.agent = User.objects.create_user('changes', 'changes@example.com', 'pw', user_type='agent')
+
+    def log(self, tour):
+        return [(entry.kind, entry.fields) for entry in TourChange.objects.filter(tour_id=tour.pk).order_by('seq')]
+
+    def test_saves_log_only_what_clients_see_change(self):
+        tour = make_tour(self.agent)
+        tour.title = 'Beach escape'
+        tour.save()
+        tour.title = 'Island escape'
+        tour.price = Decimal('1200.00')
+        tour.save()
+        tour = Tour.objects.get(pk=tour.pk)
+        tour.hotel_name = tour.hotel_name
+        tour.save()
+        log = self.log(tour)
+        self.assertEqual([kind for kind, _ in log], ['created', 'updated'])
+        self.assertEqual(log[0][1]['title'], 'Beach escape')
+        self.assertEqual(set(log[1][1]), {'title', 'price', 'price_usd'})
+
+    def test_deactivation_hides_edits_and_reactivation_recreates(self):
+        tour = make_tour(self.agent)
+        tour.is_active = False
+        tour.save()
+        tour.title = 'Hidden edit'
+        tour.save()
+        tour.is_active = True
+        tour.save()
+        tour_id = tour.pk
+        tour.delete()
+        log = [(kind, fields.get('title')) for kind, fields in self.log(Tour(pk=tour_id))]
+        self.assertEqual(log, [('created', 'Beach escape'), ('deactivated', None), ('created', 'Hidden edit'), ('deleted', None)])
+
+    def test_compaction_replays_to_the_same_state(self):
+        tour = make_tour(self.agent)
+        tour.title = 'Second title'
+        tour.save()
+        tour.price = Decimal('1500.00')
+        tour.save()
+        removed = changes.compact(before=timezone.now() + datetime.timedelta(seconds=1))
+        self.assertEqual(removed, 2)
+        [(kind, fields)] = self.log(tour)
+        self.assertEqual(kind, 'created')
+        self.assertEqual((fields['title'], fields['price']), ('Second title', '1500.00'))
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        self.agent = agent = User.objects.create_user('facets', 'facets@example.com', 'pw', user_type='agent')
+        make_tour(agent, meal_plan='all_inclusive')
+        make_tour(agent, meal_plan='half_board', price=Decimal('600.00'))
+        make_tour(agent, destination='Paris', meal_plan='all_inclusive', price=Decimal('2500.00'), visa_required=True)
+        make_tour(agent, meal_plan='all_inclusive', is_active=False)
+        self.index = FacetIndex()
+        self.labels = {tour.destination: tour.place.name for tour in Tour.objects.select_related('place')}
+
+    def counts(self, **params):
+        result = self.index.counts(parse_filters(params))
+        facets = result['facets']
+        return result['total'], {
+            'destination': {facet['value']: facet['count'] for facet in facets['destination']},
+            'meal_plan': {facet['value']: facet['count'] for facet in facets['meal_plan'] if facet['count']},
+            'visa_required': {facet['value']: facet['count'] for facet in facets['visa_required']},
+            'price': {facet['min']: facet['count'] for facet in facets['price'] if facet['count']},
+        }
+
+    def test_each_dimension_is_counted_with_the_other_filters(self):
+        bali, paris = self.labels['Bali'], self.labels['Paris']
+        total, facets = self.counts(meal_plan='all_inclusive')
+        self.assertEqual(total, 2)
+        # The selected dimension keeps its other options
+        self.assertEqual(facets['meal_plan'], {'all_inclusive': 2, 'half_board': 1})
+        self.assertEqual(facets['destination'], {bali: 1, paris: 1})
+        self.assertEqual(facets['price'], {1000: 1, 2000: 1})
+
+        total, facets = self.counts(meal_plan='all_inclusive', destination='Paris')
+        self.assertEqual(total, 1)
+        self.assertEqual(facets['meal_plan'], {'all_inclusive': 1})
+        self.assertEqual(facets['destination'], {bali: 1, paris: 1})
+        self.assertEqual(facets['visa_required'], {True: 1, False: 0})
+
+    def test_price_filter_and_ranges(self):
+        total, facets = self.counts(min_price='500', max_price='1000')
+        self.assertEqual(total, 2)
+        self.assertEqual(facets['price'], {500: 1, 1000: 1, 2000: 1})
+        self.assertEqual(sum(facets['meal_plan'].values()), 2)
+
+
+    def test_a_destination_that_is_no_known_place_matches_the_text_like_the_list(self):
+        # A legacy row never linked to a normalized destination
+        tour = make_tour(self.agent, destination='Atlantis')
+        Tour.objects.filter(pk=tour.pk).update(place=None)
+        Destination.objects.filter(name='Atlantis').delete()
+        Country.objects.filter(name='Atlantis').delete()
+        # Writes that bypass Tour.save() log themselves and tell this process's caches
+        TourChange.objects.create(tour_id=tour.pk, kind='updated')
+        catalog_changed()
+        listed = Client().get('/api/tours/', {'destination': 'atlantis'}).json()
+        self.assertEqual([listed_tour['id'] for listed_tour in listed['results']], [tour.id])
+        total, _ = self.counts(destination='atlantis')
+        self.assertEqual(total, 1)
+
+
+class DestinationIndexTests(TestCase):
+    def setUp(self):
+        agent = User.objects.create_user('places', 'places@example.com', 'pw', user_type='agent')
+        for destination in ('Nice, France', 'Paris, France', 'Cape Town, South Africa'):
+            make_tour(agent, destination=destination)
+        self.france = sorted(Destination.objects.filter(country__name='France').values_list('id', flat=True))
+
+    def test_autocomplete_ranks_places_by_tours(self):
+        suggestions = destination_index.autocomplete('fr')
+        self.assertEqual(suggestions[0], {'type': 'country', 'name': 'France', 'tours': 2})
+        names = [suggestion['name'] for suggestion in destination_index.autocomplete('ni')]
+        self.assertEqual(names, ['Nice, France'])
+        self.assertEqual(destination_index.autocomplete(''), [])
+
+    def test_one_word_names_must_read_as_places(self):
+        self.assertIsNone(destination_index.mentioned('a nice beach trip'))
+        self.assertEqual(destination_index.mentioned('A week in Nice')[0], 'Nice')
+        self.assertEqual(destination_index.mentioned('a trip to nice please')[0], 'Nice')
+        self.assertEqual(destination_index.mentioned('somewhere in france'), ('France', self.france))
+        # Longer names need no context
+        self.assertEqual(destination_index.mentioned('safari or south africa')[0], 'South Africa')
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        agent = User.objects.create_user('ranking', 'ranking@example.com', 'pw', user_type='agent')
+        self.both = make_tour(agent, meal_plan='all_inclusive')
+        self.bali = make_tour(agent, meal_plan='half_board')
+        self.paris = make_tour(agent, destination='Paris', meal_plan='all_inclusive')
+        self.inactive = make_tour(agent, meal_plan='all_inclusive', is_active=False)
+        self.conditions = [('by_destination', Q(destination='Bali')), ('by_meal_plan', Q(meal_plan='all_inclusive'))]
+
+    def test_tours_matching_more_searches_rank_first_then_by_fused_rank(self):
+        with collect_candidates() as candidates:
+            candidate_ids('by_destination', Tour.objects.filter(destination='Bali').order_by('-meal_plan'), self.conditions[0][1])
+            record_candidates('by_meal_plan', [self.paris.id, self.both.id], self.conditions[1][1])
+        # The Bali pool is half_board first, yet the tour matching both searches wins;
+        # the one-match tours follow by their pool positions, the inactive one scoring as found
+        self.assertEqual(candidates.ranked(), [self.both.id, self.bali.id, self.paris.id, self.inactive.id])
+        self.assertEqual(candidates.sources()[self.both.id], 'by_destination')
+
+    def test_matched_counts_only_annotates_the_candidates(self):
+        conditions = self.conditions + [('by_destination', Q(destination='Paris'))]
+        with CaptureQueriesContext(connection) as queries:
+            counts = matched_counts(conditions, [self.both.id, self.paris.id, self.inactive.id])
+        # Two calls of one tool count once; tours outside the pools are never read
+        self.assertEqual(counts, {self.both.id: 2, self.paris.id: 2})
+        self.assertEqual(len(queries), 1)
+        self.assertIn(' IN (', queries[0]['sql'])
+        self.assertEqual(matched_counts(conditions, []), {})
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        agent = User.objects.create_user('dates', 'dates@example.com', 'pw', user_type='agent')
+        date = datetime.date
+        self.tours = {
+            'early june': make_tour(agent, start_date=date(2030, 6, 1), end_date=date(2030, 6, 8)),
+            'mid june': make_tour(agent, start_date=date(2030, 6, 10), end_date=date(2030, 6, 20)),
+            'all year': make_tour(agent, start_date=date(2030, 1, 1), end_date=date(2030, 12, 31)),
+            'may': make_tour(agent, start_date=date(2030, 5, 20), end_date=date(2030, 5, 31)),
+        }
+
+    def available(self, **params):
+        ids = set(Tour.objects.filter(is_active=True).filter(period_condition(parse_period(params))).values_list('id', flat=True))
+        return {name for name, tour in self.tours.items() if tour.id in ids}
+
+    def test_tours_overlapping_the_window_are_available(self):
+        self.assertEqual(self.available(date_from='2030-06-05', date_to='2030-06-12'), {'early june', 'mid june', 'all year'})
+        self.assertEqual(self.available(date_from='2030-06-09', date_to='2030-06-09'), {'all year'})
+        self.assertEqual(self.available(date_from='2030-06-09', date_to='2030-06-09', flex_days='1'),
+                         {'early june', 'mid june', 'all year'})
+        self.assertEqual(self.available(date_from='2030-06-21'), {'all year'})
+        self.assertEqual(self.available(month='2030-05', min_nights='8'), {'may', 'all year'})
+        self.assertEqual(self.available(month='2030-06', nights='7'), {'early june'})
+
+    def test_period_parameters(self):
+        self.assertEqual(month_window('March', today=datetime.date(2030, 4, 15)),
+                         (datetime.date(2031, 3, 1), datetime.date(2031, 3, 31)))
+        self.assertEqual(month_window('march 2030'), (datetime.date(2030, 3, 1), datetime.date(2030, 3, 31)))
+        self.assertIsNone(month_window('2030-13'))
+        period = parse_period({'month': '2030-02', 'date_to': '2030-02-10', 'flex_days': '99', 'nights': 'x'})
+        self.assertEqual(period, {'travel_from': datetime.date(2030, 1, 1), 'travel_to': datetime.date(2030, 3, 13)})
+
+    def test_dates_at_the_edges_of_the_calendar_are_ignored(self):
+        edges = {'date_from': '0001-01-01', 'date_to': '9999-12-31', 'flex_days': '3'}
+        self.assertEqual(parse_period(edges), {})
+        self.assertEqual(parse_period({'date_from': '0002-01-01', 'date_to': '0002-01-05', 'flex_days': '3'})['travel_from'],
+                         datetime.date(1, 12, 29))
+        self.assertEqual(self.available(date_from='0002-01-01', date_to='9998-12-31', flex_days='31'), set(self.tours))
+        for path in ('/api/tours/', '/api/tours/facets/'):
+            self.assertEqual(Client().get(path, edges).status_code, 200)
+
+
+class CurrencyBoundTests(TestCase):
+    def setUp(self):
+        rates = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        rates.close()
+        self.rates_file = rates.name
+        self.addCleanup(os.unlink, rates.name)
+        self.write_rates({'USD': 1, 'EUR': 0.9, 'JPY': 150})
+        overridden = override_settings(FX_RATES_FILE=rates.name)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.agent = User.objects.create_user('fx', 'fx@example.com', 'pw', user_type='agent')
+
+    def write_rates(self, rates):
+        with open(self.rates_file, 'w') as f:
+            json.dump({'base': 'USD', 'rates': rates}, f)
+        # A rewrite within the same clock tick still has to look new to fx_table()
+        os.utime(self.rates_file, ns=(time.time_ns(), time.time_ns() + len(rates)))
+
+    def in_range(self, tour, low, high, currency):
+        in_list = Tour.objects.filter(
+            pk=tour.pk, price_usd__gte=base_bound(low, currency), price_usd__lte=base_bound(high, currency),
+        ).exists()
+        # The facet counts apply the same bounds in memory
+        total = FacetIndex().counts(parse_filters({'min_price': str(low), 'max_price': str(high)}, currency))['total']
+        self.assertEqual(total, int(in_list))
+        return in_list
+
+    def test_dollar_prices_are_rounded_to_cents(self):
+        self.assertEqual(to_base(Decimal('90'), 'EUR'), Decimal('100.00'))
+        self.assertEqual(to_base(Decimal('15000'), 'JPY'), Decimal('100.00'))
+        self.assertEqual(to_base(Decimal('33.33'), 'EUR'), Decimal('37.03'))
+        with self.assertRaises(ValueError):
+            to_base(Decimal('1'), 'XXX')
+
+    def test_a_price_exactly_at_a_bound_is_included(self):
+        tour = make_tour(self.agent, price=Decimal('33.33'), currency='EUR')
+        self.assertEqual(tour.price_usd, Decimal('37.03'))
+        self.assertTrue(self.in_range(tour, 33.33, 33.33, 'EUR'))
+        self.assertTrue(self.in_range(tour, 5000, 5555, 'JPY'))
+        self.assertFalse(self.in_range(tour, 33.34, 40, 'EUR'))
+        self.assertFalse(self.in_range(tour, 30, 33.32, 'EUR'))
+        self.assertFalse(self.in_range(tour, 5556, 6000, 'JPY'))
+        with self.assertRaises(ValueError):
+            base_bound(float('inf'), 'EUR')
+
+    def test_display(self):
+        self.assertEqual(supported(' eur '), 'EUR')
+        self.assertIsNone(supported('GBP'))
+        self.assertEqual(round_price(1234.5, 'JPY'), 1234)
+        self.assertEqual(format_price(Decimal('1234.5'), 'EUR'), '€1,234.50')
+
+    def test_a_currency_that_lost_its_rate_is_shown_from_its_dollar_price(self):
+        tour = make_tour(self.agent, price=Decimal('90'), currency='EUR')
+        self.write_rates({'USD': 1, 'JPY': 150})
+        listed = Client().get('/api/tours/', {'currency': 'JPY'}).json()['results']
+        self.assertEqual((listed[0]['display_price'], listed[0]['display_currency']), (15000, 'JPY'))
+        traveller = User.objects.create_user('fx-traveller', 'fx-traveller@example.com', 'pw')
+        detail = api_client(traveller).get(f'/api/tours/{tour.id}/').json()
+        self.assertEqual((detail['display_price'], detail['display_currency']), (100.0, 'USD'))
+
+    def test_refreshing_prices_rewrites_only_the_changed_ones(self):
+        tours = [make_tour(self.agent, price=price, currency='EUR') for price in (Decimal('0.45'), Decimal('33.33'))]
+        make_tour(self.agent, price=Decimal('5'), currency='JPY')
+        # Unchanged rates: the dollar prices Tour.save() stored are current
+        self.assertEqual(refresh_base_prices(), (0, []))
+        self.write_rates({'USD': 1, 'EUR': 0.5})
+        logged = TourChange.objects.count()
+        self.assertEqual(refresh_base_prices(), (2, ['JPY']))
+        self.assertEqual(TourChange.objects.count(), logged + 2)
+        self.assertEqual([Tour.objects.get(pk=tour.pk).price_usd for tour in tours], [Decimal('0.90'), Decimal('66.66')])
+        self.assertEqual(refresh_base_prices(), (0, ['JPY']))
+
+
+class SavedToursBulkTests(UserCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        agent = User.objects.create_user('bulk-agent', 'bulk-agent@example.com', 'pw', user_type='agent')
+        self.user = User.objects.create_user('saver', 'saver@example.com', 'pw')
+        self.tours = [make_tour(agent, title=f'Tour {i}') for i in range(3)]
+        self.inactive = make_tour(agent, is_active=False)
+        self.client = api_client(self.user)
+
+    def bulk(self, method, tour_ids):
+        return getattr(self.client, method)(
+            '/api/saved-tours/bulk/', {'tour_ids': tour_ids}, content_type='application/json'
+        ).json()
+
+    def test_bulk_save_skips_saved_and_inactive_tours_and_bulk_unsave_counts_removals(self):
+        first, second, third = (tour.id for tour in self.tours)
+        self.assertEqual(self.bulk('post', [first, second])['saved'], [first, second])
+        response = self.bulk('post', [second, third, self.inactive.id])
+        self.assertEqual((response['saved'], response['skipped']), ([third], [second, self.inactive.id]))
+        self.assertEqual(self.bulk('delete', [first, third, self.inactive.id])['removed'], 2)
+        self.assertEqual(list(SavedTour.objects.filter(user=self.user).values_list('tour_id', flat=True)), [second])
+
+    def test_saved_ids_checks_up_to_100_tours(self):
+        SavedTour.objects.save_tours(self.user.id, [self.tours[0].id, self.tours[2].id])
+        response = self.client.get('/api/saved-tours/ids/', {'tour_ids': f'{self.tours[0].id},{self.tours[1].id}'})
+        self.assertEqual(response.json()['saved_tour_ids'], [self.tours[0].id])
+        self.assertEqual(sorted(self.client.get('/api/saved-tours/ids/').json()['saved_tour_ids']), [self.tours[0].id, self.tours[2].id])
+
+        too_many = ','.join(str(tour_id) for tour_id in range(1, 102))
+        self.assertEqual(self.client.get('/api/saved-tours/ids/', {'tour_ids': too_many}).status_code, 400)
+        self.assertEqual(self.client.get('/api/saved-tours/ids/', {'tour_ids': '1,x'}).status_code, 400)
+
+
+class AffinityTests(UserCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        agent = User.objects.create_user('affinity-agent', 'affinity-agent@example.com', 'pw', user_type='agent')
+        self.user = User.objects.create_user('traveller', 'traveller@example.com', 'pw')
+        self.ubud = make_tour(agent, destination='Ubud, Indonesia', meal_plan='all_inclusive')
+        self.paris = make_tour(agent, destination='Paris, France', meal_plan='half_board', price=Decimal('3000.00'))
+
+    def save(self, *tours):
+        for tour in tours:
+            SavedTour.objects.create(user=self.user, tour=tour)
+        return record_interactions(self.user.id, [tour.id for tour in tours])
+
+    def test_saving_and_unsaving_add_and_subtract_the_same_features(self):
+        self.save(self.ubud)
+        affinity = self.save(self.paris)
+        self.assertAlmostEqual(affinity.features['country:Indonesia'], SAVED_WEIGHT, places=4)
+        self.assertAlmostEqual(affinity.features['country:France'], SAVED_WEIGHT, places=4)
+        self.assertAlmostEqual(affinity.weight, 2 * SAVED_WEIGHT, places=4)
+
+        affinity = forget_saved_tours(self.user.id, SavedTour.objects.unsave_tours(self.user.id, [self.paris.id]))
+        self.assertNotIn('country:France', affinity.features)
+        self.assertNotIn('meal_plan:half_board', affinity.features)
+        self.assertAlmostEqual(affinity.weight, SAVED_WEIGHT, places=4)
+
+        # The incremental vector matches a rebuild from the saved tours
+        rebuild_affinities([self.user.id])
+        rebuilt = UserAffinity.objects.get(user=self.user)
+        self.assertEqual(set(rebuilt.features), set(affinity.features))
+        self.assertAlmostEqual(rebuilt.price_log_sum, affinity.price_log_sum, places=3)
+
+        affinity = forget_saved_tours(self.user.id, SavedTour.objects.unsave_tours(self.user.id, [self.ubud.id]))
+        self.assertEqual((affinity.features, affinity.weight, affinity.price_log_sum), ({}, 0.0, 0.0))
+
+    def test_a_repeated_unsave_subtracts_nothing(self):
+        self.save(self.ubud, self.paris)
+        client = api_client(self.user)
+        self.assertEqual(client.delete(f'/api/saved-tours/{self.paris.id}/').status_code, 204)
+        self.assertEqual(client.delete(f'/api/saved-tours/{self.paris.id}/').status_code, 404)
+        self.assertEqual(SavedTour.objects.unsave_tours(self.user.id, [self.paris.id]), [])
+        self.assertIsNone(forget_saved_tours(self.user.id, []))
+        self.assertAlmostEqual(UserAffinity.objects.get(user=self.user).weight, SAVED_WEIGHT, places=4)
+
+    def test_first_interaction_losing_the_insert_race_updates_the_winners_row(self):
+        self.save(self.ubud)
+        # The row didn't exist when this request looked, but a concurrent first save has inserted it since
+        with mock.patch('django.db.models.query.QuerySet.first', return_value=None):
+            affinity = record_interactions(self.user.id, [self.paris.id])
+        self.assertAlmostEqual(affinity.weight, 2 * SAVED_WEIGHT, places=4)
+        self.assertEqual(UserAffinity.objects.get(user=self.user).weight, affinity.weight)
+
+    def test_older_interest_decays(self):
+        self.save(self.ubud)
+        UserAffinity.objects.filter(user=self.user).update(
+            updated_at=timezone.now() - datetime.timedelta(days=settings.AFFINITY_HALF_LIFE_DAYS)
+        )
+        affinity = self.save(self.paris)
+        self.assertAlmostEqual(affinity.features['country:Indonesia'], SAVED_WEIGHT / 2, places=3)
+        self.assertAlmostEqual(affinity.features['country:France'], SAVED_WEIGHT, places=4)
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.agent = User.objects.create_user('stats', 'stats@example.com', 'pw', user_type='agent')
+        self.tour = make_tour(self.agent)
+        self.other = make_tour(self.agent, title='City break')
+        self.today = timezone.localdate()
+
+    def stats(self, tour, day):
+        return TourDailyStats.objects.values_list('views', 'saves', 'recommendations').get(tour=tour, day=day)
+
+    def test_rollup_adds_queued_events_per_tour_and_day_and_drains_the_queue(self):
+        analytics.record_events('view', [self.tour.id, self.tour.id, self.other.id])
+        analytics.record_events('save', [self.tour.id])
+        TourEvent.objects.create(tour=self.tour, kind='view', occurred_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(analytics.rollup(batch_size=2), 5)
+        self.assertFalse(TourEvent.objects.exists())
+        self.assertEqual(self.stats(self.tour, self.today), (2, 1, 0))
+        self.assertEqual(self.stats(self.tour, self.today - datetime.timedelta(days=1)), (1, 0, 0))
+        self.assertEqual(self.stats(self.other, self.today), (1, 0, 0))
+
+        # A later rollup adds to the day's row
+        analytics.record_events('view', [self.tour.id])
+        self.assertEqual(analytics.rollup(), 1)
+        self.assertEqual(self.stats(self.tour, self.today), (3, 1, 0))
+
+    def test_backfill_replaces_saves_and_keeps_views(self):
+        TourDailyStats.objects.create(tour=self.tour, agent=self.agent, day=self.today, views=4, saves=5)
+        traveller = User.objects.create_user('saver', 'saver@example.com', 'pw')
+        SavedTour.objects.create(user=traveller, tour=self.tour)
+        analytics.record_events('save', [self.tour.id])
+        self.assertEqual(analytics.backfill(), 1)
+        self.assertEqual(self.stats(self.tour, self.today), (4, 1, 0))
+        # The queued save is already part of the history
+        self.assertFalse(TourEvent.objects.exists())
+
+    def test_dashboard_zero_fills_the_series_and_ranks_tours(self):
+        day = datetime.timedelta(days=1)
+        TourDailyStats.objects.create(tour=self.tour, agent=self.agent, day=self.today, views=4, saves=1)
+        TourDailyStats.objects.create(tour=self.other, agent=self.agent, day=self.today - 2 * day, views=2)
+        TourDailyStats.objects.create(tour=self.other, agent=self.agent, day=self.today - 3 * day, views=50)
+        result = analytics.dashboard(self.agent.id, days=3, today=self.today)
+        self.assertEqual([point['views'] for point in result['series']], [2, 0, 4])
+        self.assertEqual(result['series'][0]['date'], (self.today - 2 * day).isoformat())
+        self.assertEqual(result['totals'], {'views': 6, 'saves': 1, 'recommendations': 0, 'save_rate': round(1 / 6, 4)})
+        self.assertEqual([(tour['id'], tour['save_rate']) for tour in result['tours']], [(self.tour.id, 0.25), (self.other.id, 0.0)])
+        self.assertEqual(analytics.dashboard(self.agent.id, days=3, tour_id=self.other.id, today=self.today)['totals']['views'], 2)
+
+
+# No background flusher: the tests flush the buffer themselves
+@mock.patch.object(impressions, 'start_flusher')
+class ImpressionTests(TestCase):
+    def setUp(self):
+        impressions._buffer.clear()
+        self.addCleanup(impressions._buffer.clear)
+
+    def logged(self):
+        return list(RecommendationImpression.objects.order_by('id').values_list('tour_id', 'rank', 'tool'))
+
+    def test_recorded_impressions_are_written_in_batches_on_flush(self, start_flusher):
+        impressions.record([7, 8, 9], {7: 'search_tours_by_keyword'})
+        impressions.record([3], 'search_tours_by_destination')
+        self.assertFalse(RecommendationImpression.objects.exists())
+        with override_settings(IMPRESSIONS_BATCH_SIZE=3), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(impressions.flush(), 4)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 2)
+        self.assertEqual(self.logged(), [
+            (7, 0, 'search_tours_by_keyword'), (8, 1, impressions.RANKING_TOOL), (9, 2, impressions.RANKING_TOOL),
+            (3, 0, 'search_tours_by_destination'),
+        ])
+        self.assertEqual(impressions.flush(), 0)
+
+    @override_settings(IMPRESSIONS_BUFFER_SIZE=3)
+    def test_failed_writes_are_retried_and_the_oldest_dropped_past_the_bound(self, start_flusher):
+        impressions.record([1, 2], 'search')
+        with mock.patch.object(impressions, '_write', side_effect=DatabaseError('unreachable')), self.assertLogs('users.impressions', 'ERROR'):
+            self.assertEqual(impressions.flush(), 0)
+        impressions.record([3, 4], 'search')
+        self.assertEqual(impressions.flush(), 3)
+        self.assertEqual([tour_id for tour_id, _, _ in self.logged()], [2, 3, 4])
@@ -0,0 +1,36 @@
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import CLAIM_FIELDS, get_cached_user
+
+
+def set_user_claims(token, user):
+    """Embed the claims ClaimsJWTAuthentication answers permission checks from"""
+    for field in CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+
+
+class TourAIRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the user's type, company and preferred currency"""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        set_user_claims(token, user)
+        return token
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """Re-read the user's claims on refresh so changes reach newly issued access tokens"""
+    token_class = TourAIRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = get_cached_user(refresh.payload.get(api_settings.USER_ID_CLAIM))
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        set_user_claims(refresh, user)
+        return super().validate({**attrs, 'refresh': str(refresh)})
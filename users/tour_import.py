@@ -0,0 +1,249 @@
+"""
+Bulk tour import.
+
+Rows are streamed from CSV or JSON Lines, validated one at a time with the same rules as
+``TourCreateSerializer`` and written in batches with ``bulk_create``. Rows carrying an
+``external_id`` are upserted on (agent, external_id), so re-importing a catalog updates it in
+place and brings back tours of it that had been taken down. A key may appear only once per batch;
+repeats are rejected as row errors. A batch the database refuses (e.g. a concurrent import of
+the same keys) fails as a whole and is reported row by row. Memory use depends on the batch
+size, not the file size: rows are never all held at once and per-row errors are handed to a
+callback instead of being collected.
+
+Batches commit as they are written. If the file can't be read to the end (bad encoding, broken
+CSV quoting) the rows read before the fault are still written and the report's ``stopped`` says
+after which row reading stopped, so the rest can be fixed and imported again.
+"""
+import csv
+import io
+import json
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .catalog import catalog_changed
+from .currency import to_base
+from .embeddings import embed_stale_tours
+from .models import Destination, Tour, TourChange
+from .serializers import TourImportSerializer
+from .similarity import lists_built, schedule_refresh
+
+IMPORT_FIELDS = TourImportSerializer.Meta.fields
+# is_active too: a re-imported tour is on offer again
+UPDATE_FIELDS = [field for field in IMPORT_FIELDS if field != 'external_id'] + [
+    'is_active', 'place', 'duration_nights', 'price_usd', 'updated_at'
+]
+# Faults that end reading a file part way through
+READ_ERRORS = (UnicodeDecodeError, csv.Error)
+
+
+def detect_format(filename):
+    """Guess the import format from a file name"""
+    name = (filename or '').lower()
+    if name.endswith('.jsonl') or name.endswith('.ndjson') or name.endswith('.json'):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(stream, fmt='csv'):
+    """
+    Yield ``(row_number, row, error)`` from a text stream, one row at a time.
+
+    ``row`` is a dict of raw values; ``error`` is set instead when a line can't be parsed.
+    """
+    if fmt == 'jsonl':
+        for row_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield row_number, None, {'non_field_errors': [f'Invalid JSON: {e}']}
+                continue
+            if not isinstance(row, dict):
+                yield row_number, None, {'non_field_errors': ['Each line must be a JSON object']}
+                continue
+            yield row_number, row, None
+    elif fmt == 'csv':
+        # Row numbers count the header as line 1, matching what spreadsheets show
+        for row_number, row in enumerate(csv.DictReader(stream), start=2):
+            yield row_number, row, None
+    else:
+        raise ValueError(f"Unsupported import format '{fmt}'")
+
+
+def open_text(binary_stream, encoding='utf-8-sig'):
+    """Wrap an uploaded (binary) file for line-by-line text reading"""
+    return io.TextIOWrapper(binary_stream, encoding=encoding, newline='')
+
+
+class ImportReport:
+    """Outcome of an import run"""
+
+    def __init__(self, max_errors=100):
+        self.total = 0
+        self.imported = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        self.errors = []
+        self.max_errors = max_errors
+        # {'after_row': n, 'error': message} when the file couldn't be read past row n
+        self.stopped = None
+
+    @property
+    def rows_per_sec(self):
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, row_number, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def to_dict(self):
+        return {
+            'total_rows': self.total,
+            'imported': self.imported,
+            'failed': self.failed,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_sec': round(self.rows_per_sec, 1),
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'stopped': self.stopped,
+        }
+
+
+class TourImporter:
+    """
+    Validate and write tours for one agent in batches.
+
+    ``on_error(row_number, errors)`` is called for every rejected row, e.g. to stream an
+    error report to a file.
+    """
+
+    def __init__(self, agent, batch_size=500, on_error=None, max_errors=100):
+        self.agent = agent
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.max_errors = max_errors
+        # One serializer instance is reused for every row; building its fields is the expensive part
+        self.serializer = TourImportSerializer()
+
+    def run(self, rows):
+        """Import ``(row_number, row, error)`` tuples as produced by ``read_rows``"""
+        report = ImportReport(max_errors=self.max_errors)
+        start = time.perf_counter()
+        started_at = timezone.now()
+        batch = []
+        # Row number of each external_id in the batch
+        batch_keys = {}
+        row_number = 0
+
+        try:
+            for row_number, row, error in rows:
+                report.total += 1
+                if error is None:
+                    tour, error = self.validate_row(row)
+                if error is None and tour.external_id in batch_keys:
+                    error = {'external_id': [
+                        f"Duplicate external_id '{tour.external_id}' (first seen on row {batch_keys[tour.external_id]})"
+                    ]}
+                if error is not None:
+                    self.reject(report, row_number, error)
+                    continue
+
+                batch.append((row_number, tour))
+                if tour.external_id:
+                    batch_keys[tour.external_id] = row_number
+                if len(batch) >= self.batch_size:
+                    self.flush(report, batch)
+                    batch = []
+                    batch_keys = {}
+        except READ_ERRORS as e:
+            # Earlier batches are committed already; write the rows read so far too and say where reading stopped
+            report.stopped = {'after_row': row_number, 'error': f'{type(e).__name__}: {e}'}
+
+        if batch:
+            self.flush(report, batch)
+
+        # bulk_create bypasses the post_save signals that keep embeddings and similar tours current
+        if report.imported:
+            catalog_changed()
+            tours = Tour.objects.filter(agent=self.agent)
+            embed_stale_tours(tours)
+            if settings.SIMILAR_TOURS_REFRESH_ON_SAVE and lists_built():
+                schedule_refresh(list(tours.filter(updated_at__gte=started_at).values_list('id', flat=True)))
+
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def reject(self, report, row_number, errors):
+        report.add_error(row_number, errors)
+        if self.on_error:
+            self.on_error(row_number, errors)
+
+    def flush(self, report, batch):
+        """Write ``(row_number, tour)`` pairs; if the database rejects the batch, all its rows fail"""
+        try:
+            report.imported += self.write_batch([tour for _, tour in batch])
+        except IntegrityError as e:
+            errors = {'non_field_errors': [f'Batch not written: {e}']}
+            for row_number, _ in batch:
+                self.reject(report, row_number, errors)
+
+    def validate_row(self, row):
+        # Blank cells mean "use the default", as they would if the column were missing
+        data = {key: value for key, value in row.items() if key in IMPORT_FIELDS and value not in ('', None)}
+        try:
+            validated = dict(self.serializer.run_validation(data))
+        except serializers.ValidationError as e:
+            return None, serializers.as_serializer_error(e)
+        validated['external_id'] = validated.get('external_id') or None
+        return Tour(agent=self.agent, is_active=True, **validated), None
+
+    def write_batch(self, tours):
+        """Insert a batch; tours with an external_id replace the agent's existing tour with that key"""
+        # bulk_create skips Tour.save(), which links the normalized destination, counts the nights and
+        # converts the price to dollars
+        place_ids = Destination.objects.resolve(tour.destination for tour in tours)
+        for tour in tours:
+            tour.place_id = place_ids.get(tour.destination)
+            tour.duration_nights = Tour.nights_between(tour.start_date, tour.end_date)
+            tour.price_usd = to_base(tour.price, tour.currency)
+        keyed = {}
+        unkeyed = []
+        for tour in tours:
+            if tour.external_id:
+                # run() rejects keys repeated within a batch; called directly, the last occurrence wins
+                keyed[tour.external_id] = tour
+            else:
+                unkeyed.append(tour)
+
+        # It skips the change log too: log the batch against the tours it replaces, in its transaction
+        existing = {
+            row['external_id']: row
+            for row in Tour.objects.filter(agent=self.agent, external_id__in=list(keyed)).values(
+                'id', 'external_id', 'is_active', *TourChange.TRACKED_FIELDS
+            )
+        } if keyed else {}
+        with transaction.atomic():
+            if keyed:
+                Tour.objects.bulk_create(
+                    keyed.values(),
+                    batch_size=self.batch_size,
+                    update_conflicts=True,
+                    unique_fields=['agent', 'external_id'],
+                    update_fields=UPDATE_FIELDS,
+                )
+                # Upserts don't return primary keys
+                ids = dict(Tour.objects.filter(agent=self.agent, external_id__in=list(keyed)).values_list('external_id', 'id'))
+                for external_id, tour in keyed.items():
+                    tour.pk = ids[external_id]
+            if unkeyed:
+                Tour.objects.bulk_create(unkeyed, batch_size=self.batch_size)
+            changes = [TourChange.objects.entry(tour, existing.get(tour.external_id)) for tour in [*keyed.values(), *unkeyed]]
+            TourChange.objects.bulk_create([change for change in changes if change], batch_size=self.batch_size)
+        return len(keyed) + len(unkeyed)
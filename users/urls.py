@@ -7,12 +7,18 @@ urlpatterns = [
     path('auth/signin/', views.sign_in, name='sign_in'),
     path('auth/profile/', views.user_profile, name='user_profile'),
     path('agent/dashboard/', views.agent_dashboard_access, name='agent_dashboard'),
+    path('agent/analytics/', views.agent_analytics, name='agent_analytics'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     
     # Tour endpoints
     path('tours/', views.TourListCreateView.as_view(), name='tour_list_create'),
     path('tours/<int:pk>/', views.TourDetailView.as_view(), name='tour_detail'),
     path('tours/destinations/', views.get_unique_destinations, name='get_unique_destinations'),
+    path('tours/destinations/autocomplete/', views.destination_autocomplete, name='destination_autocomplete'),
+    path('tours/similar/', views.get_similar_tours, name='get_similar_tours'),
+    path('tours/facets/', views.tour_facets, name='tour_facets'),
+    path('tours/changes/', views.tour_changes, name='tour_changes'),
+    path('tours/import/', views.import_tours, name='import_tours'),
     
     # Chat endpoints
     path('chat/', views.chat_with_ai, name='chat_with_ai'),
@@ -22,6 +28,8 @@ urlpatterns = [
     
     # Saved tours endpoints
     path('saved-tours/', views.saved_tours_list, name='saved_tours_list'),
+    path('saved-tours/bulk/', views.saved_tours_bulk, name='saved_tours_bulk'),
+    path('saved-tours/ids/', views.saved_tour_ids, name='saved_tour_ids'),
     path('saved-tours/<int:tour_id>/', views.unsave_tour, name='unsave_tour'),
     
     # Tour companies endpoint
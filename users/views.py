@@ -1,12 +1,16 @@
+from django.db import transaction
 from rest_framework import status, generics
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
-from rest_framework_simplejwt.tokens import RefreshToken
-from .serializers import SignInSerializer, UserSerializer, TourSerializer, TourCreateSerializer, ConversationSerializer, ConversationListSerializer, ChatMessageSerializer, SavedTourSerializer
+from .serializers import SignInSerializer, UserSerializer, UserTokenSerializer, TourSerializer, TourCreateSerializer, ConversationSerializer, ConversationListSerializer, ChatMessageSerializer, SavedTourSerializer, SavedTourBulkSerializer
 from .models import Tour, Conversation, ChatMessage, SavedTour
-from .chat_service import TourRecommendationService
+from .chat_service import get_recommendation_service
+from .personalization import RECOMMENDED_WEIGHT, forget_saved_tours, personalize, record_interactions
+from .analytics import record_events
+from .routers import read_from_replica, replica_reads, using_pins
+from .tokens import TourAIRefreshToken
 
 
 @api_view(['POST'])
@@ -80,6 +84,16 @@ def user_registration(request):
                 'success': False
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        # Handle date_of_birth if provided
+        date_of_birth_obj = None
+        if date_of_birth:
+            try:
+                from datetime import datetime
+                date_of_birth_obj = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
+            except ValueError:
+                # Invalid date format - just skip it
+                pass
+        
         # Create user
         user = User.objects.create_user(
             username=username,
@@ -93,23 +107,14 @@ def user_registration(request):
             city=city,
             country=country,
             postal_code=postal_code,
+            date_of_birth=date_of_birth_obj,
             bio=bio,
             newsletter_subscription=newsletter_subscription
         )
         
-        # Handle date_of_birth if provided
-        if date_of_birth:
-            try:
-                from datetime import datetime
-                user.date_of_birth = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
-                user.save()
-            except ValueError:
-                # Invalid date format - just skip it
-                pass
-        
         # Generate tokens
-        refresh = RefreshToken.for_user(user)
-        user_data = UserSerializer(user).data
+        refresh = TourAIRefreshToken.for_user(user)
+        user_data = UserTokenSerializer(user).data
         
         return Response({
             'message': 'User registered successfully',
@@ -129,11 +134,11 @@ def user_registration(request):
 
 @api_view(['POST'])
 def sign_in(request):
-    serializer = SignInSerializer(data=request.data)
+    serializer = SignInSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
         user = serializer.validated_data['user']
-        refresh = RefreshToken.for_user(user)
-        user_data = UserSerializer(user).data
+        refresh = TourAIRefreshToken.for_user(user)
+        user_data = UserTokenSerializer(user).data
         
         return Response({
             'refresh': str(refresh),
@@ -162,6 +167,37 @@ def agent_dashboard_access(request):
     }, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@replica_reads
+def agent_analytics(request):
+    """
+    Views, saves and chat recommendations of the agent's tours per day over the last ?days= (default 30),
+    with totals and the most viewed tours; ?tour_id= narrows it to one tour. Counts lag by one rollup run.
+    """
+    from .analytics import dashboard
+    
+    user = request.user
+    if user.user_type != 'agent':
+        return Response(
+            {'error': 'Access denied. Only tour agents can access the dashboard.'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        days = min(max(int(request.query_params.get('days', 30)), 1), 366)
+        tour_id = int(request.query_params['tour_id']) if request.query_params.get('tour_id') else None
+    except ValueError:
+        return Response({
+            'error': 'days and tour_id must be integers',
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    result = dashboard(user.id, days=days, tour_id=tour_id)
+    result['success'] = True
+    return Response(result, status=status.HTTP_200_OK)
+
+
 @api_view(['GET', 'PUT'])
 @permission_classes([IsAuthenticated])
 def user_profile(request):
@@ -277,6 +313,11 @@ class TourListCreateView(generics.ListCreateAPIView):
             return TourCreateSerializer
         return TourSerializer
     
+    def list(self, request, *args, **kwargs):
+        # Public catalog reads can be served by a replica
+        with read_from_replica():
+            return super().list(request, *args, **kwargs)
+    
     def get_queryset(self):
         user = self.request.user
         print(f"DEBUG: get_queryset called for user: {user} (authenticated: {user.is_authenticated}, type: {getattr(user, 'user_type', 'anonymous')})")
@@ -288,8 +329,6 @@ class TourListCreateView(generics.ListCreateAPIView):
         # Apply search and filters
         search = self.request.query_params.get('search', '').strip()
         destination = self.request.query_params.get('destination', '').strip()
-        date_from = self.request.query_params.get('date_from', '').strip()
-        date_to = self.request.query_params.get('date_to', '').strip()
         min_price = self.request.query_params.get('min_price', '').strip()
         max_price = self.request.query_params.get('max_price', '').strip()
         visa_required = self.request.query_params.get('visa_required', '').strip()
@@ -309,42 +348,37 @@ class TourListCreateView(generics.ListCreateAPIView):
             )
             print(f"DEBUG: After search filter: {queryset.count()} tours")
         
-        # Filter by destination
+        # Filter by destination: a known place (destination, city, country, region or continent) is an indexed
+        # lookup on the normalized destination; anything else falls back to matching the text
         if destination:
-            queryset = queryset.filter(destination__iexact=destination)
+            from .destinations import destination_condition
+            queryset = queryset.filter(destination_condition(destination))
             print(f"DEBUG: After destination filter: {queryset.count()} tours")
         
-        # Filter by date range
-        if date_from:
-            try:
-                from datetime import datetime
-                date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
-                queryset = queryset.filter(start_date__gte=date_from_obj)
-            except ValueError:
-                pass  # Invalid date format, ignore filter
+        # Filter by travel period: tours whose dates overlap date_from..date_to (or ?month=), widened by
+        # ?flex_days=, and trip length (?nights= or ?min_nights=/?max_nights=); invalid values are ignored
+        from .availability import parse_period, period_condition
+        period = parse_period(self.request.query_params)
+        if period:
+            queryset = queryset.filter(period_condition(period))
         
-        if date_to:
-            try:
-                from datetime import datetime
-                date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
-                queryset = queryset.filter(end_date__lte=date_to_obj)
-            except ValueError:
-                pass  # Invalid date format, ignore filter
-        
-        # Filter by price range
+        # Filter by price range, given in the display currency (?currency=, else the user's preferred one):
+        # the bounds are converted to dollars and matched against the indexed price_usd
+        from .currency import base_bound, display_currency
+        currency = display_currency(self.request)
         if min_price:
             try:
-                min_price_decimal = float(min_price)
-                queryset = queryset.filter(price__gte=min_price_decimal)
-                print(f"DEBUG: After min_price filter: {queryset.count()} tours")
+                min_price_usd = base_bound(float(min_price), currency)
+                queryset = queryset.filter(price_usd__gte=min_price_usd)
+                print(f"DEBUG: min_price filter: price_usd >= {min_price_usd} ({min_price} {currency})")
             except ValueError:
                 pass  # Invalid price format, ignore filter
         
         if max_price:
             try:
-                max_price_decimal = float(max_price)
-                queryset = queryset.filter(price__lte=max_price_decimal)
-                print(f"DEBUG: After max_price filter: {queryset.count()} tours")
+                max_price_usd = base_bound(float(max_price), currency)
+                queryset = queryset.filter(price_usd__lte=max_price_usd)
+                print(f"DEBUG: max_price filter: price_usd <= {max_price_usd} ({max_price} {currency})")
             except ValueError:
                 pass  # Invalid price format, ignore filter
         
@@ -363,7 +397,20 @@ class TourListCreateView(generics.ListCreateAPIView):
             queryset = queryset.filter(flight_type=flight_type)
             print(f"DEBUG: After flight_type filter: {queryset.count()} tours")
         
+        # Flag the tours this user has saved, in the same query; from the primary while their own
+        # saves may not have reached the replicas
+        if user.is_authenticated:
+            from django.db.models import Exists, OuterRef
+            queryset = using_pins(queryset.annotate(
+                is_saved=Exists(SavedTour.objects.filter(user_id=user.id, tour_id=OuterRef('pk')))
+            ), SavedTour)
+        
         final_queryset = queryset.order_by('-created_at')
+        
+        # Opt-in: re-rank the newest matches by what this user saves and is recommended
+        if self.request.query_params.get('ordering') == 'personalized' and user.is_authenticated:
+            final_queryset = personalize(final_queryset, user.id)
+        
         print(f"DEBUG: Final queryset count (after all filters): {final_queryset.count()} tours")
         return final_queryset
     
@@ -384,14 +431,35 @@ class TourDetailView(generics.RetrieveUpdateDestroyAPIView):
         user = self.request.user
         if user.user_type == 'agent':
             # Agents can access their own tours (including inactive for editing)
-            return Tour.objects.filter(agent=user)
+            return Tour.objects.filter(agent_id=user.id)
         else:
             # Regular users can view all active tours
             return Tour.objects.filter(is_active=True)
     
+    def retrieve(self, request, *args, **kwargs):
+        from .similarity import similar_tours_for
+        
+        response = super().retrieve(request, *args, **kwargs)
+        # Precomputed neighbour list: one indexed query, no per-request scoring
+        response.data['similar_tours'] = [
+            {
+                'id': entry.similar.id,
+                'title': entry.similar.title,
+                'destination': entry.similar.destination,
+                'price': str(entry.similar.price),
+                'currency': entry.similar.currency,
+                'score': entry.score,
+            }
+            for entry in similar_tours_for(response.data['id'])
+        ]
+        # Agents opening their own tours aren't views
+        if response.data['agent']['id'] != request.user.id:
+            record_events('view', [response.data['id']])
+        return response
+    
     def perform_update(self, serializer):
         # Only the tour's agent can update it
-        if self.get_object().agent != self.request.user:
+        if self.get_object().agent_id != self.request.user.id:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only update your own tours.")
         
@@ -399,7 +467,7 @@ class TourDetailView(generics.RetrieveUpdateDestroyAPIView):
     
     def perform_destroy(self, instance):
         # Only the tour's agent can delete it
-        if instance.agent != self.request.user:
+        if instance.agent_id != self.request.user.id:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("You can only delete your own tours.")
         
@@ -408,8 +476,50 @@ class TourDetailView(generics.RetrieveUpdateDestroyAPIView):
         instance.save()
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, AgentTourPermission])
+def import_tours(request):
+    """
+    Bulk import tours from an uploaded CSV or JSON Lines file ("file" field).
+    Rows with an external_id update the agent's existing tour with that id.
+    """
+    from .tour_import import TourImporter, detect_format, open_text, read_rows
+    
+    upload = request.FILES.get('file')
+    if not upload:
+        return Response({
+            'error': 'A CSV or JSON Lines file is required',
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    fmt = request.data.get('format') or detect_format(upload.name)
+    if fmt not in ('csv', 'jsonl'):
+        return Response({
+            'error': "format must be 'csv' or 'jsonl'",
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    importer = TourImporter(request.user, batch_size=1000)
+    report = importer.run(read_rows(open_text(upload.file), fmt))
+    
+    if report.stopped:
+        # The rows before the fault are imported: say how far the file got so the rest can be fixed and resent
+        return Response({
+            **report.to_dict(),
+            'error': f"The file could not be read past row {report.stopped['after_row']} (it must be UTF-8 encoded "
+                     f"{fmt.upper()}); the rows up to there were imported",
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        **report.to_dict(),
+        'success': report.failed == 0
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@replica_reads
 def get_tour_companies(request):
     """
     Get all tour companies with their agent and tour information
@@ -486,6 +596,7 @@ def get_tour_companies(request):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@replica_reads
 def get_company_tours(request, company_id):
     """
     Get all tours for a specific company
@@ -544,6 +655,7 @@ def get_company_tours(request, company_id):
                 'destination': tour.destination,
                 'hotel_name': tour.hotel_name,
                 'price': float(tour.price),
+                'currency': tour.currency,
                 'formatted_price': tour.formatted_price,
                 'start_date': tour.start_date.strftime('%Y-%m-%d'),
                 'end_date': tour.end_date.strftime('%Y-%m-%d'),
@@ -570,13 +682,15 @@ def get_company_tours(request, company_id):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@replica_reads
 def get_unique_destinations(request):
     """
     Get all unique tour destinations for filter dropdown
     """
+    from .destinations import index
+    
     try:
-        destinations = Tour.objects.filter(is_active=True).values_list('destination', flat=True).distinct().order_by('destination')
-        destinations_list = [dest for dest in destinations if dest and dest.strip()]
+        destinations_list = index.available()
         
         return Response({
             'destinations': destinations_list,
@@ -592,13 +706,124 @@ def get_unique_destinations(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@replica_reads
+def destination_autocomplete(request):
+    """
+    Destinations, cities, countries, regions and continents starting with ?q=, most tours first
+    """
+    from .destinations import index
+    
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+    except ValueError:
+        return Response({
+            'error': 'limit must be an integer',
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    suggestions = index.autocomplete(request.query_params.get('q', ''), limit)
+    return Response({
+        'suggestions': suggestions,
+        'count': len(suggestions),
+        'success': True
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@replica_reads
+def tour_changes(request):
+    """
+    Tour changes after ?since=<seq>, oldest first, up to ?limit= per page. Without since, only the
+    cursor to start from: read it, then fetch the tour list, then poll with since=<next>.
+    """
+    from . import changes
+    
+    if 'since' not in request.query_params:
+        return Response({'changes': [], 'next': changes.cursor(), 'has_more': False, 'success': True})
+    try:
+        since = max(int(request.query_params['since']), 0)
+        limit = min(max(int(request.query_params.get('limit', changes.DEFAULT_LIMIT)), 1), changes.MAX_LIMIT)
+    except ValueError:
+        return Response({
+            'error': 'since and limit must be integers',
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    entries, has_more = changes.changes_since(since, limit)
+    return Response({
+        'changes': [changes.as_json(entry) for entry in entries],
+        'next': entries[-1].seq if entries else since,
+        'has_more': has_more,
+        'success': True
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@replica_reads
+def get_similar_tours(request):
+    """
+    Semantic tour search: tours most similar to free text (?q=) or to another tour (?tour_id=)
+    """
+    from .embeddings import similar_tours
+    
+    query = request.query_params.get('q', '').strip()
+    tour_id = request.query_params.get('tour_id', '').strip()
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        tour_id = int(tour_id) if tour_id else None
+    except ValueError:
+        return Response({
+            'error': 'limit and tour_id must be integers',
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if not query and tour_id is None:
+        return Response({
+            'error': 'Either q or tour_id is required',
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    matches = similar_tours(
+        query=query, tour_id=tour_id, k=limit, queryset=Tour.objects.select_related('agent__tour_company')
+    )
+    tours_data = TourSerializer([tour for tour, _ in matches], many=True).data
+    for tour_data, (_, similarity) in zip(tours_data, matches):
+        tour_data['similarity'] = round(similarity, 4)
+    
+    return Response({
+        'tours': tours_data,
+        'count': len(tours_data),
+        'success': True
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@replica_reads
+def tour_facets(request):
+    """
+    Counts per filter value for the Discover filters, given the same query parameters as the tour list
+    (prices in the same display currency)
+    """
+    from .currency import display_currency
+    from .facets import index, parse_filters
+    
+    result = index.counts(parse_filters(request.query_params, display_currency(request)))
+    result['success'] = True
+    return Response(result, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def conversation_list(request):
     """
     Get user's conversation history
     """
-    conversations = Conversation.objects.filter(user=request.user, is_active=True)
+    conversations = Conversation.objects.filter(user_id=request.user.id, is_active=True)
     serializer = ConversationListSerializer(conversations, many=True)
     return Response(serializer.data)
 
@@ -610,13 +835,15 @@ def conversation_detail(request, conversation_id):
     Get or delete a specific conversation
     """
     try:
-        conversation = Conversation.objects.get(id=conversation_id, user=request.user)
+        with read_from_replica():
+            conversation = Conversation.objects.get(id=conversation_id, user_id=request.user.id)
     except Conversation.DoesNotExist:
         return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
     
     if request.method == 'GET':
-        serializer = ConversationSerializer(conversation)
-        return Response(serializer.data)
+        with read_from_replica():
+            serializer = ConversationSerializer(conversation)
+            return Response(serializer.data)
     
     elif request.method == 'DELETE':
         conversation.delete()
@@ -625,6 +852,7 @@ def conversation_detail(request, conversation_id):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def message_recommended_tours(request, message_id):
     """
     Get recommended tours for a specific chat message
@@ -633,7 +861,7 @@ def message_recommended_tours(request, message_id):
         # Get the chat message and verify it belongs to the user's conversation
         message = ChatMessage.objects.select_related('conversation').prefetch_related('recommended_tours').get(
             id=message_id,
-            conversation__user=request.user
+            conversation__user_id=request.user.id
         )
         
         # Get the recommended tours for this message
@@ -649,6 +877,7 @@ def message_recommended_tours(request, message_id):
                 'destination': tour.destination,
                 'hotel_name': tour.hotel_name,
                 'price': float(tour.price),
+                'currency': tour.currency,
                 'formatted_price': tour.formatted_price,
                 'start_date': tour.start_date.isoformat(),
                 'end_date': tour.end_date.isoformat(),
@@ -688,8 +917,8 @@ def chat_with_ai(request):
         }, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        # Initialize the recommendation service
-        recommendation_service = TourRecommendationService()
+        # Shared recommendation service (LLM client and agent are built once per process)
+        recommendation_service = get_recommendation_service()
         
         # Handle conversation context for authenticated users
         conversation = None
@@ -698,9 +927,11 @@ def chat_with_ai(request):
         if request.user.is_authenticated:
             if conversation_id:
                 try:
-                    conversation = Conversation.objects.get(id=conversation_id, user=request.user)
-                    # Get recent messages for context (last 10 messages) with recommended tours
-                    recent_messages = conversation.messages.prefetch_related('recommended_tours').all()[:10]
+                    # History reads can go to a replica; messages this client just wrote stay pinned to the primary
+                    with read_from_replica():
+                        conversation = Conversation.objects.get(id=conversation_id, user_id=request.user.id)
+                        # Get recent messages for context (last 10 messages) with recommended tours
+                        recent_messages = list(conversation.messages.prefetch_related('recommended_tours').all()[:10])
                     chat_history = []
                     
                     for msg in recent_messages:
@@ -715,7 +946,7 @@ def chat_with_ai(request):
             
             # Create new conversation if none exists
             if not conversation:
-                conversation = Conversation.objects.create(user=request.user)
+                conversation = Conversation.objects.create(user_id=request.user.id)
             
             # Save user message
             user_chat_message = ChatMessage.objects.create(
@@ -731,6 +962,8 @@ def chat_with_ai(request):
                 print(f"  {i+1}. {msg[:100]}...")
         
         result = recommendation_service.recommend_tours(user_message, chat_history=chat_history, conversation=conversation)
+        if result['recommended_tours']:
+            record_events('recommendation', [tour['id'] for tour in result['recommended_tours']])
         
         # Save AI response and recommended tours for authenticated users
         ai_message = None
@@ -746,6 +979,7 @@ def chat_with_ai(request):
                 tour_ids = [tour['id'] for tour in result['recommended_tours']]
                 tours = Tour.objects.filter(id__in=tour_ids)
                 ai_message.recommended_tours.set(tours)
+                record_interactions(request.user.id, tour_ids, RECOMMENDED_WEIGHT)
             
             # Update conversation title if it's the first exchange
             if not conversation.title and conversation.messages.count() >= 2:
@@ -780,37 +1014,124 @@ def saved_tours_list(request):
     List user's saved tours or save a new tour
     """
     if request.method == 'GET':
-        saved_tours = SavedTour.objects.filter(user=request.user).select_related('tour', 'tour__agent')
+        saved_tours = SavedTour.objects.filter(user_id=request.user.id).select_related('tour', 'tour__agent')
         serializer = SavedTourSerializer(saved_tours, many=True)
         return Response(serializer.data)
     
     elif request.method == 'POST':
         serializer = SavedTourSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            try:
-                serializer.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            except Exception as e:
-                # Handle duplicate save attempts
-                if 'unique_together' in str(e).lower():
+            tour_id = serializer.validated_data['tour_id']
+            created = SavedTour.objects.save_tours(request.user.id, [tour_id])
+            if not created:
+                if not Tour.objects.filter(id=tour_id, is_active=True).exists():
                     return Response({
-                        'error': 'Tour is already saved'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                raise e
+                        'error': 'Tour not found'
+                    }, status=status.HTTP_404_NOT_FOUND)
+                return Response({
+                    'error': 'Tour is already saved'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # save_tours writes with raw SQL, so there is no signal to hook
+            record_interactions(request.user.id, [tour_id])
+            record_events('save', [tour_id])
+            saved_tour = SavedTour.objects.select_related('tour', 'tour__agent').get(id=created[0][0])
+            return Response(SavedTourSerializer(saved_tour).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def saved_tours_bulk(request):
+    """
+    Save (POST) or unsave (DELETE) several tours at once: {"tour_ids": [1, 2, 3]}
+    """
+    serializer = SavedTourBulkSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    tour_ids = serializer.validated_data['tour_ids']
+    
+    if request.method == 'POST':
+        created = SavedTour.objects.save_tours(request.user.id, tour_ids)
+        saved_ids = [tour_id for _, tour_id in created]
+        if saved_ids:
+            record_interactions(request.user.id, saved_ids)
+            record_events('save', saved_ids)
+        return Response({
+            'saved': saved_ids,
+            # Already saved, or not an active tour
+            'skipped': [tour_id for tour_id in dict.fromkeys(tour_ids) if tour_id not in saved_ids],
+            'success': True
+        }, status=status.HTTP_200_OK)
+    
+    elif request.method == 'DELETE':
+        with transaction.atomic():
+            removed = SavedTour.objects.unsave_tours(request.user.id, tour_ids)
+            forget_saved_tours(request.user.id, removed)
+        return Response({
+            'removed': len(removed),
+            'success': True
+        }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def saved_tour_ids(request):
+    """
+    Which tours the user has saved: ?tour_ids=1,2,3 checks a page of tours, no parameter returns all saved IDs
+    """
+    saved = SavedTour.objects.filter(user_id=request.user.id)
+    
+    tour_ids_param = request.query_params.get('tour_ids', '').strip()
+    if tour_ids_param:
+        try:
+            tour_ids = [int(tour_id) for tour_id in tour_ids_param.split(',') if tour_id.strip()]
+        except ValueError:
+            return Response({
+                'error': 'tour_ids must be a comma-separated list of integers'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(tour_ids) > SavedTourBulkSerializer.MAX_TOUR_IDS:
+            return Response({
+                'error': f'At most {SavedTourBulkSerializer.MAX_TOUR_IDS} tour_ids can be checked at once'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        saved = saved.filter(tour_id__in=tour_ids)
+    
+    return Response({
+        'saved_tour_ids': list(saved.values_list('tour_id', flat=True))
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def unsave_tour(request, tour_id):
     """
     Remove a tour from user's saved tours
     """
-    try:
-        saved_tour = SavedTour.objects.get(user=request.user, tour_id=tour_id)
-        saved_tour.delete()
+    with transaction.atomic():
+        removed = SavedTour.objects.unsave_tours(request.user.id, [tour_id])
+        forget_saved_tours(request.user.id, removed)
+    if removed:
         return Response({'success': True}, status=status.HTTP_204_NO_CONTENT)
-    except SavedTour.DoesNotExist:
-        return Response({
-            'error': 'Tour not found in saved tours'
-        }, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        'error': 'Tour not found in saved tours'
+    }, status=status.HTTP_404_NOT_FOUND)
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint (plain Django view: no DRF authentication or throttling overhead)
+    """
+    from django.conf import settings
+    from django.http import HttpResponse, HttpResponseForbidden
+    from . import metrics as app_metrics
+    
+    import hmac
+    token = settings.METRICS_TOKEN
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponseForbidden()
+    elif request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        # Without a token only local scrapers (e.g. a Prometheus agent on the host) get in
+        return HttpResponseForbidden()
+    return HttpResponse(app_metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')